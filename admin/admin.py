@@ -1,23 +1,26 @@
 from django.contrib import admin
-from .models import ShapefileLayer
+from .models import ShapefileIngestJob, ShapefileLayer, ShapefileUpload
 
 
 @admin.register(ShapefileLayer)
 class ShapefileLayerAdmin(admin.ModelAdmin):
-    list_display = ['name', 'geometry_type', 'feature_count', 'uploaded_by', 'is_active', 'created_at']
-    list_filter = ['geometry_type', 'is_active', 'created_at']
+    list_display = ['name', 'geometry_type', 'feature_count', 'ingest_status', 'uploaded_by', 'is_active', 'created_at']
+    list_filter = ['geometry_type', 'is_active', 'boundary_role', 'created_at']
     search_fields = ['name', 'description']
-    readonly_fields = ['feature_count', 'bounds', 'geojson_data', 'created_at', 'updated_at']
+    readonly_fields = ['feature_count', 'bounds', 'geojson_data', 'ingest_status', 'ingest_error', 'created_at', 'updated_at']
     
     fieldsets = (
         ('Basic Information', {
             'fields': ('name', 'description', 'is_active')
         }),
+        ('Boundaries', {
+            'fields': ('boundary_role', 'boundary_name_field')
+        }),
         ('Files', {
             'fields': ('shapefile', 'shx_file', 'dbf_file', 'prj_file')
         }),
         ('Metadata', {
-            'fields': ('geometry_type', 'feature_count', 'srid', 'bounds'),
+            'fields': ('geometry_type', 'feature_count', 'srid', 'bounds', 'ingest_status', 'ingest_error'),
             'classes': ('collapse',)
         }),
         ('Tracking', {
@@ -25,3 +28,21 @@ class ShapefileLayerAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    def get_queryset(self, request):
+        # geojson_data is never shown and can be very large
+        return super().get_queryset(request).defer('geojson_data')
+
+
+@admin.register(ShapefileIngestJob)
+class ShapefileIngestJobAdmin(admin.ModelAdmin):
+    list_display = ['layer', 'status', 'created_at', 'started_at', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = ['layer', 'status', 'error', 'created_at', 'started_at', 'finished_at']
+
+
+@admin.register(ShapefileUpload)
+class ShapefileUploadAdmin(admin.ModelAdmin):
+    list_display = ['filename', 'name', 'status', 'received', 'size', 'uploaded_by', 'created_at']
+    list_filter = ['status']
+    readonly_fields = ['received', 'status', 'error', 'layer', 'created_at', 'updated_at']
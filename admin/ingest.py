@@ -0,0 +1,227 @@
+"""
+Background ingestion of uploaded shapefiles.
+
+Uploads only store the files. ``enqueue_ingest`` records a
+ShapefileIngestJob and, once the transaction commits, hands it to a small
+thread pool (SHAPEFILE_INGEST_WORKERS). The worker reads the .shp/.shx/.dbf/.prj
+with GDAL, reprojects every feature to EPSG:4326, stores the features as
+ShapefileFeature rows with simplified levels of detail (``admin.lod``) and
+fills in the layer's ``feature_count``, ``bounds`` and ``geometry_type``.
+
+Jobs live in the database, so anything left pending (e.g. by a restart) can
+be picked up with ``manage.py process_ingest_jobs``.
+"""
+import datetime
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.gis.gdal import DataSource, SpatialReference
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .lod import build_lods
+from .models import ShapefileFeature, ShapefileIngestJob, ShapefileLayer
+
+
+# Layer file fields and the extension GDAL expects for each
+SHAPEFILE_PARTS = [
+    ('shapefile', '.shp'),
+    ('shx_file', '.shx'),
+    ('dbf_file', '.dbf'),
+    ('prj_file', '.prj'),
+]
+
+GEOMETRY_TYPE_NAMES = {name for name, _ in ShapefileLayer.GEOMETRY_TYPES}
+
+# Feature rows inserted per query while ingesting
+FEATURE_BATCH_SIZE = 1000
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SHAPEFILE_INGEST_WORKERS,
+                thread_name_prefix='shapefile-ingest',
+            )
+    return _executor
+
+
+def enqueue_ingest(layer):
+    """
+    Queue ``layer`` for ingestion and return the job. The job starts after the
+    current transaction commits; with SHAPEFILE_INGEST_WORKERS = 0 it runs
+    in the calling thread at that point instead.
+    """
+    job = ShapefileIngestJob.objects.create(layer=layer)
+    layer.ingest_status = 'pending'
+    layer.ingest_error = ''
+    layer.save(update_fields=['ingest_status', 'ingest_error'])
+
+    if settings.SHAPEFILE_INGEST_WORKERS > 0:
+        transaction.on_commit(lambda: _get_executor().submit(_run_in_thread, job.pk))
+    else:
+        transaction.on_commit(lambda: process_job(job.pk))
+    return job
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        process_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def process_job(job_id):
+    """
+    Run a pending job. Returns False if another worker already claimed it.
+    """
+    claimed = ShapefileIngestJob.objects.filter(pk=job_id, status='pending').update(
+        status='running', started_at=timezone.now()
+    )
+    if not claimed:
+        return False
+
+    job = ShapefileIngestJob.objects.select_related('layer').get(pk=job_id)
+    layer = job.layer
+    ShapefileLayer.objects.filter(pk=layer.pk).update(ingest_status='running')
+
+    try:
+        ingest_layer(layer)
+    except Exception as e:
+        _finish(job, 'failed', str(e) or e.__class__.__name__)
+        return True
+
+    _finish(job, 'completed')
+    return True
+
+
+def _finish(job, status, error=''):
+    job.status = status
+    job.error = error
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    ShapefileLayer.objects.filter(pk=job.layer_id).update(ingest_status=status, ingest_error=error)
+
+
+def process_pending_jobs():
+    """Run every pending job in this process; returns the number run"""
+    count = 0
+    for job_id in ShapefileIngestJob.objects.filter(status='pending').values_list('pk', flat=True):
+        if process_job(job_id):
+            count += 1
+    return count
+
+
+# --- Reading shapefiles ---------------------------------------------------
+
+def ingest_layer(layer):
+    """
+    Replace ``layer``'s feature rows with the contents of its uploaded files
+    and update its metadata, all in one transaction.
+    """
+    geometry_types = set()
+    min_x = min_y = float('inf')
+    max_x = max_y = float('-inf')
+    count = 0
+
+    with transaction.atomic(), shapefile_features(layer) as features:
+        layer.features.all().delete()
+        batch = []
+        for fid, geometry, properties in features:
+            x0, y0, x1, y1 = geometry.extent
+            min_x, min_y = min(min_x, x0), min(min_y, y0)
+            max_x, max_y = max(max_x, x1), max(max_y, y1)
+            geometry_types.add(geometry.geom_type)
+
+            batch.append(ShapefileFeature(
+                layer=layer, fid=fid, geometry=geometry, properties=properties
+            ))
+            count += 1
+            if len(batch) >= FEATURE_BATCH_SIZE:
+                ShapefileFeature.objects.bulk_create(batch)
+                batch = []
+        ShapefileFeature.objects.bulk_create(batch)
+
+        layer.feature_count = count
+        layer.bounds = [min_x, min_y, max_x, max_y] if count else None
+        layer.srid = 4326
+        geometry_type = _layer_geometry_type(geometry_types)
+        if geometry_type:
+            layer.geometry_type = geometry_type
+        layer.save(update_fields=['feature_count', 'bounds', 'srid', 'geometry_type', 'updated_at'])
+
+        build_lods(layer)
+
+
+@contextmanager
+def shapefile_features(layer):
+    """
+    Yield an iterator of ``(fid, GEOSGeometry in EPSG:4326, properties)`` for
+    ``layer``'s uploaded files.
+    """
+    if not layer.shapefile:
+        raise ValueError('Layer has no .shp file')
+
+    # Uploaded parts may have been renamed by storage (e.g. roads_x1Yz.dbf);
+    # GDAL needs them side by side under one basename
+    workdir = tempfile.mkdtemp(prefix='shapefile-')
+    try:
+        for field_name, extension in SHAPEFILE_PARTS:
+            field = getattr(layer, field_name)
+            if not field:
+                continue
+            with field.open('rb') as src, open(Path(workdir) / f'layer{extension}', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        yield read_datasource(Path(workdir) / 'layer.shp', layer.srid or 4326)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def read_datasource(path, default_srid=4326):
+    """Yield ``(fid, geometry, properties)`` for each feature of a shapefile"""
+    source = DataSource(str(path))
+    ogr_layer = source[0]
+    # Without a .prj, fall back to the SRID recorded on the layer
+    source_srs = ogr_layer.srs or SpatialReference(default_srid)
+    field_names = ogr_layer.fields
+
+    for feature in ogr_layer:
+        geometry = feature.geom
+        if geometry.srs is None:
+            geometry.srs = source_srs
+        geometry.transform(4326)
+        properties = {name: _json_value(feature.get(name)) for name in field_names}
+        yield feature.fid, geometry.geos, properties
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.date, datetime.time, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _layer_geometry_type(geometry_types):
+    """Pick one geometry type for the layer; shapefiles mix X and MultiX freely"""
+    geometry_types = {name.replace('25D', '') for name in geometry_types}
+    if not geometry_types:
+        return ''
+    if len(geometry_types) == 1:
+        (geometry_type,) = geometry_types
+    else:
+        multi = {name if name.startswith('Multi') else f'Multi{name}' for name in geometry_types}
+        if len(multi) != 1:
+            return ''
+        (geometry_type,) = multi
+    return geometry_type if geometry_type in GEOMETRY_TYPE_NAMES else ''
@@ -0,0 +1,97 @@
+"""
+Levels of detail for shapefile layer geometries.
+
+Ingestion stores each feature at full resolution plus simplified copies
+(``geometry_lod1`` .. ``geometry_lod3``) at increasing tolerances. Polygon
+layers are simplified as a coverage when shapely/GEOS support it, so shared
+borders between neighbouring districts stay shared; everything else uses
+topology-preserving simplification feature by feature. Point layers have
+nothing to simplify and keep only the full geometry.
+
+Endpoints pick a level from a ``zoom`` (XYZ tile zoom) or ``tolerance``
+(degrees) parameter with ``level_for_zoom`` / ``level_for_tolerance``.
+"""
+import shapely
+from django.contrib.gis.geos import GEOSGeometry
+
+from .models import ShapefileFeature
+
+
+# (level, tolerance in degrees, GeoJSON coordinate precision); level 0 is the
+# original geometry. 0.0005 degrees is roughly 55 m at the equator.
+LOD_LEVELS = [
+    (0, 0.0, 8),
+    (1, 0.0005, 6),
+    (2, 0.005, 5),
+    (3, 0.05, 4),
+]
+
+# Features whose simplified geometries are written per query
+LOD_BATCH_SIZE = 500
+
+
+def geometry_column(level):
+    """Name of the ShapefileFeature field holding ``level``"""
+    return 'geometry' if level == 0 else f'geometry_lod{level}'
+
+
+def precision(level):
+    return LOD_LEVELS[level][2]
+
+
+def level_for_tolerance(tolerance):
+    """Return the coarsest level whose tolerance does not exceed ``tolerance``"""
+    chosen = 0
+    for level, level_tolerance, _ in LOD_LEVELS:
+        if level_tolerance <= tolerance:
+            chosen = level
+    return chosen
+
+
+def level_for_zoom(zoom, tile_size=256):
+    """Return the level to draw at an XYZ zoom: simplify up to one pixel"""
+    return level_for_tolerance(360 / (tile_size * 2 ** zoom))
+
+
+def simplify(geometries, tolerance):
+    """
+    Simplify a list of shapely geometries at ``tolerance``, as a coverage when
+    they are all polygons.
+    """
+    if all(shapely.get_type_id(g) in (3, 6) for g in geometries):
+        try:
+            simplified = shapely.coverage_simplify(geometries, tolerance)
+            if shapely.is_valid(simplified).all():
+                return list(simplified)
+        except (AttributeError, TypeError, shapely.errors.GEOSException):
+            # Older shapely/GEOS, or polygons that do not form a coverage
+            pass
+    return list(shapely.simplify(geometries, tolerance, preserve_topology=True))
+
+
+def build_lods(layer):
+    """Compute and store the simplified geometries of every feature in ``layer``"""
+    features = list(layer.features.only('id', 'geometry').order_by('id'))
+    if not features:
+        return
+    # Points and multipoints have no vertices to drop
+    if all(feature.geometry.geom_type in ('Point', 'MultiPoint') for feature in features):
+        return
+
+    geometries = shapely.from_wkb([bytes(feature.geometry.wkb) for feature in features])
+    fields = []
+    for level, tolerance, _ in LOD_LEVELS[1:]:
+        field = geometry_column(level)
+        fields.append(field)
+        for feature, simplified in zip(features, simplify(geometries, tolerance)):
+            # A feature that simplifies away is drawn at full resolution
+            value = None if shapely.is_empty(simplified) else simplified
+            setattr(feature, field, _to_geos(value))
+
+    ShapefileFeature.objects.bulk_update(features, fields, batch_size=LOD_BATCH_SIZE)
+
+
+def _to_geos(geometry):
+    if geometry is None:
+        return None
+    return GEOSGeometry(memoryview(shapely.to_wkb(geometry)), srid=4326)
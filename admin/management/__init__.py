@@ -0,0 +1 @@
+# Shapefile admin management commands
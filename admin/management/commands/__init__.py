@@ -0,0 +1 @@
+# Shapefile ingestion commands
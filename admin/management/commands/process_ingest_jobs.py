@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from admin.ingest import process_pending_jobs
+from admin.models import ShapefileIngestJob
+
+
+class Command(BaseCommand):
+    help = 'Ingest uploaded shapefiles that are waiting in the job table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--watch',
+            type=float,
+            default=0,
+            help='Keep polling for new jobs every N seconds'
+        )
+        parser.add_argument(
+            '--requeue-running',
+            action='store_true',
+            help='Requeue jobs left running by a worker that stopped'
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue_running']:
+            requeued = ShapefileIngestJob.objects.filter(status='running').update(
+                status='pending', started_at=None
+            )
+            self.stdout.write(f'Requeued {requeued} running jobs')
+
+        while True:
+            count = process_pending_jobs()
+            if count:
+                self.stdout.write(self.style.SUCCESS(
+                    f'[{timezone.now():%H:%M:%S}] Processed {count} ingest jobs'
+                ))
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
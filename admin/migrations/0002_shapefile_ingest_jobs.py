@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gis_admin', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shapefilelayer',
+            name='ingest_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='shapefilelayer',
+            name='ingest_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ShapefileIngestJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('layer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_jobs', to='gis_admin.shapefilelayer')),
+            ],
+            options={
+                'verbose_name': 'Shapefile Ingest Job',
+                'verbose_name_plural': 'Shapefile Ingest Jobs',
+                'ordering': ['created_at'],
+            },
+        ),
+    ]
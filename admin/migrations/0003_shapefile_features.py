@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:22
+
+import json
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.contrib.gis.geos import GEOSGeometry
+from django.db import migrations, models
+
+
+def copy_geojson_features(apps, schema_editor):
+    """Copy features from existing geojson_data blobs into feature rows"""
+    ShapefileLayer = apps.get_model('gis_admin', 'ShapefileLayer')
+    ShapefileFeature = apps.get_model('gis_admin', 'ShapefileFeature')
+    layers = ShapefileLayer.objects.exclude(geojson_data=None)
+    for layer in layers.iterator(chunk_size=1):
+        if not isinstance(layer.geojson_data, dict):
+            continue
+        rows = []
+        for fid, feature in enumerate(layer.geojson_data.get('features') or []):
+            if not feature.get('geometry'):
+                continue
+            rows.append(ShapefileFeature(
+                layer=layer,
+                fid=feature['id'] if isinstance(feature.get('id'), int) else fid,
+                geometry=GEOSGeometry(json.dumps(feature['geometry']), srid=4326),
+                properties=feature.get('properties') or {},
+            ))
+        ShapefileFeature.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gis_admin', '0002_shapefile_ingest_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShapefileFeature',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fid', models.IntegerField(help_text='Feature id within the shapefile')),
+                ('geometry', django.contrib.gis.db.models.fields.GeometryField(srid=4326)),
+                ('properties', models.JSONField(blank=True, default=dict)),
+                ('layer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='features', to='gis_admin.shapefilelayer')),
+            ],
+            options={
+                'verbose_name': 'Shapefile Feature',
+                'verbose_name_plural': 'Shapefile Features',
+                'ordering': ['layer', 'fid'],
+                'constraints': [models.UniqueConstraint(fields=('layer', 'fid'), name='unique_layer_feature')],
+            },
+        ),
+        migrations.RunPython(copy_geojson_features, migrations.RunPython.noop),
+    ]
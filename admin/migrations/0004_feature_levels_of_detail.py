@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:24
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gis_admin', '0003_shapefile_features'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='shapefilefeature',
+            options={'ordering': ['layer_id', 'fid'], 'verbose_name': 'Shapefile Feature', 'verbose_name_plural': 'Shapefile Features'},
+        ),
+        migrations.AddField(
+            model_name='shapefilefeature',
+            name='geometry_lod1',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, spatial_index=False, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='shapefilefeature',
+            name='geometry_lod2',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, spatial_index=False, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='shapefilefeature',
+            name='geometry_lod3',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, spatial_index=False, srid=4326),
+        ),
+    ]
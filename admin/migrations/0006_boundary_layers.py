@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gis_admin', '0005_shapefile_uploads'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shapefilelayer',
+            name='boundary_name_field',
+            field=models.CharField(blank=True, default='', help_text='Feature property holding the district or region name', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='shapefilelayer',
+            name='boundary_role',
+            field=models.CharField(blank=True, choices=[('district', 'District'), ('region', 'Region')], default='', max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='shapefilelayer',
+            constraint=models.UniqueConstraint(condition=models.Q(('boundary_role', ''), _negated=True), fields=('boundary_role',), name='unique_boundary_role'),
+        ),
+    ]
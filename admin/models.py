@@ -1,6 +1,27 @@
-from django.db import models
+from django.contrib.gis.db import models
 from django.contrib.auth.models import User
 import os
+import uuid
+
+
+UPLOAD_STATUSES = [
+    ('uploading', 'Uploading'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+]
+
+# Facility attributes a layer's polygons can provide (see facilities.boundaries)
+BOUNDARY_ROLES = [
+    ('district', 'District'),
+    ('region', 'Region'),
+]
+
+INGEST_STATUSES = [
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+]
 
 
 class ShapefileLayer(models.Model):
@@ -25,7 +46,7 @@ class ShapefileLayer(models.Model):
     dbf_file = models.FileField(upload_to='shapefiles/', blank=True, null=True)
     prj_file = models.FileField(upload_to='shapefiles/', blank=True, null=True)
     
-    # GeoJSON representation (stored for quick access)
+    # Legacy GeoJSON representation; features now live in ShapefileFeature
     geojson_data = models.JSONField(blank=True, null=True)
     
     # Metadata
@@ -33,6 +54,17 @@ class ShapefileLayer(models.Model):
     srid = models.IntegerField(default=4326, help_text='Spatial Reference System ID')
     bounds = models.JSONField(blank=True, null=True, help_text='Bounding box [minx, miny, maxx, maxy]')
     
+    # Background ingestion (blank until the files are first queued)
+    ingest_status = models.CharField(max_length=20, choices=INGEST_STATUSES, blank=True, default='')
+    ingest_error = models.TextField(blank=True, default='')
+    
+    # Polygon layer answering "which district/region is this point in"
+    boundary_role = models.CharField(max_length=20, choices=BOUNDARY_ROLES, blank=True, default='')
+    boundary_name_field = models.CharField(
+        max_length=100, blank=True, default='',
+        help_text='Feature property holding the district or region name'
+    )
+    
     # Tracking
     uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='uploaded_shapefiles')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -43,6 +75,13 @@ class ShapefileLayer(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Shapefile Layer'
         verbose_name_plural = 'Shapefile Layers'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['boundary_role'],
+                condition=~models.Q(boundary_role=''),
+                name='unique_boundary_role',
+            ),
+        ]
     
     def __str__(self):
         return self.name
@@ -64,3 +103,75 @@ class ShapefileLayer(models.Model):
                 os.remove(self.prj_file.path)
         
         super().delete(*args, **kwargs)
+
+
+class ShapefileFeature(models.Model):
+    """One feature of a shapefile layer, reprojected to WGS84"""
+    
+    layer = models.ForeignKey(ShapefileLayer, on_delete=models.CASCADE, related_name='features')
+    fid = models.IntegerField(help_text='Feature id within the shapefile')
+    geometry = models.GeometryField(srid=4326, spatial_index=True)
+    properties = models.JSONField(default=dict, blank=True)
+    
+    # Simplified copies for low zoom levels (see admin.lod); null means use geometry
+    geometry_lod1 = models.GeometryField(srid=4326, spatial_index=False, blank=True, null=True)
+    geometry_lod2 = models.GeometryField(srid=4326, spatial_index=False, blank=True, null=True)
+    geometry_lod3 = models.GeometryField(srid=4326, spatial_index=False, blank=True, null=True)
+    
+    class Meta:
+        ordering = ['layer_id', 'fid']
+        verbose_name = 'Shapefile Feature'
+        verbose_name_plural = 'Shapefile Features'
+        constraints = [
+            models.UniqueConstraint(fields=['layer', 'fid'], name='unique_layer_feature'),
+        ]
+    
+    def __str__(self):
+        return f'{self.layer} #{self.fid}'
+
+
+class ShapefileIngestJob(models.Model):
+    """Queued work to read a layer's uploaded files into its GeoJSON and metadata"""
+    
+    layer = models.ForeignKey(ShapefileLayer, on_delete=models.CASCADE, related_name='ingest_jobs')
+    status = models.CharField(max_length=20, choices=INGEST_STATUSES, default='pending', db_index=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        verbose_name = 'Shapefile Ingest Job'
+        verbose_name_plural = 'Shapefile Ingest Jobs'
+    
+    def __str__(self):
+        return f'{self.layer} ({self.status})'
+
+
+class ShapefileUpload(models.Model):
+    """
+    A zipped shapefile uploaded in chunks (see admin.uploads). Once every
+    byte has arrived and the checksum matches, it becomes a ShapefileLayer.
+    """
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.CharField(max_length=255, help_text='Name of the layer to create')
+    description = models.TextField(blank=True, default='')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField(help_text='Total size of the zip file in bytes')
+    received = models.BigIntegerField(default=0, help_text='Bytes stored so far')
+    status = models.CharField(max_length=20, choices=UPLOAD_STATUSES, default='uploading')
+    error = models.TextField(blank=True, default='')
+    layer = models.ForeignKey(ShapefileLayer, on_delete=models.SET_NULL, null=True, blank=True, related_name='uploads')
+    uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='shapefile_uploads')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Shapefile Upload'
+        verbose_name_plural = 'Shapefile Uploads'
+    
+    def __str__(self):
+        return f'{self.filename} ({self.received}/{self.size})'
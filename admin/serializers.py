@@ -1,8 +1,15 @@
+import json
+
+from django.conf import settings
 from rest_framework import serializers
-from .models import ShapefileLayer
+from .models import ShapefileLayer, ShapefileUpload
 
 
 class ShapefileLayerSerializer(serializers.ModelSerializer):
+    """
+    Layer details and files. Geometry is not included; it is served by the
+    ``features`` and ``geojson`` endpoints.
+    """
     uploaded_by_username = serializers.CharField(source='uploaded_by.username', read_only=True)
     
     class Meta:
@@ -10,17 +17,43 @@ class ShapefileLayerSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'name', 'description', 'geometry_type',
             'shapefile', 'shx_file', 'dbf_file', 'prj_file',
-            'geojson_data', 'feature_count', 'srid', 'bounds',
+            'feature_count', 'srid', 'bounds',
             'uploaded_by', 'uploaded_by_username',
-            'created_at', 'updated_at', 'is_active'
+            'created_at', 'updated_at', 'is_active',
+            'ingest_status', 'ingest_error',
+            'boundary_role', 'boundary_name_field'
         ]
-        read_only_fields = ['uploaded_by', 'created_at', 'updated_at']
+        read_only_fields = ['uploaded_by', 'created_at', 'updated_at', 'ingest_status', 'ingest_error']
     
     def validate_shapefile(self, value):
         """Validate that the uploaded file is a valid shapefile"""
         if not value.name.endswith('.shp'):
             raise serializers.ValidationError("File must be a .shp shapefile")
         return value
+    
+    def validate(self, attrs):
+        role = attrs.get('boundary_role', getattr(self.instance, 'boundary_role', ''))
+        name_field = attrs.get('boundary_name_field', getattr(self.instance, 'boundary_name_field', ''))
+        if role and not name_field:
+            raise serializers.ValidationError(
+                {'boundary_name_field': "Name the feature property holding the boundary names"}
+            )
+        return attrs
+
+
+class ShapefileLayerSummarySerializer(serializers.ModelSerializer):
+    """Read-only summary of a layer for listings such as a layer picker"""
+    uploaded_by_username = serializers.CharField(source='uploaded_by.username', read_only=True)
+    
+    class Meta:
+        model = ShapefileLayer
+        fields = [
+            'id', 'name', 'description', 'geometry_type',
+            'feature_count', 'bounds', 'is_active',
+            'uploaded_by_username', 'created_at', 'updated_at',
+            'ingest_status', 'boundary_role',
+        ]
+        read_only_fields = fields
 
 
 class ShapefileUploadSerializer(serializers.Serializer):
@@ -52,3 +85,50 @@ class ShapefileUploadSerializer(serializers.Serializer):
         if value and not value.name.endswith('.prj'):
             raise serializers.ValidationError("Projection file must be a .prj file")
         return value
+
+
+class ShapefileChunkedUploadSerializer(serializers.ModelSerializer):
+    """Serializer for a chunked upload of a zipped shapefile"""
+    
+    class Meta:
+        model = ShapefileUpload
+        fields = [
+            'id', 'name', 'description', 'filename', 'size',
+            'received', 'status', 'error', 'layer',
+            'created_at', 'updated_at'
+        ]
+        read_only_fields = ['received', 'status', 'error', 'layer', 'created_at', 'updated_at']
+    
+    def validate_name(self, value):
+        if ShapefileLayer.objects.filter(name=value).exists():
+            raise serializers.ValidationError("A shapefile layer with this name already exists")
+        return value
+    
+    def validate_filename(self, value):
+        if not value.lower().endswith('.zip'):
+            raise serializers.ValidationError("File must be a .zip of the shapefile")
+        return value
+    
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Size must be positive")
+        if value > settings.SHAPEFILE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Uploads are limited to {settings.SHAPEFILE_UPLOAD_MAX_SIZE} bytes"
+            )
+        return value
+
+
+class ShapefileFeatureSerializer(serializers.BaseSerializer):
+    """
+    GeoJSON Feature for a ShapefileFeature ``values()`` row with fid,
+    properties and a ``geojson`` (AsGeoJSON) annotation
+    """
+    
+    def to_representation(self, row):
+        return {
+            'type': 'Feature',
+            'id': row['fid'],
+            'geometry': json.loads(row['geojson']),
+            'properties': row['properties'],
+        }
@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ShapefileLayer
+from .tiles import invalidate_layer_tiles
+
+
+@receiver(post_save, sender=ShapefileLayer)
+@receiver(post_delete, sender=ShapefileLayer)
+def layer_changed(sender, instance, **kwargs):
+    """Invalidate cached tiles once the change is visible to other connections"""
+    layer_id = instance.pk
+    transaction.on_commit(lambda: invalidate_layer_tiles(layer_id))
@@ -1,12 +1,54 @@
-from django.test import TestCase
+import hashlib
+import io
+import math
+import shutil
+import struct
+import tempfile
+import zipfile
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
+from django.contrib.gis.geos import Polygon
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import ShapefileLayer
+from .lod import build_lods, level_for_tolerance, level_for_zoom
+from .models import ShapefileFeature, ShapefileIngestJob, ShapefileLayer, ShapefileUpload
 from django.core.files.uploadedfile import SimpleUploadedFile
 import json
 
 
+def shapefile_parts(points, names, prj=None):
+    """Build .shp/.shx/.dbf(/.prj) bytes for a point layer with a NAME field"""
+    records = [struct.pack('<idd', 1, x, y) for x, y in points]
+    xs, ys = [x for x, _ in points], [y for _, y in points]
+    bbox = struct.pack('<4d', min(xs), min(ys), max(xs), max(ys))
+
+    def header(length_words):
+        return (struct.pack('>i20xi', 9994, length_words)
+                + struct.pack('<ii', 1000, 1) + bbox + b'\0' * 32)
+
+    shp, shx, offset = b'', b'', 50
+    for number, record in enumerate(records, 1):
+        shp += struct.pack('>ii', number, len(record) // 2) + record
+        shx += struct.pack('>ii', offset, len(record) // 2)
+        offset += 4 + len(record) // 2
+    shp = header(50 + len(shp) // 2) + shp
+    shx = header(50 + len(shx) // 2) + shx
+
+    dbf = struct.pack('<BBBBIHH20x', 3, 124, 1, 1, len(names), 65, 21)
+    dbf += b'NAME'.ljust(11, b'\0') + b'C' + b'\0' * 4 + bytes([20, 0]) + b'\0' * 14 + b'\r'
+    for name in names:
+        dbf += b' ' + name.encode().ljust(20)
+    dbf += b'\x1a'
+
+    parts = {'shp': shp, 'shx': shx, 'dbf': dbf}
+    if prj:
+        parts['prj'] = prj.encode()
+    return parts
+
+
 class ShapefileAPITestCase(TestCase):
     """Test cases for Shapefile Admin API"""
     
@@ -80,6 +122,17 @@ class ShapefileAPITestCase(TestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['name'], 'Test Layer')
     
+    def test_list_never_selects_geojson_data(self):
+        """Test list and active responses leave the heavy GeoJSON column unread"""
+        for url in ['/api/shapefiles/', '/api/shapefiles/active/']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('geojson_data', response.data[0])
+            self.assertEqual(response.data[0]['uploaded_by_username'], 'admin')
+            for query in queries.captured_queries:
+                self.assertNotIn('geojson_data', query['sql'])
+    
     def test_unauthorized_access(self):
         """Test that non-admin users cannot access the API"""
         self.client.force_authenticate(user=None)
@@ -139,3 +192,292 @@ class ShapefileModelTestCase(TestCase):
                 name='Unique Layer',
                 uploaded_by=self.admin_user
             )
+
+
+class ShapefileIngestTestCase(TestCase):
+    """Test cases for background shapefile ingestion"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            email='admin@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.admin_user)
+        
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, SHAPEFILE_INGEST_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+    
+    def _upload(self, parts):
+        data = {'name': 'Hospitals'}
+        for extension, content in parts.items():
+            data[f'{extension}_file'] = SimpleUploadedFile(f'hospitals.{extension}', content)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/shapefiles/upload-complete/', data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['ingest_status'], 'pending')
+        return ShapefileLayer.objects.get(pk=response.data['id'])
+    
+    def test_upload_is_ingested(self):
+        """Test uploaded files are read into GeoJSON and metadata"""
+        layer = self._upload(shapefile_parts([(33.77, -13.96), (35.0, -15.8)], ['Lilongwe', 'Blantyre']))
+        self.assertEqual(layer.ingest_status, 'completed')
+        self.assertEqual(layer.feature_count, 2)
+        self.assertEqual(layer.geometry_type, 'Point')
+        self.assertEqual(layer.bounds, [33.77, -15.8, 35.0, -13.96])
+        feature = layer.features.get(fid=0)
+        self.assertEqual(feature.geometry.coords, (33.77, -13.96))
+        self.assertEqual(feature.properties['NAME'], 'Lilongwe')
+        self.assertEqual(layer.ingest_jobs.get().status, 'completed')
+    
+    def test_invalid_upload_fails_job(self):
+        """Test unreadable files mark the job and layer as failed"""
+        layer = self._upload({'shp': b'not a shapefile'})
+        self.assertEqual(layer.ingest_status, 'failed')
+        self.assertTrue(layer.ingest_error)
+        self.assertEqual(ShapefileIngestJob.objects.get(layer=layer).status, 'failed')
+    
+    def test_reingest_action(self):
+        """Test a layer can be queued for ingestion again"""
+        layer = self._upload(shapefile_parts([(33.77, -13.96)], ['Lilongwe']))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/shapefiles/{layer.id}/ingest/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(layer.ingest_jobs.filter(status='completed').count(), 2)
+    
+    def test_features_endpoint(self):
+        """Test features can be filtered by bbox, paged and streamed"""
+        layer = self._upload(shapefile_parts(
+            [(33.77, -13.96), (35.0, -15.8), (34.0, -11.4)], ['Lilongwe', 'Blantyre', 'Mzuzu']
+        ))
+        url = f'/api/shapefiles/{layer.id}/features/'
+        
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['type'], 'FeatureCollection')
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(len(response.data['features']), 2)
+        self.assertIsNotNone(response.data['next'])
+        
+        response = self.client.get(url, {'bbox': '33,-14.5,34.5,-13'})
+        self.assertEqual([f['properties']['NAME'] for f in response.data['features']], ['Lilongwe'])
+        self.assertEqual(response.data['features'][0]['geometry']['coordinates'], [33.77, -13.96])
+        
+        response = self.client.get(url, {'stream': 1})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['count'], 3)
+        
+        response = self.client.get(url, {'bbox': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        response = self.client.get(f'/api/shapefiles/{layer.id}/geojson/')
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual([f['id'] for f in data['features']], [0, 1, 2])
+
+
+class ShapefileLevelOfDetailTestCase(TestCase):
+    """Test cases for simplified feature geometries"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            email='admin@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.admin_user)
+        self.layer = ShapefileLayer.objects.create(name='Districts', uploaded_by=self.admin_user)
+        
+        # Two neighbouring districts sharing a finely digitised border
+        border = [(33.0 + 0.002 * math.sin(i / 10), -14.0 + i * 0.001) for i in range(1001)]
+        west = Polygon(border + [(32.0, -13.0), (32.0, -14.0), border[0]], srid=4326)
+        east = Polygon(border + [(34.0, -13.0), (34.0, -14.0), border[0]], srid=4326)
+        for fid, geometry in enumerate([west, east]):
+            ShapefileFeature.objects.create(layer=self.layer, fid=fid, geometry=geometry)
+        build_lods(self.layer)
+    
+    def test_levels_for_zoom(self):
+        """Test coarser levels are picked for lower zooms"""
+        self.assertEqual(level_for_zoom(3), 3)
+        self.assertEqual(level_for_zoom(10), 1)
+        self.assertEqual(level_for_zoom(16), 0)
+        self.assertEqual(level_for_tolerance(0.01), 2)
+    
+    def test_simplified_geometries_stored(self):
+        """Test each level has fewer vertices and borders stay shared"""
+        west, east = ShapefileFeature.objects.filter(layer=self.layer).order_by('fid')
+        self.assertLess(west.geometry_lod3.num_coords, west.geometry_lod1.num_coords)
+        self.assertLess(west.geometry_lod1.num_coords, west.geometry.num_coords)
+        self.assertAlmostEqual(west.geometry_lod2.intersection(east.geometry_lod2).area, 0)
+    
+    def test_features_endpoint_uses_zoom(self):
+        """Test the features endpoint serves the level for the zoom"""
+        url = f'/api/shapefiles/{self.layer.id}/features/'
+        full = self.client.get(url).data['features'][0]['geometry']['coordinates'][0]
+        low = self.client.get(url, {'zoom': 4}).data['features'][0]['geometry']['coordinates'][0]
+        self.assertLess(len(low), len(full) // 10)
+        response = self.client.get(url, {'zoom': 'far'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ShapefileTileTestCase(TestCase):
+    """Test cases for shapefile layer vector tiles"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            email='admin@test.com',
+            password='testpass123'
+        )
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        settings_override = override_settings(FACILITY_CACHE_DIR=cache_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.districts = ShapefileLayer.objects.create(name='Districts', uploaded_by=self.admin_user)
+        ShapefileFeature.objects.create(
+            layer=self.districts, fid=0, properties={'NAME': 'Lilongwe'},
+            geometry=Polygon.from_bbox((33.0, -14.5, 34.5, -13.5)),
+        )
+        self.roads = ShapefileLayer.objects.create(name='Roads', uploaded_by=self.admin_user, is_active=False)
+        ShapefileFeature.objects.create(
+            layer=self.roads, fid=0, properties={'REF': 'M1'},
+            geometry=Polygon.from_bbox((33.5, -14.0, 33.6, -13.9)).boundary,
+        )
+    
+    def test_layer_tile(self):
+        """Test a layer is served as MVT clipped to the tile"""
+        response = self.client.get(f'/api/shapefiles/{self.districts.id}/tiles/6/37/34.mvt')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'Districts', response.content)
+        self.assertIn(b'Lilongwe', response.content)
+        
+        empty = self.client.get(f'/api/shapefiles/{self.districts.id}/tiles/6/0/0.mvt')
+        self.assertEqual(empty.content, b'')
+        
+        response = self.client.get(f'/api/shapefiles/{self.districts.id}/tiles/2/9/0.mvt')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_inactive_layer_tile_is_admin_only(self):
+        """Test inactive layers are hidden from non-admin users"""
+        url = f'/api/shapefiles/{self.roads.id}/tiles/6/37/34.mvt'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.client.force_authenticate(user=self.admin_user)
+        self.assertIn(b'Roads', self.client.get(url).content)
+    
+    def test_active_tile_follows_toggle(self):
+        """Test the combined tile holds active layers and is invalidated on toggle"""
+        response = self.client.get('/api/shapefiles/tiles/6/37/34.mvt')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn(b'Districts', response.content)
+        self.assertNotIn(b'Roads', response.content)
+        
+        self.client.force_authenticate(user=self.admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/shapefiles/{self.roads.id}/toggle-active/')
+        response = self.client.get('/api/shapefiles/tiles/6/37/34.mvt')
+        self.assertIn(b'Roads', response.content)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/shapefiles/{self.districts.id}/')
+        response = self.client.get('/api/shapefiles/tiles/6/37/34.mvt')
+        self.assertNotIn(b'Districts', response.content)
+
+
+class ShapefileChunkedUploadTestCase(TestCase):
+    """Test cases for resumable zipped shapefile uploads"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.admin_user = User.objects.create_superuser(
+            username='admin',
+            email='admin@test.com',
+            password='testpass123'
+        )
+        self.client.force_authenticate(user=self.admin_user)
+        
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root,
+            SHAPEFILE_UPLOAD_DIR=f'{media_root}/chunked',
+            SHAPEFILE_INGEST_WORKERS=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            parts = shapefile_parts([(33.77, -13.96), (35.0, -15.8)], ['Lilongwe', 'Blantyre'])
+            for extension, content in parts.items():
+                archive.writestr(f'hospitals/Hospitals.{extension.upper()}', content)
+            archive.writestr('__MACOSX/hospitals/._Hospitals.shp', b'junk')
+        self.zip_bytes = buffer.getvalue()
+    
+    def _start(self):
+        response = self.client.post('/api/shapefile-uploads/', {
+            'name': 'Hospitals', 'filename': 'hospitals.zip', 'size': len(self.zip_bytes)
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return f"/api/shapefile-uploads/{response.data['id']}/"
+    
+    def _put(self, url, offset, data):
+        return self.client.put(
+            f'{url}chunk/?offset={offset}', data, content_type='application/octet-stream'
+        )
+    
+    def test_chunked_upload_creates_layer(self):
+        """Test chunks resume from the stored offset and finalize ingests the layer"""
+        url = self._start()
+        half = len(self.zip_bytes) // 2
+        response = self._put(url, 0, self.zip_bytes[:half])
+        self.assertEqual(response.data['received'], half)
+        
+        response = self._put(url, 0, self.zip_bytes[half:])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['received'], half)
+        
+        response = self.client.post(f'{url}finalize/', {'sha256': '0' * 64}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        
+        self.assertEqual(self.client.get(url).data['received'], half)
+        self._put(url, half, self.zip_bytes[half:])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'{url}finalize/', {
+                'sha256': hashlib.sha256(self.zip_bytes).hexdigest()
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        
+        layer = ShapefileLayer.objects.get(pk=response.data['id'])
+        self.assertTrue(layer.shapefile.name.endswith('.shp'))
+        self.assertTrue(layer.dbf_file)
+        self.assertEqual(layer.ingest_status, 'completed')
+        self.assertEqual(layer.feature_count, 2)
+        upload = ShapefileUpload.objects.get()
+        self.assertEqual((upload.status, upload.layer), ('completed', layer))
+    
+    def test_checksum_mismatch_fails_upload(self):
+        """Test a corrupted upload is rejected and no layer is created"""
+        url = self._start()
+        self._put(url, 0, self.zip_bytes)
+        response = self.client.post(f'{url}finalize/', {
+            'sha256': hashlib.sha256(b'other').hexdigest()
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url).data['status'], 'failed')
+        self.assertFalse(ShapefileLayer.objects.exists())
+    
+    def test_chunk_past_declared_size(self):
+        """Test chunks cannot grow the upload beyond its declared size"""
+        url = self._start()
+        response = self._put(url, 0, self.zip_bytes + b'extra')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(url).data['received'], 0)
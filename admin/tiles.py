@@ -0,0 +1,174 @@
+"""
+Mapbox Vector Tiles for uploaded shapefile layers.
+
+Each ShapefileLayer is written as one MVT layer named after it. Features are
+drawn from the level of detail for the tile's zoom (``admin.lod``) and
+clipped to the tile plus a small buffer, with ``ST_AsMVT`` on PostGIS and the
+pure-Python encoder from ``facilities.tiles`` elsewhere.
+
+``get_layer_tile`` serves a single layer and ``get_active_tile`` combines all
+active layers. Rendered tiles are cached on disk like facility tiles, under
+data versions that ``invalidate_layer_tiles`` bumps whenever a layer changes.
+"""
+import json
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+from django.db.models.functions import Coalesce
+
+from facilities.cache import bump_data_version, data_version
+from facilities.tiles import (
+    EXTENT,
+    GEOM_LINESTRING,
+    GEOM_POINT,
+    GEOM_POLYGON,
+    TILE_BUFFER,
+    buffered_lnglat_bounds,
+    cached_tile,
+    encode_tile,
+    lnglat_to_tile_pixel,
+)
+
+from .lod import geometry_column, level_for_zoom
+from .models import ShapefileFeature, ShapefileLayer
+
+# Data version bumped whenever any layer changes; covers the combined tile of
+# all active layers and other caches built from several layers
+LAYERS_VERSION = 'shapefile-layers'
+
+
+def layer_version_name(layer_id):
+    return f'shapefile-layer-{layer_id}'
+
+
+# --- Tile rendering -------------------------------------------------------
+
+def render_layer_tile_postgis(layer, z, x, y):
+    """Render one layer's features in tile z/x/y with ST_AsMVT"""
+    level = level_for_zoom(z)
+    geometry = 'f.geometry'
+    if level:
+        geometry = f'COALESCE(f.{connection.ops.quote_name(geometry_column(level))}, f.geometry)'
+    # jsonb columns are expanded into one MVT property per key
+    sql = f'''
+        WITH bounds AS (
+            SELECT ST_TileEnvelope(%s, %s, %s) AS geom,
+                   ST_TileEnvelope(%s, %s, %s, margin => %s) AS area
+        )
+        SELECT ST_AsMVT(tile, %s, %s, 'geom', 'fid')
+        FROM (
+            SELECT f.fid, f.properties,
+                   ST_AsMVTGeom(ST_Transform({geometry}, 3857), bounds.geom, %s, %s, true) AS geom
+            FROM {connection.ops.quote_name(ShapefileFeature._meta.db_table)} f, bounds
+            WHERE f.layer_id = %s AND f.geometry && ST_Transform(bounds.area, 4326)
+        ) AS tile
+        WHERE tile.geom IS NOT NULL
+    '''
+    margin = TILE_BUFFER / EXTENT
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            z, x, y, z, x, y, margin, layer.name, EXTENT, EXTENT, TILE_BUFFER, layer.pk,
+        ])
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else b''
+
+
+def render_layer_tile_python(layer, z, x, y):
+    """Render one layer's features without database vector tile support"""
+    clip = Polygon.from_bbox(buffered_lnglat_bounds(z, x, y))
+    clip.srid = 4326
+
+    level = level_for_zoom(z)
+    rows = layer.features.filter(geometry__intersects=clip).annotate(
+        tile_geometry=Coalesce(geometry_column(level), 'geometry')
+    ).values('fid', 'properties', 'tile_geometry')
+
+    features = []
+    for row in rows.iterator(chunk_size=2000):
+        geometry = row['tile_geometry'].intersection(clip)
+        properties = {key: _property_value(value) for key, value in row['properties'].items()}
+        features.extend(_tile_features(row['fid'], geometry, properties, z, x, y))
+    if not features:
+        return b''
+    return encode_tile([(layer.name, features)])
+
+
+def render_layer_tile(layer, z, x, y):
+    if connection.vendor == 'postgresql':
+        return render_layer_tile_postgis(layer, z, x, y)
+    return render_layer_tile_python(layer, z, x, y)
+
+
+def _property_value(value):
+    # MVT values are scalars; nested JSON is written as text
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _tile_features(fid, geometry, properties, z, x, y):
+    """Yield encoder features for a clipped geometry, one per geometry type"""
+    def pixels(coords):
+        return [lnglat_to_tile_pixel(lng, lat, z, x, y) for lng, lat, *_ in coords]
+
+    points, lines, polygons = [], [], []
+    pending = [geometry]
+    while pending:
+        part = pending.pop()
+        if part.empty:
+            continue
+        kind = part.geom_type
+        if kind == 'Point':
+            points.append(lnglat_to_tile_pixel(part.x, part.y, z, x, y))
+        elif kind == 'LineString' or kind == 'LinearRing':
+            lines.append(pixels(part.coords))
+        elif kind == 'Polygon':
+            polygons.append([pixels(ring.coords) for ring in part])
+        else:
+            # Multi* geometries and collections left over from clipping
+            pending.extend(reversed(list(part)))
+
+    for geom_type, parts in ((GEOM_POINT, points), (GEOM_LINESTRING, lines), (GEOM_POLYGON, polygons)):
+        if parts:
+            yield {'id': fid, 'type': geom_type, 'geometry': parts, 'properties': properties}
+
+
+# --- Disk cache -----------------------------------------------------------
+
+def _cache_root():
+    return Path(settings.FACILITY_CACHE_DIR) / 'layer-tiles'
+
+
+def get_layer_tile(layer, z, x, y):
+    """Return the MVT bytes of ``layer`` for a tile, rendering and caching on a miss"""
+    version = data_version(layer_version_name(layer.pk)) or 'initial'
+    path = _cache_root() / str(layer.pk) / version / str(z) / str(x) / f'{y}.mvt'
+    return cached_tile(path, lambda: render_layer_tile(layer, z, x, y))
+
+
+def get_active_tile(z, x, y):
+    """Return one tile combining every active layer"""
+    version = data_version(LAYERS_VERSION) or 'initial'
+    path = _cache_root() / 'active' / version / str(z) / str(x) / f'{y}.mvt'
+
+    def render():
+        layers = ShapefileLayer.objects.filter(is_active=True).order_by('name').only('id', 'name')
+        # Concatenated tiles are a valid tile holding all their layers
+        return b''.join(render_layer_tile(layer, z, x, y) for layer in layers)
+
+    return cached_tile(path, render)
+
+
+def invalidate_layer_tiles(layer_id):
+    """
+    Start fresh tile caches for ``layer_id`` and mark everything built from
+    several layers (the combined tile, boundary indexes) as stale
+    """
+    bump_data_version(layer_version_name(layer_id))
+    bump_data_version(LAYERS_VERSION)
+    root = _cache_root()
+    shutil.rmtree(root / str(layer_id), ignore_errors=True)
+    shutil.rmtree(root / 'active', ignore_errors=True)
@@ -0,0 +1,132 @@
+"""
+Chunked, resumable uploads of zipped shapefiles.
+
+A client creates a ShapefileUpload with the size of its zip, PUTs the bytes
+in chunks at increasing offsets (after a dropped connection it asks for
+``received`` and carries on from there) and finalizes with the SHA-256 of
+the whole file. Chunks are streamed from the request straight into a part
+file under SHAPEFILE_UPLOAD_DIR. Finalizing hashes that file and extracts
+the shapefile members one at a time, so neither step holds the upload in
+memory.
+"""
+import hashlib
+import shutil
+import zipfile
+from pathlib import Path, PurePosixPath
+
+from django.conf import settings
+
+
+# Bytes read from the request or part file at a time
+UPLOAD_READ_SIZE = 1 << 20
+
+SHAPEFILE_EXTENSIONS = ['.shp', '.shx', '.dbf', '.prj']
+
+# Extracted members may be at most this many times the size of the zip;
+# shapefiles compress well, but not like a zip bomb
+MAX_COMPRESSION_RATIO = 50
+
+
+class UploadError(Exception):
+    """The uploaded data cannot be accepted; the message is shown to the client"""
+
+
+def part_path(upload):
+    return Path(settings.SHAPEFILE_UPLOAD_DIR) / f'{upload.pk}.part'
+
+
+def write_chunk(upload, offset, stream):
+    """
+    Write the body ``stream`` to ``upload``'s part file at ``offset`` and
+    return the new number of bytes received. The caller must hold a lock on
+    the upload row.
+
+    Anything past ``offset`` is discarded first, and whatever arrived before a
+    dropped connection is kept so the client can resume from there.
+    """
+    path = part_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch(exist_ok=True)
+    remaining = upload.size - offset
+
+    written = 0
+    with open(path, 'r+b') as part:
+        part.seek(offset)
+        part.truncate()
+        while True:
+            try:
+                data = stream.read(UPLOAD_READ_SIZE)
+            except OSError:
+                # Client went away mid-chunk
+                break
+            if not data:
+                break
+            if written + len(data) > remaining:
+                part.truncate(offset)
+                raise UploadError(f'Chunk runs past the declared size of {upload.size} bytes')
+            part.write(data)
+            written += len(data)
+    return offset + written
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(UPLOAD_READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_shapefile(zip_path, workdir):
+    """
+    Extract the .shp and its sibling .shx/.dbf/.prj from a zip into
+    ``workdir``. Returns ``{extension: path}``.
+    """
+    try:
+        archive = zipfile.ZipFile(zip_path)
+    except zipfile.BadZipFile:
+        raise UploadError('Upload is not a valid zip file')
+
+    with archive:
+        members = {}
+        for info in archive.infolist():
+            name = PurePosixPath(info.filename)
+            if info.is_dir() or '__MACOSX' in name.parts or name.name.startswith('.'):
+                continue
+            extension = name.suffix.lower()
+            if extension in SHAPEFILE_EXTENSIONS:
+                members.setdefault(extension, []).append(info)
+
+        if len(members.get('.shp', [])) != 1:
+            raise UploadError('The zip must contain exactly one .shp file')
+        stem = _stem(members['.shp'][0])
+        parts = {}
+        for extension, infos in members.items():
+            # Only files sharing the .shp's path and basename belong to it
+            siblings = [info for info in infos if _stem(info) == stem]
+            if siblings:
+                parts[extension] = siblings[0]
+
+        extracted_size = sum(info.file_size for info in parts.values())
+        if extracted_size > MAX_COMPRESSION_RATIO * max(Path(zip_path).stat().st_size, 1):
+            raise UploadError('The zip expands to an implausible size')
+
+        basename = PurePosixPath(members['.shp'][0].filename).stem
+        paths = {}
+        for extension, info in parts.items():
+            paths[extension] = Path(workdir) / f'{basename}{extension}'
+            try:
+                with archive.open(info) as src, open(paths[extension], 'wb') as dst:
+                    shutil.copyfileobj(src, dst, UPLOAD_READ_SIZE)
+            except (zipfile.BadZipFile, NotImplementedError, RuntimeError) as e:
+                raise UploadError(f'Cannot extract {info.filename}: {e}')
+    return paths
+
+
+def _stem(info):
+    return str(PurePosixPath(info.filename).with_suffix('')).lower()
+
+
+def discard(upload):
+    """Remove an upload's part file"""
+    part_path(upload).unlink(missing_ok=True)
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ShapefileLayerViewSet
+from .views import ShapefileLayerViewSet, ShapefileUploadViewSet, active_layers_tile, layer_tile
 from .authentication import login_view, logout_view, current_user_view, refresh_token_view
 
 router = DefaultRouter()
 router.register(r'shapefiles', ShapefileLayerViewSet, basename='shapefile')
+router.register(r'shapefile-uploads', ShapefileUploadViewSet, basename='shapefile-upload')
 
 urlpatterns = [
     # Authentication endpoints
@@ -13,6 +14,10 @@ urlpatterns = [
     path('auth/me/', current_user_view, name='current-user'),
     path('auth/refresh/', refresh_token_view, name='refresh-token'),
     
+    # Vector tiles for shapefile layers
+    path('shapefiles/tiles/<int:z>/<int:x>/<int:y>.mvt', active_layers_tile, name='shapefile-active-tile'),
+    path('shapefiles/<int:pk>/tiles/<int:z>/<int:x>/<int:y>.mvt', layer_tile, name='shapefile-tile'),
+    
     # Shapefile CRUD endpoints
     path('', include(router.urls)),
 ]
@@ -1,26 +1,101 @@
-from rest_framework import viewsets, status
-from rest_framework.decorators import action
+import re
+import tempfile
+
+from rest_framework import mixins, viewsets, status
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
-from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.pagination import PageNumberPagination
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.contrib.gis.geos import Polygon
+from django.db.models import F
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from .models import ShapefileLayer
-from .serializers import ShapefileLayerSerializer, ShapefileUploadSerializer
+from facilities.streaming import STREAM_CHUNK_SIZE, stream_feature_collection
+from facilities.tiles import is_valid_tile
+from .ingest import enqueue_ingest
+from .lod import geometry_column, level_for_tolerance, level_for_zoom, precision
+from .models import ShapefileLayer, ShapefileUpload
+from .tiles import get_active_tile, get_layer_tile
+from .uploads import UploadError, discard, extract_shapefile, file_sha256, part_path, write_chunk
+from .serializers import (
+    ShapefileChunkedUploadSerializer,
+    ShapefileFeatureSerializer,
+    ShapefileLayerSerializer,
+    ShapefileLayerSummarySerializer,
+    ShapefileUploadSerializer,
+)
+
+
+def create_layer(shapefile_data, user):
+    """
+    Create a layer from uploaded files and queue them for ingestion. Returns
+    the layer serializer; its ``errors`` are set when the data was invalid.
+    """
+    layer_serializer = ShapefileLayerSerializer(data=shapefile_data)
+    if layer_serializer.is_valid():
+        layer = layer_serializer.save(uploaded_by=user)
+        # Files are read in the background; poll ingest_status for the result
+        enqueue_ingest(layer)
+    return layer_serializer
+
+
+class ShapefileFeaturePagination(PageNumberPagination):
+    """Pages of layer features, returned as FeatureCollections"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    
+    def get_paginated_response(self, data):
+        return Response({
+            'type': 'FeatureCollection',
+            'count': self.page.paginator.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'features': data,
+        })
 
 
 class ShapefileLayerViewSet(viewsets.ModelViewSet):
-    queryset = ShapefileLayer.objects.all()
+    # The legacy GeoJSON blob can be hundreds of MB per layer; geometry is
+    # served from feature rows by the features/geojson actions instead
+    queryset = ShapefileLayer.objects.defer('geojson_data')
     serializer_class = ShapefileLayerSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
-    parser_classes = [MultiPartParser, FormParser]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
+    
+    # Uploading any of these re-reads the layer's data
+    file_fields = ['shapefile', 'shx_file', 'dbf_file', 'prj_file']
+    
+    # Actions that return many layers use the summary serializer
+    summary_actions = ['list', 'active_layers']
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.summary_actions:
+            queryset = queryset.select_related('uploaded_by')
+        return queryset
+    
+    def get_serializer_class(self):
+        if self.action in self.summary_actions:
+            return ShapefileLayerSummarySerializer
+        return super().get_serializer_class()
     
     def perform_create(self, serializer):
-        """Set the uploaded_by field to the current user"""
-        serializer.save(uploaded_by=self.request.user)
+        """Set the uploaded_by field to the current user and queue ingestion"""
+        layer = serializer.save(uploaded_by=self.request.user)
+        enqueue_ingest(layer)
     
     def perform_update(self, serializer):
-        """Update shapefile and track the user"""
-        serializer.save()
+        """Update shapefile, re-ingesting when new files were uploaded"""
+        layer = serializer.save()
+        if any(field in serializer.validated_data for field in self.file_fields):
+            enqueue_ingest(layer)
     
     @action(detail=False, methods=['post'], url_path='upload-complete')
     def upload_complete(self, request):
@@ -39,9 +114,8 @@ class ShapefileLayerViewSet(viewsets.ModelViewSet):
                 'prj_file': serializer.validated_data.get('prj_file'),
             }
             
-            layer_serializer = ShapefileLayerSerializer(data=shapefile_data)
-            if layer_serializer.is_valid():
-                layer_serializer.save(uploaded_by=request.user)
+            layer_serializer = create_layer(shapefile_data, request.user)
+            if not layer_serializer.errors:
                 return Response(layer_serializer.data, status=status.HTTP_201_CREATED)
             else:
                 return Response(layer_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -58,9 +132,29 @@ class ShapefileLayerViewSet(viewsets.ModelViewSet):
             'feature_count': layer.feature_count,
             'srid': layer.srid,
             'bounds': layer.bounds,
+            'ingest_status': layer.ingest_status,
+            'ingest_error': layer.ingest_error,
         }
         return Response(metadata)
     
+    @action(detail=True, methods=['post'], url_path='ingest')
+    def ingest(self, request, pk=None):
+        """Queue the layer's files to be read again"""
+        layer = self.get_object()
+        if not layer.shapefile:
+            return Response(
+                {'error': 'Layer has no .shp file to ingest'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if layer.ingest_status in ('pending', 'running'):
+            return Response(
+                {'error': f'Ingestion is already {layer.ingest_status}'},
+                status=status.HTTP_409_CONFLICT
+            )
+        enqueue_ingest(layer)
+        serializer = self.get_serializer(layer)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+    
     @action(detail=True, methods=['post'], url_path='toggle-active')
     def toggle_active(self, request, pk=None):
         """Toggle the is_active status of a shapefile layer"""
@@ -73,6 +167,263 @@ class ShapefileLayerViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'], url_path='active')
     def active_layers(self, request):
         """Get only active shapefile layers"""
-        active_layers = self.queryset.filter(is_active=True)
+        active_layers = self.get_queryset().filter(is_active=True)
         serializer = self.get_serializer(active_layers, many=True)
         return Response(serializer.data)
+    
+    @action(detail=True, methods=['get'], url_path='features')
+    def features(self, request, pk=None):
+        """
+        Get the layer's features as GeoJSON
+        
+        Query parameters:
+        - bbox: min_lng,min_lat,max_lng,max_lat; only features intersecting it
+        - zoom: Map zoom level (0-22); geometries are simplified to suit it
+        - tolerance: Simplification tolerance in degrees (instead of zoom)
+        - page, page_size: Pagination (default 100, max 1000 per page)
+        - stream: Pass 1 to stream every matching feature instead of paging
+        """
+        layer = self.get_object()
+        queryset = layer.features.order_by('fid')
+        
+        bbox = request.query_params.get('bbox')
+        if bbox:
+            try:
+                min_lng, min_lat, max_lng, max_lat = [float(v) for v in bbox.split(',')]
+            except (ValueError, TypeError):
+                return Response(
+                    {'error': 'bbox must be min_lng,min_lat,max_lng,max_lat'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            envelope = Polygon.from_bbox((min_lng, min_lat, max_lng, max_lat))
+            envelope.srid = 4326
+            queryset = queryset.filter(geometry__intersects=envelope)
+        
+        try:
+            level = self._detail_level(request)
+        except (ValueError, TypeError):
+            return self._invalid_detail_level()
+        rows = self._feature_rows(queryset, level)
+        serializer = ShapefileFeatureSerializer()
+        
+        if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+            return self._stream_features(rows)
+        
+        paginator = ShapefileFeaturePagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
+        return paginator.get_paginated_response(
+            [serializer.to_representation(row) for row in page]
+        )
+    
+    @action(detail=True, methods=['get'], url_path='geojson')
+    def geojson(self, request, pk=None):
+        """
+        Stream the whole layer as a GeoJSON FeatureCollection
+        
+        Query parameters:
+        - zoom: Map zoom level (0-22); geometries are simplified to suit it
+        - tolerance: Simplification tolerance in degrees (instead of zoom)
+        """
+        layer = self.get_object()
+        try:
+            level = self._detail_level(request)
+        except (ValueError, TypeError):
+            return self._invalid_detail_level()
+        return self._stream_features(self._feature_rows(layer.features.order_by('fid'), level))
+    
+    def _feature_rows(self, queryset, level):
+        """``values()`` rows for ShapefileFeatureSerializer at a level of detail"""
+        geometry = F('geometry')
+        if level:
+            geometry = Coalesce(geometry_column(level), 'geometry')
+        return queryset.annotate(
+            geojson=AsGeoJSON(geometry, precision=precision(level))
+        ).values('fid', 'properties', 'geojson')
+    
+    def _stream_features(self, rows):
+        serializer = ShapefileFeatureSerializer()
+        return stream_feature_collection(
+            serializer.to_representation(row)
+            for row in rows.iterator(chunk_size=STREAM_CHUNK_SIZE)
+        )
+    
+    def _invalid_detail_level(self):
+        return Response(
+            {'error': 'zoom must be an integer and tolerance a number'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    def _detail_level(self, request):
+        """Level of detail for the ``zoom`` or ``tolerance`` query parameter"""
+        tolerance = request.query_params.get('tolerance')
+        if tolerance:
+            return level_for_tolerance(float(tolerance))
+        zoom = request.query_params.get('zoom')
+        if zoom:
+            return level_for_zoom(int(zoom))
+        return 0
+
+
+class ShapefileUploadViewSet(mixins.CreateModelMixin,
+                             mixins.RetrieveModelMixin,
+                             mixins.DestroyModelMixin,
+                             viewsets.GenericViewSet):
+    """
+    Resumable upload of a zipped shapefile
+    
+    1. POST /shapefile-uploads/ with name, description, filename and size
+    2. PUT the zip's bytes to /shapefile-uploads/{id}/chunk/?offset=N, in as
+       many chunks as needed; GET /shapefile-uploads/{id}/ shows how many
+       bytes were received so an interrupted upload can resume there
+    3. POST /shapefile-uploads/{id}/finalize/ with the file's sha256 to
+       create the layer
+    """
+    queryset = ShapefileUpload.objects.all()
+    serializer_class = ShapefileChunkedUploadSerializer
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    parser_classes = [JSONParser, FormParser]
+    
+    def perform_create(self, serializer):
+        serializer.save(uploaded_by=self.request.user)
+    
+    def perform_destroy(self, instance):
+        discard(instance)
+        instance.delete()
+    
+    @action(detail=True, methods=['put'], url_path='chunk')
+    def chunk(self, request, pk=None):
+        """Store the raw request body at ``offset``"""
+        try:
+            offset = int(request.query_params.get('offset', ''))
+        except ValueError:
+            return Response(
+                {'error': 'offset must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if request.stream is None:
+            return Response(
+                {'error': 'Chunk body is empty'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # The row lock keeps concurrent chunks from writing the file at once
+        with transaction.atomic():
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=pk)
+            if upload.status != 'uploading':
+                return Response(
+                    {'error': f'Upload is {upload.status}'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            if offset != upload.received:
+                return Response(
+                    {'error': f'Expected offset {upload.received}', 'received': upload.received},
+                    status=status.HTTP_409_CONFLICT
+                )
+            try:
+                # Read the body directly; request.data would buffer it all
+                upload.received = write_chunk(upload, offset, request.stream)
+            except UploadError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            upload.save(update_fields=['received', 'updated_at'])
+        return Response(self.get_serializer(upload).data)
+    
+    @action(detail=True, methods=['post'], url_path='finalize')
+    def finalize(self, request, pk=None):
+        """Verify the checksum, unpack the zip and create the layer"""
+        sha256 = str(request.data.get('sha256', '')).strip().lower()
+        if not re.fullmatch(r'[0-9a-f]{64}', sha256):
+            return Response(
+                {'error': 'sha256 must be the hex SHA-256 of the whole file'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        with transaction.atomic():
+            upload = get_object_or_404(self.get_queryset().select_for_update(), pk=pk)
+            if upload.status != 'uploading':
+                return Response(
+                    {'error': f'Upload is {upload.status}'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            if upload.received != upload.size:
+                return Response(
+                    {'error': f'Upload is incomplete: received {upload.received} of {upload.size} bytes'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            try:
+                if file_sha256(part_path(upload)) != sha256:
+                    raise UploadError('Checksum does not match the uploaded data')
+                with tempfile.TemporaryDirectory(dir=settings.SHAPEFILE_UPLOAD_DIR) as workdir:
+                    layer_serializer = self._create_layer(upload, extract_shapefile(part_path(upload), workdir))
+            except UploadError as e:
+                self._fail(upload, str(e))
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if layer_serializer.errors:
+                # Leave the upload open so it can be finalized again
+                return Response(layer_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            
+            upload.status = 'completed'
+            upload.layer = layer_serializer.instance
+            upload.save(update_fields=['status', 'layer', 'updated_at'])
+            transaction.on_commit(lambda: discard(upload))
+        return Response(layer_serializer.data, status=status.HTTP_201_CREATED)
+    
+    def _create_layer(self, upload, paths):
+        files = {extension: open(path, 'rb') for extension, path in paths.items()}
+        try:
+            def part(extension):
+                if extension not in files:
+                    return None
+                return File(files[extension], name=paths[extension].name)
+            
+            return create_layer({
+                'name': upload.name,
+                'description': upload.description,
+                'shapefile': part('.shp'),
+                'shx_file': part('.shx'),
+                'dbf_file': part('.dbf'),
+                'prj_file': part('.prj'),
+            }, self.request.user)
+        finally:
+            for f in files.values():
+                f.close()
+    
+    def _fail(self, upload, error):
+        upload.status = 'failed'
+        upload.error = error
+        upload.save(update_fields=['status', 'error', 'updated_at'])
+        discard(upload)
+
+
+def _invalid_tile(z, x, y):
+    return Response(
+        {'error': f'Invalid tile coordinates: {z}/{x}/{y}'},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def layer_tile(request, pk, z, x, y):
+    """
+    Return one shapefile layer in tile z/x/y as a Mapbox Vector Tile.
+    
+    Geometries are clipped to the tile and simplified for its zoom. Inactive
+    layers are only served to admins.
+    """
+    if not is_valid_tile(z, x, y):
+        return _invalid_tile(z, x, y)
+    layers = ShapefileLayer.objects.only('id', 'name', 'is_active')
+    if not request.user.is_staff:
+        layers = layers.filter(is_active=True)
+    layer = get_object_or_404(layers, pk=pk)
+    return HttpResponse(get_layer_tile(layer, z, x, y), content_type='application/vnd.mapbox-vector-tile')
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def active_layers_tile(request, z, x, y):
+    """Return every active shapefile layer in tile z/x/y, one MVT layer each"""
+    if not is_valid_tile(z, x, y):
+        return _invalid_tile(z, x, y)
+    return HttpResponse(get_active_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
@@ -5,3 +5,6 @@ class FacilitiesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'facilities'
     verbose_name = 'Health Facilities'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,90 @@
+"""
+k-nearest facilities for many origins in one request.
+
+Origins are matched against a FacilityIndex a chunk at a time. Each chunk
+takes one STRtree query for all of its search boxes, vectorised haversine
+distances for the candidate pairs and a lexsort that keeps the k nearest per
+origin (``FacilityIndex.nearest_many``). Facility rows are loaded once, the
+first time a chunk refers to them, so the database sees one query per chunk
+at most.
+"""
+import numpy as np
+
+
+# Most origins accepted in one request
+MAX_ORIGINS = 100000
+
+# Most facilities returned per origin
+MAX_K = 100
+
+# Origins matched per index query; also the size above which results stream
+CHUNK_SIZE = 2000
+
+
+def parse_origins(origins):
+    """
+    Return (lngs, lats, labels) for a list of ``{"lat", "lng"[, "id"]}``
+    objects or ``[lng, lat]`` pairs. Raises ValueError for anything else.
+    """
+    if not isinstance(origins, list) or not origins:
+        raise ValueError('origins must be a non-empty list')
+    if len(origins) > MAX_ORIGINS:
+        raise ValueError(f'At most {MAX_ORIGINS} origins are allowed per request')
+
+    lngs = np.empty(len(origins), dtype=np.float64)
+    lats = np.empty(len(origins), dtype=np.float64)
+    labels = []
+    for position, origin in enumerate(origins):
+        try:
+            if isinstance(origin, dict):
+                lng, lat, label = origin['lng'], origin['lat'], origin.get('id', position)
+            else:
+                (lng, lat), label = origin, position
+            lngs[position], lats[position] = float(lng), float(lat)
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'Origin {position} must be {{"lat", "lng"}} or [lng, lat]')
+        if not (-180 <= lngs[position] <= 180 and -90 <= lats[position] <= 90):
+            raise ValueError(f'Origin {position} is out of range')
+        labels.append(label)
+    return lngs, lats, labels
+
+
+def iter_nearest(index, lngs, lats, labels, k, radius_m, amenity, load, represent):
+    """
+    Yield ``{"origin", "count", "facilities"}`` for every origin, in order.
+
+    ``load(ids)`` returns ``{id: facility}`` for facility ids, and
+    ``represent(facility, distance_m)`` serializes one facility for one
+    origin.
+    """
+    loaded = {}
+    for start in range(0, len(lngs), CHUNK_SIZE):
+        stop = min(start + CHUNK_SIZE, len(lngs))
+        origins, ids, distances = index.nearest_many(
+            lngs[start:stop], lats[start:stop], k, radius_m, amenity
+        )
+        missing = [int(pk) for pk in np.unique(ids) if int(pk) not in loaded]
+        if missing:
+            loaded.update(load(missing))
+
+        # Split the flat, origin-sorted arrays into one run per origin
+        bounds = np.searchsorted(origins, np.arange(stop - start + 1))
+        for offset in range(stop - start):
+            position = start + offset
+            facilities = [
+                represent(loaded[int(pk)], float(distance))
+                for pk, distance in zip(
+                    ids[bounds[offset]:bounds[offset + 1]],
+                    distances[bounds[offset]:bounds[offset + 1]],
+                )
+                if int(pk) in loaded
+            ]
+            yield {
+                'origin': {
+                    'id': labels[position],
+                    'latitude': float(lats[position]),
+                    'longitude': float(lngs[position]),
+                },
+                'count': len(facilities),
+                'facilities': facilities,
+            }
@@ -0,0 +1,119 @@
+"""
+Point-in-polygon lookups against district and region boundary layers.
+
+A ShapefileLayer becomes the district (or region) boundary layer by setting
+its ``boundary_role``; ``boundary_name_field`` names the feature property
+holding each polygon's name. Its polygons are loaded into a shapely STRtree
+of prepared geometries held in memory, so locating a point is a bounding-box
+probe plus one or two prepared containment tests. ``locate_many`` runs the
+same lookup for whole arrays of points at once.
+
+Indexes are rebuilt lazily when any layer changes (see ``admin.tiles``).
+"""
+import threading
+
+import numpy as np
+import shapely
+
+from admin.models import BOUNDARY_ROLES, ShapefileLayer
+from admin.tiles import LAYERS_VERSION
+
+from .cache import data_version
+
+
+ROLES = [role for role, _ in BOUNDARY_ROLES]
+
+
+class BoundaryIndex:
+    """Immutable snapshot of one boundary layer's polygons and names"""
+
+    def __init__(self, layer_id, fids, names, geometries):
+        self.layer_id = layer_id
+        self.fids = np.asarray(fids, dtype=np.int64)
+        self.names = np.asarray(names, dtype=object)
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    @classmethod
+    def from_layer(cls, layer):
+        fids, names, geometries = [], [], []
+        rows = layer.features.order_by('fid').values_list('fid', 'properties', 'geometry')
+        for fid, properties, geometry in rows.iterator(chunk_size=500):
+            fids.append(fid)
+            name = properties.get(layer.boundary_name_field)
+            names.append(None if name is None else str(name).strip())
+            geometries.append(shapely.from_wkb(bytes(geometry.wkb)))
+        return cls(layer.pk, fids, names, geometries)
+
+    def __len__(self):
+        return len(self.fids)
+
+    def locate(self, lng, lat):
+        """Return the position of the polygon containing the point, or None"""
+        point = shapely.points(lng, lat)
+        candidates = self.tree.query(point)
+        if len(candidates):
+            # Points on a shared border belong to the lowest fid
+            hits = np.sort(candidates[shapely.intersects(self.geometries[candidates], point)])
+            if len(hits):
+                return int(hits[0])
+        return None
+
+    def locate_many(self, lngs, lats):
+        """
+        Return, for each point, the position of the polygon containing it or
+        -1 when it lies outside every polygon.
+        """
+        points = shapely.points(np.asarray(lngs, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+        positions = np.full(len(points), -1, dtype=np.int64)
+        if not len(points) or not len(self):
+            return positions
+
+        point_idx, polygon_idx = self.tree.query(points)
+        hit = shapely.intersects(self.geometries[polygon_idx], points[point_idx])
+        point_idx, polygon_idx = point_idx[hit], polygon_idx[hit]
+        # Keep the lowest fid for points on shared borders: assign in
+        # descending order so the smallest position is written last
+        order = np.argsort(-polygon_idx, kind='stable')
+        positions[point_idx[order]] = polygon_idx[order]
+        return positions
+
+    def describe(self, position):
+        if position is None:
+            return None
+        return {
+            'name': self.names[position],
+            'layer': self.layer_id,
+            'fid': int(self.fids[position]),
+        }
+
+
+_indexes = {}
+_indexes_version = None
+_indexes_lock = threading.Lock()
+
+
+def get_boundary_index(role):
+    """Return the BoundaryIndex for ``role``, or None when no layer has that role"""
+    global _indexes, _indexes_version
+
+    version = data_version(LAYERS_VERSION)
+    with _indexes_lock:
+        if _indexes_version != version:
+            _indexes, _indexes_version = {}, version
+        if role not in _indexes:
+            layer = ShapefileLayer.objects.filter(boundary_role=role).only(
+                'id', 'boundary_name_field'
+            ).first()
+            _indexes[role] = BoundaryIndex.from_layer(layer) if layer else None
+    return _indexes[role]
+
+
+def locate(lng, lat):
+    """Return ``{role: {'name', 'layer', 'fid'} or None}`` for a point"""
+    result = {}
+    for role in ROLES:
+        index = get_boundary_index(role)
+        result[role] = index.describe(index.locate(lng, lat)) if index else None
+    return result
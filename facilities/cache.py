@@ -0,0 +1,47 @@
+"""
+Cross-process invalidation for data derived from HealthFacility rows.
+
+Web workers keep in-memory indexes and caches, while imports run in a
+separate management command process. A change is announced by rewriting a
+small version file under FACILITY_CACHE_DIR that every process can read.
+"""
+import os
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _version_path(name):
+    return Path(settings.FACILITY_CACHE_DIR) / f'{name}.version'
+
+
+def data_version(name='facilities'):
+    """Return a token that changes every time bump_data_version(name) runs"""
+    try:
+        return _version_path(name).read_text()
+    except FileNotFoundError:
+        return ''
+
+
+def bump_data_version(name='facilities'):
+    """Mark everything derived from ``name`` data as stale"""
+    path = _version_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp_path.write_text(uuid.uuid4().hex)
+    os.replace(tmp_path, path)
+
+
+def cached_result(key, compute, timeout=None):
+    """
+    Return ``compute()``, cached in Django's cache until facility data next
+    changes.
+    """
+    cache_key = f'facilities:{key}:{data_version()}'
+    result = cache.get(cache_key)
+    if result is None:
+        result = compute()
+        cache.set(cache_key, result, timeout)
+    return result
@@ -0,0 +1,16 @@
+"""
+Case-insensitive equality filters for facility attributes.
+
+Django's ``__iexact`` compiles to ``UPPER("col"::text) = UPPER(%s)``, which
+does not line up with the ``Upper()`` expression indexes declared on
+HealthFacility. ``iexact`` compares ``UPPER("col")`` directly so the planner
+can match those indexes (``hf_*_upper_idx``).
+"""
+from django.db.models import F, Value
+from django.db.models.functions import Upper
+from django.db.models.lookups import Exact
+
+
+def iexact(field, value):
+    """Return a filter expression for ``field`` equal to ``value`` ignoring case"""
+    return Exact(Upper(F(field)), Upper(Value(value)))
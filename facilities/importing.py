@@ -0,0 +1,349 @@
+"""
+Turn GeoJSON features from the Malawi health facility export into
+HealthFacility field values.
+
+Shared by the ``load_facilities`` import paths so they agree on parsing,
+normalisation and which features are skipped.
+"""
+import codecs
+import hashlib
+import json
+import math
+from pathlib import Path
+
+from django.contrib.gis.geos import Point
+
+
+class SkipFeature(Exception):
+    """Raised for features that cannot be imported"""
+
+
+def parse_int(value):
+    """Safely parse integer values"""
+    if value is None or value == '':
+        return None
+    try:
+        return int(float(value))
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_float(value):
+    """Safely parse float values"""
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def parse_lookup(value):
+    """Normalize a filterable value: trimmed, single-spaced, blank as None"""
+    if value is None:
+        return None
+    value = ' '.join(str(value).split())
+    return value or None
+
+
+def parse_text(value):
+    """Text values are stored as exported"""
+    return value
+
+
+# (model field, GeoJSON property, parser); property names are the 10-character
+# shapefile column names used in the export
+PROPERTY_FIELDS = [
+    ('osm_type', 'osm_type', parse_text),
+    ('uuid', 'uuid', parse_text),
+    ('district', 'district', parse_lookup),
+    ('region', 'region', parse_lookup),
+    ('area', 'area', parse_float),
+    ('perimeter', 'perimeter', parse_float),
+    ('amenity', 'amenity', parse_lookup),
+    ('healthcare', 'healthcare', parse_text),
+    ('speciality', 'speciality', parse_text),
+    ('health_amenity', 'health_ame', parse_text),
+    ('operator', 'operator', parse_text),
+    ('operator_type', 'operator_t', parse_text),
+    ('operational_status', 'operationa', parse_text),
+    ('beds', 'beds', parse_int),
+    ('staff_doctors', 'staff_doct', parse_int),
+    ('staff_nurses', 'staff_nurs', parse_int),
+    ('dispensing', 'dispensing', parse_text),
+    ('wheelchair', 'wheelchair', parse_lookup),
+    ('emergency', 'emergency', parse_lookup),
+    ('insurance', 'insurance', parse_text),
+    ('water_source', 'water_sour', parse_text),
+    ('electricity', 'electricit', parse_text),
+    ('url', 'url', parse_text),
+    ('opening_hours', 'opening_ho', parse_text),
+    ('addr_housenumber', 'addr_house', parse_text),
+    ('addr_street', 'addr_stree', parse_text),
+    ('addr_postcode', 'addr_postc', parse_text),
+    ('addr_city', 'addr_city', parse_text),
+    ('source', 'source', parse_text),
+    ('completeness', 'completene', parse_float),
+    ('changeset_id', 'changeset_', parse_int),
+    ('changeset_version', 'changese_1', parse_int),
+    ('changeset_timestamp', 'changese_2', parse_text),
+    ('is_in_health_system', 'is_in_heal', parse_text),
+    ('is_in_health_system_1', 'is_in_he_1', parse_text),
+]
+
+# Fields covered by a facility's content hash
+HASHED_FIELDS = ['name', 'location'] + [field for field, _, _ in PROPERTY_FIELDS]
+
+# Every field written by an import (the update set for bulk_update)
+IMPORTED_FIELDS = HASHED_FIELDS + ['content_hash']
+
+
+def content_hash(data):
+    """
+    Return a SHA-256 hex digest of the imported values in ``data`` (with the
+    location as a ``(lng, lat)`` tuple). Delta imports skip rows whose stored
+    hash matches.
+    """
+    payload = json.dumps(
+        [data[field] for field in HASHED_FIELDS],
+        separators=(',', ':'), ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def parse_feature(feature):
+    """
+    Return ``(osm_id, field values)`` for a GeoJSON feature, with the location
+    as a ``(lng, lat)`` tuple, or raise SkipFeature when it has no coordinates
+    or OSM ID.
+    """
+    properties = feature.get('properties') or {}
+    geometry = feature.get('geometry') or {}
+
+    # Extract coordinates
+    coordinates = geometry.get('coordinates', [])
+    if not coordinates or len(coordinates) < 2:
+        raise SkipFeature('No valid coordinates')
+    lng, lat = float(coordinates[0]), float(coordinates[1])
+
+    # Get OSM ID
+    osm_id = properties.get('osm_id')
+    if not osm_id:
+        raise SkipFeature('No OSM ID')
+
+    facility_name = properties.get('name')
+    if not facility_name or facility_name.strip() == '':
+        facility_name = f'Unnamed {properties.get("amenity", "Facility")} {osm_id}'
+
+    data = {
+        'name': facility_name,
+        'location': (lng, lat),
+    }
+    for field, key, parse in PROPERTY_FIELDS:
+        data[field] = parse(properties.get(key))
+    data['content_hash'] = content_hash(data)
+    return int(osm_id), data
+
+
+def feature_to_row(feature):
+    """Like ``parse_feature``, with the location as a Point ready for the ORM"""
+    osm_id, data = parse_feature(feature)
+    data['location'] = Point(*data['location'], srid=4326)
+    return osm_id, data
+
+
+# --- COPY rows for the parallel import ------------------------------------
+
+# Staging table columns after the leading feature index, in COPY order
+COPY_FIELDS = ['osm_id'] + IMPORTED_FIELDS
+
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value):
+    """Format a value for PostgreSQL's COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value).translate(_COPY_ESCAPES)
+
+
+def copy_limits(model, connection):
+    """
+    Return ``(lengths, ranges)`` for the COPY_FIELDS of ``model``: the
+    max_length of each text column and the (min, max) of each integer
+    column. COPY rejects the whole stream on the first value outside them,
+    so ``copy_chunk`` checks them per feature instead.
+    """
+    lengths, ranges = {}, {}
+    for name in COPY_FIELDS:
+        field = model._meta.get_field(name)
+        internal_type = field.get_internal_type()
+        if getattr(field, 'max_length', None):
+            lengths[name] = field.max_length
+        elif internal_type in connection.ops.integer_field_ranges:
+            ranges[name] = connection.ops.integer_field_range(internal_type)
+    return lengths, ranges
+
+
+def check_copy_values(values, limits):
+    """Raise ValueError if a value in ``values`` would make COPY fail"""
+    lengths, ranges = limits
+    for name, value in values.items():
+        if value is None:
+            continue
+        if name in lengths and len(str(value)) > lengths[name]:
+            raise ValueError(f'{name} is longer than {lengths[name]} characters')
+        if name in ranges and not ranges[name][0] <= value <= ranges[name][1]:
+            raise ValueError(f'{name} {value} is out of range')
+        if isinstance(value, str) and '\x00' in value:
+            raise ValueError(f'{name} contains a NUL character')
+    lng, lat = values['location']
+    if not (math.isfinite(lng) and math.isfinite(lat)):
+        raise ValueError('Coordinates must be finite numbers')
+
+
+def copy_chunk(chunk, limits=({}, {})):
+    """
+    Parse ``[(index, feature), ...]``, where each feature is a dict or its
+    JSON text, into COPY text lines, one per valid
+    feature, prefixed by the feature index. Returns ``(text, problems)``
+    where ``problems`` lists ``(index, skipped, message)`` for features that
+    could not be imported, including values outside ``limits`` (see
+    ``copy_limits``).
+
+    Runs in import worker processes, so it avoids GEOS and the database: the
+    location is written as EWKT and parsed by PostGIS during COPY.
+    """
+    lines, problems = [], []
+    for index, feature in chunk:
+        try:
+            if isinstance(feature, str):
+                feature = json.loads(feature)
+            osm_id, data = parse_feature(feature)
+            check_copy_values({'osm_id': osm_id, **data}, limits)
+        except SkipFeature as e:
+            problems.append((index, True, str(e)))
+            continue
+        except Exception as e:
+            problems.append((index, False, str(e)))
+            continue
+        data['location'] = 'SRID=4326;POINT(%r %r)' % data['location']
+        values = [index, osm_id] + [data[field] for field in IMPORTED_FIELDS]
+        lines.append('\t'.join(copy_value(value) for value in values) + '\n')
+    return ''.join(lines), problems
+
+
+class FeatureReader:
+    """
+    Iterate over the features of a GeoJSON FeatureCollection without loading
+    the whole document.
+
+    The file is read in ``chunk_size`` byte chunks and each feature is decoded
+    on its own with ``JSONDecoder.raw_decode``, so memory use is bounded by the
+    largest single feature rather than the file. ``bytes_read`` and
+    ``total_bytes`` support progress reporting. With ``raw=True`` each
+    feature is yielded as its JSON text, which is cheaper to hand to another
+    process than the decoded dict.
+    """
+
+    def __init__(self, path, chunk_size=1 << 16, raw=False):
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.raw = raw
+        self.total_bytes = self.path.stat().st_size
+        self.bytes_read = 0
+        self._decoder = json.JSONDecoder()
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            self._file = f
+            self._text = codecs.getincrementaldecoder('utf-8-sig')()
+            self._buffer = ''
+            self._pos = 0
+            self._eof = False
+
+            self._expect('{')
+            if self._peek() == '}':
+                return
+            while True:
+                key = self._value()
+                self._expect(':')
+                if key == 'features':
+                    yield from self._array()
+                else:
+                    self._value()
+                if self._next() == '}':
+                    return
+                self._pos -= 1
+                self._expect(',')
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            feature = self._value()
+            yield self._buffer[self._start:self._pos] if self.raw else feature
+            if self._next() == ']':
+                return
+            self._pos -= 1
+            self._expect(',')
+            # Drop what has been decoded so the buffer stays about one chunk long
+            if self._pos > self.chunk_size:
+                self._buffer = self._buffer[self._pos:]
+                self._pos = 0
+
+    def _fill(self):
+        """Read another chunk; return False at end of file"""
+        if self._eof:
+            return False
+        chunk = self._file.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        if not chunk:
+            self._eof = True
+            self._buffer += self._text.decode(b'', final=True)
+            return False
+        self._buffer = self._buffer[self._pos:] + self._text.decode(chunk)
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Return the next non-whitespace character without consuming it"""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in ' \t\r\n':
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of GeoJSON file')
+
+    def _next(self):
+        char = self._peek()
+        self._pos += 1
+        return char
+
+    def _expect(self, char):
+        found = self._next()
+        if found != char:
+            raise ValueError(
+                f'Invalid GeoJSON: expected {char!r} at byte ~{self.bytes_read}, found {found!r}'
+            )
+
+    def _value(self):
+        """Decode the JSON value at the current position"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._start, self._pos = self._pos, end
+            return value
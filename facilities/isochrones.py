@@ -0,0 +1,283 @@
+"""
+Isochrones: the area within given travel times or distances of a facility.
+
+With a road graph (``facilities.routing``), a search from the facility finds
+every road segment within reach of the largest cutoff. For each cutoff the
+roads are followed as far as the budget allows, points along them are
+buffered by the distance still left to cover off-road, and the buffers are
+merged. The buffering happens in an azimuthal equidistant projection centred
+on the facility. Without a graph only distance cutoffs can be answered, as
+geodesic circles (a circle in that projection).
+
+Results are cached on disk per facility and cutoff under FACILITY_CACHE_DIR
+(``precompute_isochrones`` fills the cache ahead of time); requests only
+compute a few missing facilities each, see MAX_UNCACHED. They are keyed by
+the facility's position and the road graph version, so moving a facility or
+rebuilding the graph never serves a stale polygon. Saving or deleting a
+facility also drops its entries (see ``signals``).
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+import shapely
+from django.conf import settings
+from pyproj import Transformer
+
+from .cache import data_version
+from .geodesy import WGS84
+from .routing import GRAPH_VERSION, SearchTooLarge, get_graph, off_road_speed
+from .streaming import dumps
+
+
+# Cutoff unit and its size in seconds or metres, per metric
+METRICS = {
+    'time': ('minutes', 60),
+    'distance': ('km', 1000),
+}
+
+DEFAULT_CUTOFFS = {
+    'time': [15, 30, 60],
+    'distance': [5, 10, 25],
+}
+
+# Largest cutoff accepted per metric, in the metric's unit
+MAX_CUTOFF = {
+    'time': 120,
+    'distance': 300,
+}
+
+# Cutoffs are rounded to multiples of this step, in the metric's unit, so
+# the cache holds a bounded set of files per facility
+CUTOFF_STEP = {
+    'time': 5,
+    'distance': 5,
+}
+
+MAX_CUTOFFS = 5
+
+# Facilities per multi-facility request
+MAX_FACILITIES = 20
+
+# Facilities without cached isochrones that one request may compute; the
+# rest are left to later requests or precompute_isochrones
+MAX_UNCACHED = 3
+
+# Road junctions a request's isochrone search may reach, for cutoffs beyond
+# the largest default one (see node_budget)
+MAX_NODES = 20000
+
+# Reached nodes are thinned to one per grid cell before buffering; cells are
+# this fraction of the isochrone's extent, but at least MIN_CELL_M
+GRID_CELLS = 200
+MIN_CELL_M = 50
+
+
+class NoRoadGraph(Exception):
+    """Raised for travel time isochrones when no road graph is available"""
+
+
+class IsochroneTooLarge(Exception):
+    """Raised when the largest cutoff reaches more junctions than allowed"""
+
+
+def parse_cutoffs(text, metric):
+    """
+    Parse a comma-separated list of cutoffs into sorted, distinct floats,
+    each rounded to the nearest multiple of the metric's CUTOFF_STEP
+    """
+    if metric not in METRICS:
+        raise ValueError(f'metric must be one of {", ".join(METRICS)}')
+    if not text:
+        return [float(cutoff) for cutoff in DEFAULT_CUTOFFS[metric]]
+    try:
+        values = [float(value) for value in text.split(',') if value.strip()]
+    except ValueError:
+        raise ValueError('cutoffs must be a comma-separated list of numbers')
+    unit = METRICS[metric][0]
+    if not all(0 < value <= MAX_CUTOFF[metric] for value in values):
+        raise ValueError(f'cutoffs must be above 0 and at most {MAX_CUTOFF[metric]} {unit}')
+    step = CUTOFF_STEP[metric]
+    cutoffs = sorted({float(max(round(value / step), 1) * step) for value in values})
+    if not cutoffs or len(cutoffs) > MAX_CUTOFFS:
+        raise ValueError(f'Give between 1 and {MAX_CUTOFFS} cutoffs')
+    return cutoffs
+
+
+def node_budget(cutoffs, metric):
+    """
+    Junctions a request may reach to compute ``cutoffs``: no limit up to the
+    largest default cutoff, so the defaults can always be answered, and
+    MAX_NODES beyond it
+    """
+    if max(cutoffs) <= max(DEFAULT_CUTOFFS[metric]):
+        return None
+    return MAX_NODES
+
+
+def isochrone_polygons(lng, lat, cutoffs, metric, graph, max_nodes=None):
+    """
+    Return one shapely geometry (lng/lat) per cutoff, and whether they follow
+    the road graph. Raises IsochroneTooLarge if the search reaches more than
+    ``max_nodes`` junctions.
+    """
+    size = METRICS[metric][1]
+    limits = [cutoff * size for cutoff in cutoffs]
+    if graph is None and metric == 'time':
+        raise NoRoadGraph('Travel time isochrones need a road graph (see build_road_graph)')
+
+    local = Transformer.from_crs(
+        'EPSG:4326', f'+proj=aeqd +lat_0={lat} +lon_0={lng} +datum=WGS84 +units=m', always_xy=True
+    )
+
+    def to_lnglat(coords):
+        return np.column_stack(local.transform(coords[:, 0], coords[:, 1], direction='INVERSE'))
+
+    if graph is None:
+        # Geodesic circles: distances from the projection centre are exact
+        centre = shapely.points(np.zeros(len(limits)), np.zeros(len(limits)))
+        circles = shapely.buffer(centre, limits, quad_segs=16)
+        return [shapely.transform(circle, to_lnglat) for circle in circles], False
+
+    # Metres that one unit of remaining cost buys off-road
+    off_road = off_road_speed() if metric == 'time' else 1.0
+    weight = 'time' if metric == 'time' else 'distance'
+    try:
+        lngs, lats, segments, segment_costs = graph.reached_segments(lng, lat, weight, max(limits), max_nodes)
+    except SearchTooLarge:
+        raise IsochroneTooLarge(
+            f'a {max(cutoffs):g} {METRICS[metric][0]} cutoff reaches more than {max_nodes} road junctions'
+        )
+    point_x, point_y = local.transform(lngs, lats)
+    segment_x, segment_y = point_x[segments], point_y[segments]
+    segment_lengths = np.hypot(segment_x[:, 1] - segment_x[:, 0], segment_y[:, 1] - segment_y[:, 0])
+
+    polygons = []
+    for limit in limits:
+        # The facility itself is always a starting point, reached at no cost
+        x, y, costs = [np.zeros(1)], [np.zeros(1)], [np.zeros(1)]
+        going = segment_costs[:, 0] < limit
+        start_x, start_y, start_costs = segment_x[going, 0], segment_y[going, 0], segment_costs[going, 0]
+        x.append(start_x)
+        y.append(start_y)
+        costs.append(start_costs)
+        extent = max(float(np.max(np.hypot(start_x, start_y), initial=0.0)) + limit * off_road, 1.0)
+        cell = max(extent / GRID_CELLS, MIN_CELL_M)
+
+        # Points every cell along each road segment, up to where the budget runs out
+        step_costs = segment_costs[going, 1] - start_costs
+        reach = np.ones(going.sum())
+        moving = step_costs > 0
+        reach[moving] = np.minimum((limit - start_costs[moving]) / step_costs[moving], 1.0)
+        steps = np.maximum(np.ceil(reach * segment_lengths[going] / cell), 1).astype(np.int64)
+        along = np.repeat(np.arange(len(steps)), steps)
+        fraction = (np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps) + 1) / steps[along] * reach[along]
+        end_x, end_y = segment_x[going, 1], segment_y[going, 1]
+        x.append(start_x[along] + fraction * (end_x[along] - start_x[along]))
+        y.append(start_y[along] + fraction * (end_y[along] - start_y[along]))
+        costs.append(start_costs[along] + fraction * step_costs[along])
+
+        x, y, costs = np.concatenate(x), np.concatenate(y), np.concatenate(costs)
+        radii = np.maximum(limit - costs, 0.0) * off_road
+
+        # Keep the point with the most budget left in each grid cell
+        order = np.argsort(-radii, kind='stable')
+        column = np.floor(x[order] / cell).astype(np.int64)
+        row = np.floor(y[order] / cell).astype(np.int64)
+        keys = (column - column.min()) * (row.max() - row.min() + 1) + (row - row.min())
+        _, first = np.unique(keys, return_index=True)
+        chosen = order[first]
+
+        buffers = shapely.buffer(shapely.points(x[chosen], y[chosen]), radii[chosen], quad_segs=4)
+        polygon = shapely.union_all(buffers).simplify(cell / 2)
+        polygons.append(shapely.transform(polygon, to_lnglat))
+    return polygons, True
+
+
+def features_for(facility_id, cutoffs, metric, polygons, on_roads):
+    """GeoJSON features for one facility's isochrones, smallest cutoff first"""
+    unit = METRICS[metric][0]
+    features = []
+    for cutoff, polygon in zip(cutoffs, polygons):
+        polygon = shapely.set_precision(polygon, 1e-6)
+        area, _ = WGS84.geometry_area_perimeter(polygon) if not polygon.is_empty else (0.0, 0.0)
+        features.append({
+            'type': 'Feature',
+            'geometry': json.loads(shapely.to_geojson(polygon)),
+            'properties': {
+                'facility': facility_id,
+                'metric': metric,
+                'cutoff': cutoff,
+                'unit': unit,
+                'method': 'road' if on_roads else 'straight_line',
+                'area_km2': round(abs(area) / 1e6, 3),
+            },
+        })
+    return features
+
+
+def _cache_root():
+    return Path(settings.FACILITY_CACHE_DIR) / 'isochrones'
+
+
+def facility_isochrones(facility_id, lng, lat, cutoffs, metric, compute=True, max_nodes=None):
+    """
+    Return one facility's isochrone features, one per cutoff. Each cutoff is
+    cached in its own file, so any mix of cutoffs reuses earlier work, and
+    missing ones are computed together from a single search, limited to
+    ``max_nodes`` junctions. With ``compute=False``, return None instead if
+    any cutoff is missing.
+    """
+    graph = get_graph()
+    version = (data_version(GRAPH_VERSION) or 'initial') if graph is not None else 'straight-line'
+    position = hashlib.sha1(json.dumps([lng, lat]).encode()).hexdigest()[:16]
+    folder = _cache_root() / str(facility_id) / version
+    paths = {cutoff: folder / f'{position}-{metric}-{cutoff:g}.json' for cutoff in cutoffs}
+
+    features = {}
+    for cutoff, path in paths.items():
+        try:
+            features[cutoff] = json.loads(path.read_bytes())
+        except FileNotFoundError:
+            pass
+
+    missing = [cutoff for cutoff in cutoffs if cutoff not in features]
+    if missing and not compute:
+        return None
+    if missing:
+        polygons, on_roads = isochrone_polygons(lng, lat, missing, metric, graph, max_nodes)
+        folder.mkdir(parents=True, exist_ok=True)
+        for cutoff, feature in zip(missing, features_for(facility_id, missing, metric, polygons, on_roads)):
+            tmp_path = paths[cutoff].with_name(f'{paths[cutoff].name}.{os.getpid()}.tmp')
+            tmp_path.write_text(dumps(feature))
+            os.replace(tmp_path, paths[cutoff])
+            features[cutoff] = feature
+    return [features[cutoff] for cutoff in cutoffs]
+
+
+def union_features(features, cutoffs, metric):
+    """Merge several facilities' features into one coverage area per cutoff"""
+    merged = []
+    for cutoff in cutoffs:
+        group = [f for f in features if f['properties']['cutoff'] == cutoff]
+        polygon = shapely.union_all([shapely.from_geojson(json.dumps(f['geometry'])) for f in group])
+        feature, = features_for(
+            None, [cutoff], metric, [polygon],
+            any(f['properties']['method'] == 'road' for f in group),
+        )
+        del feature['properties']['facility']
+        feature['properties']['facilities'] = [f['properties']['facility'] for f in group]
+        merged.append(feature)
+    return merged
+
+
+def discard_isochrones(facility_id):
+    """Drop every cached isochrone of one facility"""
+    shutil.rmtree(_cache_root() / str(facility_id), ignore_errors=True)
+
+
+def clear_isochrone_cache():
+    shutil.rmtree(_cache_root(), ignore_errors=True)
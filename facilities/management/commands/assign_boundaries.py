@@ -0,0 +1,102 @@
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from facilities.boundaries import ROLES, get_boundary_index
+from facilities.cache import bump_data_version
+from facilities.models import HealthFacility
+from facilities.tiles import clear_tile_cache
+
+
+class Command(BaseCommand):
+    help = "Set every facility's district/region from the boundary shapefile layers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--role',
+            choices=ROLES,
+            action='append',
+            help='Only assign this attribute (repeatable; default: every role with a boundary layer)'
+        )
+        parser.add_argument(
+            '--uppercase',
+            action='store_true',
+            help='Store names in upper case, like the OSM import (e.g. LILONGWE)'
+        )
+        parser.add_argument(
+            '--clear-unmatched',
+            action='store_true',
+            help='Clear the attribute for facilities outside every polygon instead of keeping it'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Facilities updated per query (default: 1000)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without saving'
+        )
+
+    def handle(self, *args, **options):
+        indexes = {}
+        for role in options['role'] or ROLES:
+            index = get_boundary_index(role)
+            if index is None:
+                self.stdout.write(self.style.WARNING(f'No shapefile layer has boundary_role={role}'))
+            else:
+                indexes[role] = index
+        if not indexes:
+            return
+
+        # One pass over the table, then one vectorised lookup per role
+        fields = list(indexes)
+        ids, lngs, lats, current = [], [], [], {field: [] for field in fields}
+        rows = HealthFacility.objects.values_list('id', 'location', *fields)
+        for pk, location, *values in rows.iterator(chunk_size=5000):
+            ids.append(pk)
+            lngs.append(location.x)
+            lats.append(location.y)
+            for field, value in zip(fields, values):
+                current[field].append(value)
+
+        assigned = {}
+        changed = np.zeros(len(ids), dtype=bool)
+        for field, index in indexes.items():
+            positions = index.locate_many(lngs, lats)
+            matched = positions >= 0
+            names = np.asarray(current[field], dtype=object)
+            if options['clear_unmatched']:
+                names[~matched] = None
+            found = index.names[positions[matched]]
+            if options['uppercase']:
+                found = np.array([n.upper() if n else n for n in found], dtype=object)
+            names[matched] = found
+            changed |= names != np.asarray(current[field], dtype=object)
+            assigned[field] = names
+            self.stdout.write(
+                f'{field}: {int(matched.sum())} of {len(ids)} facilities inside a polygon'
+            )
+
+        changed_positions = np.flatnonzero(changed)
+        if not options['dry_run'] and len(changed_positions):
+            now = timezone.now()
+            facilities = [
+                HealthFacility(
+                    id=ids[position], updated_at=now,
+                    **{field: assigned[field][position] for field in fields}
+                )
+                for position in changed_positions
+            ]
+            with transaction.atomic():
+                HealthFacility.objects.bulk_update(
+                    facilities, fields + ['updated_at'], batch_size=max(options['batch_size'], 1)
+                )
+            # Rebuild in-memory indexes and caches in every process
+            bump_data_version()
+            clear_tile_cache()
+
+        verb = 'Would update' if options['dry_run'] else 'Updated'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(changed_positions)} facilities'))
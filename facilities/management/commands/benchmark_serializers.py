@@ -0,0 +1,137 @@
+import random
+import time
+
+from django.contrib.gis.geos import Point
+from django.contrib.gis.measure import D
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from facilities.fast_serializers import STX, STY, FastFacilitySerializer
+from facilities.models import HealthFacility
+from facilities.serializers import (
+    HealthFacilityGeoJSONSerializer,
+    HealthFacilityListSerializer,
+    NearbyFacilitySerializer,
+)
+
+
+SERIALIZERS = {
+    'list': HealthFacilityListSerializer,
+    'nearby': NearbyFacilitySerializer,
+    'geojson': HealthFacilityGeoJSONSerializer,
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare DRF facility serializers with the values()-based fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            default=1000,
+            help='Number of facilities to serialize'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Timed runs per serializer (best run is reported)'
+        )
+        parser.add_argument(
+            '--from-db',
+            action='store_true',
+            help='Serialize facilities from the database instead of synthetic rows'
+        )
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/facilities/'))
+        context = {'request': request}
+
+        if options['from_db']:
+            instances, rows = self._database_rows(options['rows'])
+        else:
+            instances, rows = self._synthetic_rows(options['rows'])
+        if not instances:
+            raise CommandError('No facilities to serialize')
+
+        renderer = JSONRenderer()
+        self.stdout.write(f'Serializing {len(instances)} facilities...')
+
+        for name, serializer_class in SERIALIZERS.items():
+            fast = FastFacilitySerializer(serializer_class, context)
+
+            drf_time, drf_data = self._best_of(
+                options['repeat'],
+                lambda: serializer_class(instances, many=True, context=context).data
+            )
+            fast_time, fast_data = self._best_of(
+                options['repeat'], lambda: fast.serialize(rows)
+            )
+
+            if isinstance(drf_data, dict):
+                # The GeoJSON list serializer wraps features in a FeatureCollection
+                drf_data = drf_data['features']
+            identical = renderer.render(drf_data) == renderer.render(fast_data)
+            style = self.style.SUCCESS if identical else self.style.ERROR
+            self.stdout.write(style(
+                f'{name:8} DRF {drf_time * 1000:8.2f} ms   fast {fast_time * 1000:8.2f} ms   '
+                f'speedup {drf_time / fast_time:5.1f}x   '
+                f'output {"identical" if identical else "DIFFERENT"}'
+            ))
+
+    def _best_of(self, repeat, func):
+        best, result = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def _database_rows(self, count):
+        queryset = HealthFacility.objects.order_by('id')[:count]
+        instances = list(queryset)
+        columns = [
+            field.name for field in HealthFacility._meta.concrete_fields
+            if field.name != 'location'
+        ]
+        rows = list(queryset.values(
+            *columns, longitude=STX(F('location')), latitude=STY(F('location'))
+        ))
+        for facility, row in zip(instances, rows):
+            facility.distance = row['distance'] = D(m=random.uniform(0, 50000))
+        return instances, rows
+
+    def _synthetic_rows(self, count):
+        rng = random.Random(42)
+        text_fields = [
+            field.name for field in HealthFacility._meta.concrete_fields
+            if field.get_internal_type() in ('CharField', 'URLField')
+        ]
+        instances, rows = [], []
+        for pk in range(1, count + 1):
+            lng = round(rng.uniform(32.7, 35.9), 7)
+            lat = round(rng.uniform(-17.1, -9.4), 7)
+            values = {name: rng.choice([None, f'{name} {pk}']) for name in text_fields}
+            values.update({
+                'id': pk,
+                'osm_id': 1000000 + pk,
+                'name': f'Facility {pk}',
+                'beds': rng.choice([None, rng.randint(0, 500)]),
+                'staff_doctors': rng.choice([None, rng.randint(0, 50)]),
+                'staff_nurses': rng.choice([None, rng.randint(0, 200)]),
+                'area': rng.choice([None, rng.uniform(0, 1000)]),
+                'perimeter': rng.choice([None, rng.uniform(0, 100)]),
+                'completeness': rng.choice([None, rng.uniform(0, 100)]),
+                'changeset_id': rng.randint(1, 10 ** 9),
+                'changeset_version': rng.randint(1, 20),
+            })
+            facility = HealthFacility(location=Point(lng, lat, srid=4326), **values)
+            facility.distance = D(m=rng.uniform(0, 50000))
+            instances.append(facility)
+            rows.append({**values, 'longitude': lng, 'latitude': lat, 'distance': facility.distance})
+        return instances, rows
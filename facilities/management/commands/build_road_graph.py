@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from facilities.cache import bump_data_version
+from facilities.importing import FeatureReader
+from facilities.isochrones import clear_isochrone_cache
+from facilities.routing import GRAPH_VERSION, GraphBuilder
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the routing graph from OSM road lines in GeoJSON, e.g. '
+        '"ogr2ogr -f GeoJSON roads.geojson malawi-latest.osm.pbf lines -where \'highway IS NOT NULL\'"'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            type=str,
+            required=True,
+            help='GeoJSON FeatureCollection of OSM highway lines'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Where to write the graph (default: ROAD_GRAPH_FILE)'
+        )
+
+    def handle(self, *args, **options):
+        output = options['output'] or settings.ROAD_GRAPH_FILE
+        builder = GraphBuilder()
+        roads = skipped = 0
+        try:
+            for feature in FeatureReader(options['file']):
+                if builder.add_feature(feature):
+                    roads += 1
+                else:
+                    skipped += 1
+            graph = builder.build()
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        graph.save(output)
+        # Running processes reload the graph on their next request
+        bump_data_version(GRAPH_VERSION)
+        clear_isochrone_cache()
+        self.stdout.write(f'{roads} roads read, {skipped} other features skipped')
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(graph)} nodes and {graph.edge_count} edges to {output}'
+        ))
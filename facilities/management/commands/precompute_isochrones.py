@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from facilities.filters import iexact
+from facilities.isochrones import METRICS, IsochroneTooLarge, NoRoadGraph, facility_isochrones, parse_cutoffs
+from facilities.models import HealthFacility
+
+
+class Command(BaseCommand):
+    help = 'Compute and cache isochrones for facilities ahead of requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--metric',
+            choices=list(METRICS),
+            default='time',
+            help="'time' (minutes over the road graph) or 'distance' (km)"
+        )
+        parser.add_argument(
+            '--cutoffs',
+            type=str,
+            default='',
+            help='Comma-separated cutoffs, as requested by clients (default: 15,30,60 or 5,10,25)'
+        )
+        parser.add_argument(
+            '--amenity',
+            type=str,
+            help='Only facilities of this amenity type (e.g. hospital)'
+        )
+        parser.add_argument(
+            '--district',
+            type=str,
+            help='Only facilities in this district'
+        )
+        parser.add_argument(
+            '--max-nodes',
+            type=int,
+            default=None,
+            help='Skip facilities whose search reaches more road junctions than this (default: no limit)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            cutoffs = parse_cutoffs(options['cutoffs'], options['metric'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        facilities = HealthFacility.objects.only('id', 'location').order_by('id')
+        if options['amenity']:
+            facilities = facilities.filter(iexact('amenity', options['amenity']))
+        if options['district']:
+            facilities = facilities.filter(iexact('district', options['district']))
+
+        count = skipped = 0
+        for facility in facilities.iterator(chunk_size=500):
+            try:
+                facility_isochrones(
+                    facility.pk, facility.longitude, facility.latitude, cutoffs, options['metric'],
+                    max_nodes=options['max_nodes'],
+                )
+            except NoRoadGraph as e:
+                raise CommandError(str(e))
+            except IsochroneTooLarge as e:
+                self.stdout.write(self.style.WARNING(f'Skipping facility {facility.pk}: {e}'))
+                skipped += 1
+                continue
+            count += 1
+            if count % 100 == 0:
+                self.stdout.write(f'{count} facilities done')
+        self.stdout.write(self.style.SUCCESS(f'Cached isochrones for {count} facilities'))
+        if skipped:
+            self.stdout.write(self.style.WARNING(f'Skipped: {skipped} facilities'))
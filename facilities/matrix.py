@@ -0,0 +1,49 @@
+"""
+Distance and bearing matrices between origins and facilities.
+
+Every cell is a geodesic on the WGS84 ellipsoid (``geodesy.inverse``),
+computed a block of origin rows at a time so memory stays bounded however
+many origins are sent. Rows are yielded as soon as their block is done,
+which lets large matrices be streamed.
+"""
+import numpy as np
+
+from .geodesy import inverse
+
+
+# Most origin x facility cells in one request
+MAX_CELLS = 1000000
+
+# Cells computed per block of origin rows
+BLOCK_CELLS = 50000
+
+# Matrices larger than this are streamed
+STREAM_CELLS = 20000
+
+
+def iter_rows(lngs, lats, labels, dest_lngs, dest_lats):
+    """
+    Yield ``{"origin", "distances_m", "bearings"}`` for every origin, with
+    one value per destination, in destination order.
+    """
+    dest_lngs = np.asarray(dest_lngs, dtype=np.float64)[np.newaxis, :]
+    dest_lats = np.asarray(dest_lats, dtype=np.float64)[np.newaxis, :]
+    rows_per_block = max(BLOCK_CELLS // max(dest_lngs.shape[1], 1), 1)
+    for start in range(0, len(lngs), rows_per_block):
+        stop = min(start + rows_per_block, len(lngs))
+        distances, bearings = inverse(
+            lngs[start:stop, np.newaxis], lats[start:stop, np.newaxis], dest_lngs, dest_lats
+        )
+        distances = np.round(distances, 2).tolist()
+        bearings = np.round(bearings, 2).tolist()
+        for offset in range(stop - start):
+            position = start + offset
+            yield {
+                'origin': {
+                    'id': labels[position],
+                    'latitude': float(lats[position]),
+                    'longitude': float(lngs[position]),
+                },
+                'distances_m': distances[offset],
+                'bearings': bearings[offset],
+            }
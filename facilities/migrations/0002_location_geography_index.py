@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facilities', '0001_initial'),
+    ]
+
+    operations = [
+        # ST_DWithin and the KNN <-> operator on geography can only use an
+        # index built over the same location::geography expression.
+        migrations.RunSQL(
+            sql=(
+                'CREATE INDEX IF NOT EXISTS health_facilities_location_geog_idx '
+                'ON health_facilities USING GIST ((location::geography));'
+            ),
+            reverse_sql='DROP INDEX IF EXISTS health_facilities_location_geog_idx;',
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facilities', '0002_location_geography_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='healthfacility',
+            index=models.Index(fields=['name', 'id'], name='health_faci_name_id_idx'),
+        ),
+    ]
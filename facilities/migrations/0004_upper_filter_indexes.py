@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:12
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('facilities', '0003_name_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='healthfacility',
+            index=models.Index(django.db.models.functions.text.Upper('district'), django.db.models.functions.text.Upper('amenity'), name='hf_district_amenity_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='healthfacility',
+            index=models.Index(django.db.models.functions.text.Upper('amenity'), name='hf_amenity_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='healthfacility',
+            index=models.Index(django.db.models.functions.text.Upper('region'), name='hf_region_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='healthfacility',
+            index=models.Index(django.db.models.functions.text.Upper('emergency'), name='hf_emergency_upper_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='healthfacility',
+            index=models.Index(django.db.models.functions.text.Upper('wheelchair'), name='hf_wheelchair_upper_idx'),
+        ),
+    ]
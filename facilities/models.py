@@ -1,5 +1,6 @@
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import Point
+from django.db.models.functions import Upper
 
 
 class HealthFacility(models.Model):
@@ -65,6 +66,9 @@ class HealthFacility(models.Model):
     is_in_health_system = models.CharField(max_length=100, blank=True, null=True, db_column='is_in_heal')
     is_in_health_system_1 = models.CharField(max_length=100, blank=True, null=True, db_column='is_in_he_1')
     
+    # Hash of the imported values, used by delta imports to skip unchanged rows
+    content_hash = models.CharField(max_length=64, blank=True, null=True, editable=False)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -77,6 +81,14 @@ class HealthFacility(models.Model):
         indexes = [
             models.Index(fields=['district', 'amenity']),
             models.Index(fields=['region', 'district']),
+            # Keyset pagination walks (name, id)
+            models.Index(fields=['name', 'id'], name='health_faci_name_id_idx'),
+            # Case-insensitive filters compare UPPER(col) (see facilities.filters)
+            models.Index(Upper('district'), Upper('amenity'), name='hf_district_amenity_upper_idx'),
+            models.Index(Upper('amenity'), name='hf_amenity_upper_idx'),
+            models.Index(Upper('region'), name='hf_region_upper_idx'),
+            models.Index(Upper('emergency'), name='hf_emergency_upper_idx'),
+            models.Index(Upper('wheelchair'), name='hf_wheelchair_upper_idx'),
         ]
     
     def __str__(self):
@@ -104,11 +116,11 @@ class HealthFacility(models.Model):
         Calculate distance from a given point in meters
         point should be a Point object or tuple (longitude, latitude)
         """
-        from django.contrib.gis.geos import Point
-        from django.contrib.gis.measure import D
+        from .geodesy import inverse
         
         if isinstance(point, tuple):
             point = Point(point[0], point[1], srid=4326)
         
-        # Use geodetic distance for accuracy
-        return self.location.distance(point) * 111319.9  # Convert degrees to meters approximately
+        # Geodesic distance on the WGS84 ellipsoid
+        distance_m, _ = inverse(point.x, point.y, self.location.x, self.location.y)
+        return distance_m
@@ -0,0 +1,63 @@
+"""
+Index-assisted proximity queries for health facilities.
+
+PostGIS can only use a spatial index when the radius test and the sort are
+written as index operators (``ST_DWithin`` and ``<->``). Filtering or sorting
+on an annotated ``Distance`` forces a full table scan, so here the distance is
+annotated for display only and never used to narrow or order the rows.
+
+All of these helpers work on the ``location::geography`` expression, which is
+covered by the ``health_facilities_location_geog_idx`` GiST index, so radius
+and distance are measured in metres on the spheroid.
+"""
+from django.contrib.gis.db.models.sql import DistanceField
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+
+from .models import HealthFacility
+
+
+LOCATION_GEOGRAPHY = f'"{HealthFacility._meta.db_table}"."location"::geography'
+POINT_GEOGRAPHY = 'ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography'
+
+
+def within_radius(queryset, point, radius_m):
+    """Keep facilities within ``radius_m`` metres of ``point``"""
+    return queryset.filter(RawSQL(
+        f'ST_DWithin({LOCATION_GEOGRAPHY}, {POINT_GEOGRAPHY}, %s)',
+        (point.x, point.y, radius_m),
+        output_field=BooleanField(),
+    ))
+
+
+def annotate_distance(queryset, point):
+    """Annotate ``distance`` (a Distance measure) from ``point`` on the spheroid"""
+    return queryset.annotate(distance=RawSQL(
+        f'ST_Distance({LOCATION_GEOGRAPHY}, {POINT_GEOGRAPHY}, true)',
+        (point.x, point.y),
+        output_field=DistanceField(HealthFacility._meta.get_field('location')),
+    ))
+
+
+def proximity(point):
+    """The KNN ``<->`` distance from ``point`` (metres on the sphere)"""
+    return RawSQL(
+        f'{LOCATION_GEOGRAPHY} <-> {POINT_GEOGRAPHY}',
+        (point.x, point.y),
+        output_field=FloatField(),
+    )
+
+
+def order_by_proximity(queryset, point):
+    """Order facilities nearest-first with the KNN ``<->`` operator"""
+    return queryset.order_by(proximity(point).asc(), 'pk')
+
+
+def nearest(queryset, point, radius_km, limit):
+    """
+    Return up to ``limit`` facilities within ``radius_km`` of ``point``,
+    nearest first, each annotated with its distance.
+    """
+    queryset = within_radius(queryset, point, radius_km * 1000)
+    queryset = annotate_distance(queryset, point)
+    return order_by_proximity(queryset, point)[:limit]
@@ -0,0 +1,735 @@
+"""
+Offline road-network routing.
+
+The road graph is built from OSM highway lines by the ``build_road_graph``
+command and stored in ROAD_GRAPH_FILE as a compressed ``.npz`` of flat
+arrays. Nodes are junctions and dead ends only: the vertices between them
+are merged into links, and each link keeps its shape as a run of vertices
+with the cumulative length (m) and travel time (s) along it. A link is
+driven forwards, backwards or both, and the CSR adjacency of directed edges
+is derived from the links on load. Loading is a few array reads, with no
+parsing.
+
+Searches run scipy's compiled Dijkstra over that adjacency. Every search
+has a finite cost limit that grows with the straight-line distance to its
+targets (``search_limit``), so a target that is far off by road or cannot be
+reached never makes a request search the whole graph. Points snap to the
+nearest point on any link segment, enter the graph partway along that link,
+and cover the gap at OFF_ROAD_SPEED_KMH.
+"""
+import os
+import re
+import threading
+from pathlib import Path
+
+import numpy as np
+import shapely
+from django.conf import settings
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components, dijkstra
+
+from .cache import data_version
+from .geodesy import haversine
+
+
+# Typical speeds (km/h) by OSM highway class; other classes are not routable
+ROAD_SPEEDS_KMH = {
+    'motorway': 100, 'motorway_link': 60,
+    'trunk': 80, 'trunk_link': 50,
+    'primary': 70, 'primary_link': 40,
+    'secondary': 60, 'secondary_link': 40,
+    'tertiary': 50, 'tertiary_link': 30,
+    'unclassified': 40, 'road': 30, 'residential': 30,
+    'living_street': 10, 'service': 20, 'track': 15,
+}
+
+# Speed over the straight gap between a point and the nearest road vertex
+OFF_ROAD_SPEED_KMH = 5
+
+# Points further than this from every road vertex cannot be routed
+MAX_SNAP_M = 10000
+
+# Searches give up beyond MAX_DETOUR times the straight-line distance to the
+# farthest target (at least MIN_SEARCH_M), covered at SLOW_ROAD_SPEED_KMH
+# when searching on travel time
+MAX_DETOUR = 3
+MIN_SEARCH_M = 20000
+SLOW_ROAD_SPEED_KMH = 15
+
+# Facilities ranked by travel time are drawn from this many straight-line
+# nearest ones
+TRAVEL_TIME_CANDIDATES = 100
+
+# Data version bumped whenever ROAD_GRAPH_FILE is rewritten
+GRAPH_VERSION = 'road-graph'
+
+WEIGHTS = ('time', 'distance')
+
+_ARRAYS = (
+    'lngs', 'lats', 'link_nodes', 'link_directions',
+    'shape_indptr', 'shape_lngs', 'shape_lats', 'shape_lengths', 'shape_times',
+)
+
+# "key"=>"value" pairs in the other_tags column written by GDAL's OSM driver
+_HSTORE_PAIR = re.compile(r'"((?:[^"\\]|\\.)*)"=>"((?:[^"\\]|\\.)*)"')
+
+
+class SearchTooLarge(Exception):
+    """Raised when a search reaches more nodes than its budget allows"""
+
+
+class RoadGraph:
+    """
+    Immutable directed road graph.
+
+    ``link_nodes`` holds the (first, last) node of every link and
+    ``link_directions`` whether it is driven forwards (1), backwards (-1) or
+    both (0). Link ``i``'s shape is ``shape_*[shape_indptr[i]:shape_indptr[i + 1]]``,
+    from its first node to its last, with ``shape_lengths`` and
+    ``shape_times`` counted from the first node.
+    """
+
+    def __init__(self, lngs, lats, link_nodes, link_directions,
+                 shape_indptr, shape_lngs, shape_lats, shape_lengths, shape_times):
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.link_nodes = np.asarray(link_nodes, dtype=np.int64).reshape(-1, 2)
+        self.link_directions = np.asarray(link_directions, dtype=np.int8)
+        self.shape_indptr = np.asarray(shape_indptr, dtype=np.int64)
+        self.shape_lngs = np.asarray(shape_lngs, dtype=np.float64)
+        self.shape_lats = np.asarray(shape_lats, dtype=np.float64)
+        self.shape_lengths = np.asarray(shape_lengths, dtype=np.float64)
+        self.shape_times = np.asarray(shape_times, dtype=np.float64)
+        # The link each shape vertex belongs to
+        self.shape_links = np.repeat(np.arange(len(self.link_nodes)), np.diff(self.shape_indptr))
+        # Segments are named by the shape vertex they start from
+        self.segment_starts = np.flatnonzero(self.shape_links[:-1] == self.shape_links[1:])
+
+        # Directed edges: every link forwards and/or backwards, by source node
+        forward = np.flatnonzero(self.link_directions >= 0)
+        backward = np.flatnonzero(self.link_directions <= 0)
+        links = np.concatenate([forward, backward])
+        against = np.repeat([0, 1], [len(forward), len(backward)])
+        order = np.argsort(self.link_nodes[links, against], kind='stable')
+        last = self.shape_indptr[1:] - 1
+        self.edge_links = links[order]
+        self.edge_reversed = against[order].astype(bool)
+        self.sources = self.link_nodes[self.edge_links, against[order]]
+        self.targets = self.link_nodes[self.edge_links, 1 - against[order]]
+        self.lengths = self.shape_lengths[last][self.edge_links]
+        self.times = self.shape_times[last][self.edge_links]
+
+        self._tree = None
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(**{name: data[name] for name in _ARRAYS})
+
+    def save(self, path):
+        """Write the graph atomically, so running processes never read half a file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **{name: getattr(self, name) for name in _ARRAYS})
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.lngs)
+
+    @property
+    def edge_count(self):
+        return len(self.targets)
+
+    @property
+    def tree(self):
+        """STRtree over the link segments, in the order of ``segment_starts``"""
+        if self._tree is None:
+            with self._lock:
+                if self._tree is None:
+                    starts = self.segment_starts
+                    lines = shapely.linestrings(np.stack([
+                        np.column_stack([self.shape_lngs[starts], self.shape_lats[starts]]),
+                        np.column_stack([self.shape_lngs[starts + 1], self.shape_lats[starts + 1]]),
+                    ], axis=1))
+                    self._tree = shapely.STRtree(lines)
+        return self._tree
+
+    def snap(self, lngs, lats):
+        """
+        Return (segments, fractions, distances_m): for each point the nearest
+        link segment, named by the shape vertex it starts from, how far along
+        it the nearest point lies (0 to 1) and how far away that point is.
+        Segment -1 marks points more than MAX_SNAP_M from every road.
+        """
+        lngs = np.atleast_1d(np.asarray(lngs, dtype=np.float64))
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        segments = np.full(len(lngs), -1, dtype=np.int64)
+        fractions = np.zeros(len(lngs))
+        distances = np.full(len(lngs), np.inf)
+        if not len(self.segment_starts) or not len(lngs):
+            return segments, fractions, distances
+        points, found = self.tree.query_nearest(shapely.points(lngs, lats), all_matches=False)
+        starts = self.segment_starts[found]
+
+        # Project onto the segment, with longitudes scaled to metres at the point
+        scale = np.cos(np.radians(lats[points]))
+        dx = (self.shape_lngs[starts + 1] - self.shape_lngs[starts]) * scale
+        dy = self.shape_lats[starts + 1] - self.shape_lats[starts]
+        px = (lngs[points] - self.shape_lngs[starts]) * scale
+        py = lats[points] - self.shape_lats[starts]
+        squared = dx * dx + dy * dy
+        along = np.divide(px * dx + py * dy, squared, out=np.zeros(len(starts)), where=squared > 0)
+        fractions[points] = np.clip(along, 0.0, 1.0)
+        segments[points] = starts
+        snapped_lngs, snapped_lats = self._point(starts, fractions[points])
+        distances[points] = haversine(lngs[points], lats[points], snapped_lngs, snapped_lats)
+        segments[distances > MAX_SNAP_M] = -1
+        return segments, fractions, distances
+
+    def _point(self, segments, fractions):
+        """(lngs, lats) of positions along link segments, exact at their ends"""
+        lngs, lats = self.shape_lngs, self.shape_lats
+        return (
+            lngs[segments] * (1 - fractions) + lngs[segments + 1] * fractions,
+            lats[segments] * (1 - fractions) + lats[segments + 1] * fractions,
+        )
+
+    def _along(self, weight):
+        if weight not in WEIGHTS:
+            raise ValueError(f'weight must be one of {", ".join(WEIGHTS)}')
+        return self.shape_times if weight == 'time' else self.shape_lengths
+
+    def _at(self, position, along):
+        """Value of ``along`` (from ``_along``) at a (segment, fraction) position"""
+        segment, fraction = position
+        return float(along[segment] + fraction * (along[segment + 1] - along[segment]))
+
+    def _matrix(self, weight):
+        """
+        Return the sparse adjacency matrix for ``weight`` and the edge behind
+        each of its entries; of parallel edges only the cheapest is kept
+        """
+        if weight not in self._matrices:
+            with self._lock:
+                if weight not in self._matrices:
+                    costs = self.times if weight == 'time' else self.lengths
+                    order = np.lexsort((costs, self.targets, self.sources))
+                    sources, targets = self.sources[order], self.targets[order]
+                    first = np.r_[True, (sources[1:] != sources[:-1]) | (targets[1:] != targets[:-1])]
+                    edges = order[first & (sources != targets)]
+                    indptr = np.zeros(len(self) + 1, dtype=np.int64)
+                    indptr[1:] = np.cumsum(np.bincount(self.sources[edges], minlength=len(self)))
+                    matrix = csr_matrix((costs[edges], self.targets[edges], indptr), shape=(len(self), len(self)))
+                    self._matrices[weight] = matrix, edges
+        return self._matrices[weight]
+
+    def _edge(self, source, target, weight):
+        """The edge a search over ``weight`` took from node ``source`` to ``target``"""
+        matrix, edges = self._matrix(weight)
+        start, stop = matrix.indptr[source], matrix.indptr[source + 1]
+        return int(edges[start + np.searchsorted(matrix.indices[start:stop], target)])
+
+    def _ends(self, position, weight, leaving):
+        """
+        (node, cost, end vertex) for every way between a (segment, fraction)
+        position and the nodes at either end of its link: from the position to
+        the node when ``leaving``, otherwise from the node to the position
+        """
+        segment, fraction = position
+        link = self.shape_links[segment]
+        along = self._along(weight)
+        at = self._at(position, along)
+        direction = self.link_directions[link]
+        first, last = int(self.shape_indptr[link]), int(self.shape_indptr[link + 1] - 1)
+        ends = []
+        if (segment == first and fraction == 0) or direction == 0 or (direction < 0) == leaving:
+            ends.append((int(self.link_nodes[link, 0]), at - float(along[first]), first))
+        if (segment + 1 == last and fraction == 1) or direction == 0 or (direction > 0) == leaving:
+            ends.append((int(self.link_nodes[link, 1]), float(along[last]) - at, last))
+        return ends
+
+    def _direct(self, origin, destination, weight):
+        """
+        (cost, shape vertices in between) of driving from one position to
+        another along their shared link, or (inf, None)
+        """
+        if self.shape_links[origin[0]] != self.shape_links[destination[0]]:
+            return np.inf, None
+        direction = self.link_directions[self.shape_links[origin[0]]]
+        forward = destination[0] + destination[1] >= origin[0] + origin[1]
+        if (forward and direction < 0) or (not forward and direction > 0):
+            return np.inf, None
+        along = self._along(weight)
+        cost = abs(self._at(destination, along) - self._at(origin, along))
+        if forward:
+            return cost, np.arange(origin[0] + 1, destination[0] + 1)
+        return cost, np.arange(origin[0], destination[0], -1)
+
+    def search(self, starts, weight='time', limit=np.inf, max_nodes=None):
+        """
+        Dijkstra from several (node, starting cost) pairs. Returns (costs,
+        predecessors) for every node, with cost inf for nodes that cost more
+        than ``limit`` to reach and predecessor -9999 at the start of a path.
+        Raises SearchTooLarge if more than ``max_nodes`` nodes are reached.
+        """
+        costs = np.full(len(self), np.inf)
+        predecessors = np.full(len(self), -9999, dtype=np.int64)
+        starts = [(node, cost) for node, cost in starts if cost <= limit]
+        if not starts:
+            return costs, predecessors
+        nodes = np.array([node for node, _ in starts], dtype=np.int64)
+        offsets = np.array([cost for _, cost in starts], dtype=np.float64)
+        matrix, _ = self._matrix(weight)
+        found, via = dijkstra(
+            matrix, indices=nodes, return_predecessors=True, limit=limit - offsets.min()
+        )
+        found = found + offsets[:, np.newaxis]
+        best = np.argmin(found, axis=0)
+        columns = np.arange(len(self))
+        costs = found[best, columns]
+        predecessors = via[best, columns].astype(np.int64)
+        costs[costs > limit] = np.inf
+        if max_nodes is not None and np.count_nonzero(np.isfinite(costs)) > max_nodes:
+            raise SearchTooLarge(f'The search reaches more than {max_nodes} road junctions')
+        return costs, predecessors
+
+    def _best_route(self, origin, destination, exits, costs, predecessors, weight):
+        """
+        Return (cost, shape vertices) of the cheapest way from position
+        ``origin`` to position ``destination``, given a search from ``exits``,
+        or (inf, None). The vertices are those passed in between.
+        """
+        best, shape = self._direct(origin, destination, weight)
+        arrival = None
+        for node, cost, end in self._ends(destination, weight, leaving=False):
+            if costs[node] + cost < best:
+                best, arrival = costs[node] + cost, (node, end)
+        if arrival is None:
+            return best, shape
+
+        # Walk the search back from the node where the route joins the last link
+        node, end = arrival
+        pieces = [_position_run(destination, end)[::-1]]
+        while predecessors[node] >= 0:
+            previous = int(predecessors[node])
+            edge = self._edge(previous, node, weight)
+            link = self.edge_links[edge]
+            first, last = int(self.shape_indptr[link]), int(self.shape_indptr[link + 1] - 1)
+            pieces.append(_vertex_run(last, first) if self.edge_reversed[edge] else _vertex_run(first, last))
+            node = previous
+        _, start = min((cost, end) for exit_node, cost, end in exits if exit_node == node)
+        pieces.append(_position_run(origin, start))
+        return best, np.concatenate(pieces[::-1])
+
+    def _measure(self, origin, shape, destination):
+        """(distance_m, duration_s) from one position to another through ``shape``"""
+        measured = []
+        for along in (self.shape_lengths, self.shape_times):
+            if not len(shape):
+                measured.append(abs(self._at(destination, along) - self._at(origin, along)))
+                continue
+            steps = (np.abs(np.diff(shape)) == 1) & (self.shape_links[shape[:-1]] == self.shape_links[shape[1:]])
+            measured.append(
+                abs(float(along[shape[0]]) - self._at(origin, along))
+                + float(np.abs(np.diff(along[shape]))[steps].sum())
+                + abs(self._at(destination, along) - float(along[shape[-1]]))
+            )
+        return measured[0], measured[1]
+
+    def route(self, lng1, lat1, lng2, lat2, weight='time'):
+        """
+        Route between two points, or None when either is off the graph or no
+        route is found within the search limit. Returns ``{"distance_m",
+        "duration_s", "geometry"}`` with a GeoJSON LineString that includes
+        the off-road gaps at both ends.
+        """
+        segments, fractions, gaps = self.snap([lng1, lng2], [lat1, lat2])
+        if (segments < 0).any():
+            return None
+        origin = (int(segments[0]), float(fractions[0]))
+        destination = (int(segments[1]), float(fractions[1]))
+        snapped_lngs, snapped_lats = self._point(segments, fractions)
+        distance = self._straight(snapped_lngs[0], snapped_lats[0], snapped_lngs[1:], snapped_lats[1:])
+        limit = search_limit(distance, weight)
+        exits = self._ends(origin, weight, leaving=True)
+        costs, predecessors = self.search([(node, cost) for node, cost, _ in exits], weight, limit)
+        cost, shape = self._best_route(origin, destination, exits, costs, predecessors, weight)
+        if shape is None or cost > limit:
+            return None
+
+        distance, duration = self._measure(origin, shape, destination)
+        coordinates = [[lng1, lat1]]
+        points = zip(
+            np.r_[snapped_lngs[0], self.shape_lngs[shape], snapped_lngs[1]].tolist(),
+            np.r_[snapped_lats[0], self.shape_lats[shape], snapped_lats[1]].tolist(),
+        )
+        for lng, lat in [*points, (lng2, lat2)]:
+            if [lng, lat] != coordinates[-1]:
+                coordinates.append([lng, lat])
+        if len(coordinates) == 1:
+            coordinates.append(coordinates[0])
+        return {
+            'distance_m': distance + float(gaps.sum()),
+            'duration_s': duration + float(gaps.sum()) / off_road_speed(),
+            'geometry': {'type': 'LineString', 'coordinates': coordinates},
+        }
+
+    def travel_times(self, lng, lat, dest_lngs, dest_lats):
+        """
+        Return (durations_s, distances_m) of the fastest routes from one point
+        to each destination, inf where a destination cannot be reached within
+        the search limit set by the farthest of them
+        """
+        segments, fractions, gaps = self.snap(np.r_[lng, dest_lngs], np.r_[lat, dest_lats])
+        durations = np.full(len(segments) - 1, np.inf)
+        distances = np.full(len(segments) - 1, np.inf)
+        valid = np.flatnonzero(segments[1:] >= 0) + 1
+        if segments[0] < 0 or not len(valid):
+            return durations, distances
+
+        origin = (int(segments[0]), float(fractions[0]))
+        snapped_lngs, snapped_lats = self._point(segments[valid], fractions[valid])
+        origin_lng, origin_lat = self._point(segments[0], fractions[0])
+        limit = search_limit(self._straight(origin_lng, origin_lat, snapped_lngs, snapped_lats), 'time')
+        exits = self._ends(origin, 'time', leaving=True)
+        costs, predecessors = self.search([(node, cost) for node, cost, _ in exits], 'time', limit)
+        speed = off_road_speed()
+        for position in valid.tolist():
+            destination = (int(segments[position]), float(fractions[position]))
+            cost, shape = self._best_route(origin, destination, exits, costs, predecessors, 'time')
+            if shape is not None and cost <= limit:
+                distance, duration = self._measure(origin, shape, destination)
+                durations[position - 1] = duration + (gaps[0] + gaps[position]) / speed
+                distances[position - 1] = distance + gaps[0] + gaps[position]
+        return durations, distances
+
+    def fastest(self, lng, lat, dest_lngs, dest_lats, limit):
+        """
+        Return (positions, durations_s, distances_m) for the ``limit``
+        destinations with the shortest travel time, fastest first, leaving
+        out those that cannot be reached
+        """
+        durations, distances = self.travel_times(lng, lat, dest_lngs, dest_lats)
+        order = np.argsort(durations, kind='stable')
+        order = order[np.isfinite(durations[order])][:limit]
+        return order.tolist(), durations[order].tolist(), distances[order].tolist()
+
+    def reached_segments(self, lng, lat, weight, limit, max_nodes=None):
+        """
+        Return the pieces of road that can be reached from a point within
+        ``limit``, as (lngs, lats, ends, costs): ``ends`` and ``costs`` have
+        shape (n, 2) and hold, for every link segment whose start is within
+        reach, the indices into ``lngs``/``lats`` of its start and end in the
+        direction of travel and the cost of reaching each. The point's snapped
+        position on the road is one of the points. The off-road gap costs
+        OFF_ROAD_SPEED_KMH (time) or its length (distance). ``max_nodes`` is
+        passed on to ``search``.
+        """
+        segments, fractions, gaps = self.snap(lng, lat)
+        if segments[0] < 0:
+            return np.zeros(0), np.zeros(0), np.zeros((0, 2), dtype=np.int64), np.zeros((0, 2))
+        origin = (int(segments[0]), float(fractions[0]))
+        gap_cost = gaps[0] / off_road_speed() if weight == 'time' else gaps[0]
+        exits = [(node, gap_cost + cost, end) for node, cost, end in self._ends(origin, weight, leaving=True)]
+        costs, _ = self.search([(node, cost) for node, cost, _ in exits], weight, limit, max_nodes)
+
+        # Every edge leaving a reached node, plus the origin's own link from
+        # the first vertex past the snapped position
+        along = self._along(weight)
+        edges = np.flatnonzero(costs[self.sources] < limit)
+        firsts = np.array([origin[0] + 1 if end > origin[0] else origin[0] for _, _, end in exits], dtype=np.int64)
+        first_costs = gap_cost + np.abs(along[firsts] - self._at(origin, along))
+        starts = np.concatenate([
+            np.where(self.edge_reversed[edges], self.shape_indptr[self.edge_links[edges] + 1] - 1,
+                     self.shape_indptr[self.edge_links[edges]]),
+            firsts,
+        ])
+        stops = np.concatenate([
+            np.where(self.edge_reversed[edges], self.shape_indptr[self.edge_links[edges]],
+                     self.shape_indptr[self.edge_links[edges] + 1] - 1),
+            np.array([end for _, _, end in exits], dtype=np.int64),
+        ])
+        start_costs = np.concatenate([costs[self.sources[edges]], first_costs])
+
+        # Expand every run of vertices into its segments; -1 is the snapped position
+        counts = np.abs(stops - starts)
+        run = np.repeat(np.arange(len(counts)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        step = np.sign(stops - starts)[run]
+        ends = np.concatenate([
+            np.column_stack([np.full(len(firsts), -1), firsts]),
+            np.column_stack([starts[run] + step * offset, starts[run] + step * (offset + 1)]),
+        ])
+        segment_costs = np.concatenate([
+            np.column_stack([np.full(len(firsts), gap_cost), first_costs]),
+            start_costs[run][:, np.newaxis] + np.abs(along[ends[len(firsts):]] - along[starts[run]][:, np.newaxis]),
+        ])
+        keep = segment_costs[:, 0] < limit
+        vertices, positions = np.unique(ends[keep], return_inverse=True)
+        lngs, lats = self.shape_lngs[vertices], self.shape_lats[vertices]
+        snapped = vertices < 0
+        lngs[snapped], lats[snapped] = self._point(origin[0], origin[1])
+        return lngs, lats, positions.reshape(-1, 2), segment_costs[keep]
+
+    def _straight(self, lng, lat, lngs, lats):
+        """Straight-line distance from one point to the farthest of others"""
+        return float(np.max(haversine(lng, lat, lngs, lats)))
+
+
+def _vertex_run(start, stop):
+    """Shape vertex indices from ``start`` to ``stop``, in either direction"""
+    step = 1 if stop >= start else -1
+    return np.arange(start, stop + step, step)
+
+
+def _position_run(position, end):
+    """
+    Shape vertex indices from the first one past a (segment, fraction)
+    position to ``end``, a vertex at either end of its link
+    """
+    segment, _ = position
+    return _vertex_run(segment + 1, end) if end > segment else _vertex_run(segment, end)
+
+
+def search_limit(distance_m, weight):
+    """
+    Cost limit for a search whose farthest target is ``distance_m`` away in
+    a straight line
+    """
+    metres = max(MAX_DETOUR * distance_m, MIN_SEARCH_M)
+    return metres / (SLOW_ROAD_SPEED_KMH / 3.6) if weight == 'time' else metres
+
+
+def off_road_speed():
+    """OFF_ROAD_SPEED_KMH in m/s"""
+    return OFF_ROAD_SPEED_KMH / 3.6
+
+
+# --- Building graphs from OSM road lines ------------------------------------
+
+def road_tags(properties):
+    """Return the OSM tags of a feature, including GDAL's packed other_tags"""
+    tags = dict(properties or {})
+    other = tags.pop('other_tags', None)
+    if other:
+        tags.update(_HSTORE_PAIR.findall(other))
+    return tags
+
+
+def road_speed(tags):
+    """Speed in km/h for a way, or None when it is not a road"""
+    speed = ROAD_SPEEDS_KMH.get(tags.get('highway'))
+    if speed is None:
+        return None
+    match = re.match(r'\s*(\d+(?:\.\d+)?)\s*(mph)?', str(tags.get('maxspeed') or ''))
+    if match and float(match.group(1)) > 0:
+        speed = float(match.group(1)) * (1.609344 if match.group(2) else 1)
+    return speed
+
+
+def road_direction(tags):
+    """1 for one-way along the line, -1 for one-way against it, 0 for both"""
+    oneway = str(tags.get('oneway') or '').lower()
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway in ('-1', 'reverse'):
+        return -1
+    if oneway == 'no':
+        return 0
+    if tags.get('junction') == 'roundabout' or tags.get('highway') == 'motorway':
+        return 1
+    return 0
+
+
+class GraphBuilder:
+    """
+    Collect OSM road lines as GeoJSON features, then assemble a RoadGraph.
+
+    Vertices at the same position (to 1e-7 degrees) are joined. Only the
+    largest strongly connected part of the network is kept, so every snapped
+    point can reach every other one, one-way streets included. Runs of
+    vertices between junctions are then merged into links that keep their
+    shape, so searches only visit junctions and dead ends.
+    """
+
+    def __init__(self):
+        self._coords = []
+        self._starts = []
+        self._speeds = []
+        self._directions = []
+        self._vertices = 0
+
+    def add_feature(self, feature):
+        """Add one road feature; returns False when it is not a routable line"""
+        tags = road_tags(feature.get('properties'))
+        speed = road_speed(tags)
+        geometry = feature.get('geometry') or {}
+        if speed is None:
+            return False
+        if geometry.get('type') == 'LineString':
+            lines = [geometry['coordinates']]
+        elif geometry.get('type') == 'MultiLineString':
+            lines = geometry['coordinates']
+        else:
+            return False
+
+        direction = road_direction(tags)
+        for line in lines:
+            if len(line) < 2:
+                continue
+            coords = np.array([point[:2] for point in line], dtype=np.float64)
+            segments = len(coords) - 1
+            self._coords.append(coords)
+            self._starts.append(np.arange(self._vertices, self._vertices + segments))
+            self._speeds.append(np.full(segments, speed, dtype=np.float64))
+            self._directions.append(np.full(segments, direction, dtype=np.int8))
+            self._vertices += len(coords)
+        return True
+
+    def build(self):
+        if not self._coords:
+            raise ValueError('No routable roads found')
+        coords = np.concatenate(self._coords)
+        starts = np.concatenate(self._starts)
+        speeds = np.concatenate(self._speeds)
+        directions = np.concatenate(self._directions)
+
+        keys = np.round(coords * 1e7).astype(np.int64)
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        lngs, lats = coords[first, 0], coords[first, 1]
+        u, v = inverse[starts], inverse[starts + 1]
+        keep = u != v
+        u, v, speeds, directions = u[keep], v[keep], speeds[keep], directions[keep]
+
+        # Keep the largest strongly connected part and renumber its vertices
+        vertices = _largest_strong_component(len(lngs), u, v, directions)
+        numbering = np.cumsum(vertices) - 1
+        keep = vertices[u] & vertices[v]
+        u, v, speeds, directions = numbering[u[keep]], numbering[v[keep]], speeds[keep], directions[keep]
+        lngs, lats = lngs[vertices], lats[vertices]
+
+        lengths = haversine(lngs[u], lats[u], lngs[v], lats[v])
+        times = lengths / (speeds / 3.6)
+        shape, runs, segments, along = _merge_chains(len(lngs), u, v, directions)
+
+        # Every segment of a link can be driven the same way as its first
+        counts = np.diff(runs)
+        first_steps = runs[:-1] - np.arange(len(counts))
+        link_directions = (directions[segments] * np.where(along, 1, -1))[first_steps].astype(np.int8)
+
+        # Cumulative length and time at every vertex of every link
+        step_lengths = np.zeros(len(shape))
+        step_times = np.zeros(len(shape))
+        inner = np.ones(len(shape), dtype=bool)
+        inner[runs[:-1]] = False
+        step_lengths[inner] = lengths[segments]
+        step_times[inner] = times[segments]
+        restart = np.repeat(runs[:-1], counts)
+
+        def cumulative(steps):
+            total = np.cumsum(steps)
+            return total - total[restart]
+
+        junction = np.zeros(len(lngs), dtype=bool)
+        junction[shape[runs[:-1]]] = True
+        junction[shape[runs[1:] - 1]] = True
+        node_numbering = np.cumsum(junction) - 1
+        link_nodes = np.column_stack([node_numbering[shape[runs[:-1]]], node_numbering[shape[runs[1:] - 1]]])
+        return RoadGraph(
+            lngs[junction], lats[junction], link_nodes, link_directions, runs,
+            lngs[shape], lats[shape], cumulative(step_lengths), cumulative(step_times),
+        )
+
+
+def _largest_strong_component(count, u, v, directions):
+    """Boolean mask of the vertices in the largest strongly connected component"""
+    forward, backward = directions >= 0, directions <= 0
+    rows = np.concatenate([u[forward], v[backward]])
+    columns = np.concatenate([v[forward], u[backward]])
+    matrix = csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(count, count))
+    _, labels = connected_components(matrix, directed=True, connection='strong')
+    return labels == np.argmax(np.bincount(labels))
+
+
+def _merge_chains(count, u, v, directions):
+    """
+    Split the segments ``(u[i], v[i])`` into runs between junctions: the
+    vertices that do not join exactly two segments, to two different
+    neighbours, that can be driven through the same way. Returns (shape, runs, segments, along): the vertices of every
+    run one after another, where each run starts in ``shape`` (CSR style),
+    and for every step the segment taken and whether it was taken from u to v.
+    """
+    degree = np.bincount(u, minlength=count) + np.bincount(v, minlength=count)
+    order = np.argsort(np.concatenate([u, v]), kind='stable')
+    incident = np.tile(np.arange(len(u)), 2)[order]
+    neighbours = np.concatenate([v, u])[order]
+    indptr = np.r_[0, np.cumsum(degree)]
+    junction = degree != 2
+    pairs = np.flatnonzero(degree == 2)
+    into, out_of = incident[indptr[pairs]], incident[indptr[pairs] + 1]
+    junction[pairs] = (
+        (neighbours[indptr[pairs]] == neighbours[indptr[pairs] + 1])
+        | (directions[into] * np.where(v[into] == pairs, 1, -1)
+           != directions[out_of] * np.where(u[out_of] == pairs, 1, -1))
+    )
+
+    # Plain lists: the walk below touches every segment once
+    incident, indptr, junction = incident.tolist(), indptr.tolist(), junction.tolist()
+    u_list, v_list = u.tolist(), v.tolist()
+    used = bytearray(len(u_list))
+    shape, runs, segments, along = [], [0], [], []
+
+    def walk(vertex, segment):
+        shape.append(vertex)
+        while True:
+            used[segment] = 1
+            forward = u_list[segment] == vertex
+            vertex = v_list[segment] if forward else u_list[segment]
+            segments.append(segment)
+            along.append(forward)
+            shape.append(vertex)
+            if junction[vertex]:
+                break
+            position = indptr[vertex]
+            segment = incident[position + 1] if incident[position] == segment else incident[position]
+        runs.append(len(shape))
+
+    for vertex in [vertex for vertex in range(count) if junction[vertex]]:
+        for position in range(indptr[vertex], indptr[vertex + 1]):
+            if not used[incident[position]]:
+                walk(vertex, incident[position])
+    # Whatever is left are rings without a junction; each starts anywhere
+    for segment in range(len(u_list)):
+        if not used[segment]:
+            junction[u_list[segment]] = True
+            walk(u_list[segment], segment)
+    return (
+        np.array(shape, dtype=np.int64), np.array(runs, dtype=np.int64),
+        np.array(segments, dtype=np.int64), np.array(along, dtype=bool),
+    )
+
+
+# --- Shared graph -----------------------------------------------------------
+
+_graph = None
+_graph_version = None
+_graph_lock = threading.Lock()
+
+
+def get_graph():
+    """Return the RoadGraph in ROAD_GRAPH_FILE, or None when there is none"""
+    global _graph, _graph_version
+
+    path = Path(settings.ROAD_GRAPH_FILE)
+    version = (str(path), data_version(GRAPH_VERSION))
+    if _graph_version != version:
+        with _graph_lock:
+            if _graph_version != version:
+                _graph = RoadGraph.load(path) if path.exists() else None
+                _graph_version = version
+    return _graph
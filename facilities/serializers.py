@@ -5,7 +5,67 @@ from django.contrib.gis.measure import D
 from .models import HealthFacility
 
 
-class HealthFacilityListSerializer(serializers.ModelSerializer):
+def requested_fields(request):
+    """Parse ?fields= and ?omit= into two sets of field names"""
+    if request is None:
+        return set(), set()
+    
+    def parse(param):
+        value = request.query_params.get(param, '')
+        return {name.strip() for name in value.split(',') if name.strip()}
+    
+    return parse('fields'), parse('omit')
+
+
+class SparseFieldsMixin:
+    """
+    Lets clients choose output fields with ?fields=a,b or drop them with
+    ?omit=a,b. ``model_fields()`` tells the view which columns the remaining
+    fields need, so the same trimming can reach the SELECT via .only().
+    """
+    
+    # Serializer fields computed from other columns (None: from an annotation)
+    derived_fields = {
+        'latitude': 'location',
+        'longitude': 'location',
+        'coordinates': 'location',
+        'distance': None,
+        'distance_km': None,
+        'distance_m': None,
+    }
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fields, omit = requested_fields(self.context.get('request'))
+        if not fields and not omit:
+            return
+        
+        required = self.required_fields()
+        for name in list(self.fields):
+            if name in required:
+                continue
+            if (fields and name not in fields) or name in omit:
+                self.fields.pop(name)
+    
+    def required_fields(self):
+        """Fields that are always kept"""
+        return {'id'}
+    
+    def model_fields(self):
+        """Model fields needed to render the current serializer fields"""
+        model = self.Meta.model
+        names = {model._meta.pk.name}
+        for name, field in self.fields.items():
+            if name in self.derived_fields:
+                source = self.derived_fields[name]
+            else:
+                source = field.source
+            if source and source != '*':
+                names.add(source)
+        return names
+
+
+class HealthFacilityListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for listing health facilities with basic information"""
     
     distance = serializers.SerializerMethodField()
@@ -41,7 +101,7 @@ class HealthFacilityListSerializer(serializers.ModelSerializer):
         return None
 
 
-class HealthFacilityDetailSerializer(serializers.ModelSerializer):
+class HealthFacilityDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Detailed serializer for a single health facility"""
     
     distance = serializers.SerializerMethodField()
@@ -51,7 +111,7 @@ class HealthFacilityDetailSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = HealthFacility
-        fields = '__all__'
+        exclude = ['content_hash']
     
     def get_latitude(self, obj):
         return obj.latitude
@@ -70,11 +130,15 @@ class HealthFacilityDetailSerializer(serializers.ModelSerializer):
         return None
 
 
-class HealthFacilityGeoJSONSerializer(GeoFeatureModelSerializer):
+class HealthFacilityGeoJSONSerializer(SparseFieldsMixin, GeoFeatureModelSerializer):
     """GeoJSON serializer for mapping applications"""
     
     distance = serializers.SerializerMethodField()
     
+    def required_fields(self):
+        """GeoJSON features always carry their id and geometry"""
+        return {self.Meta.id_field, self.Meta.geo_field}
+    
     class Meta:
         model = HealthFacility
         geo_field = 'location'
@@ -97,7 +161,7 @@ class HealthFacilityGeoJSONSerializer(GeoFeatureModelSerializer):
         return None
 
 
-class NearbyFacilitySerializer(serializers.ModelSerializer):
+class NearbyFacilitySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for nearby facilities with distance"""
     
     distance_km = serializers.SerializerMethodField()
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_data_version
+from .isochrones import discard_isochrones
+from .models import HealthFacility
+from .tiles import clear_tile_cache
+
+
+@receiver(post_save, sender=HealthFacility)
+@receiver(post_delete, sender=HealthFacility)
+def facility_changed(sender, instance, **kwargs):
+    """Invalidate indexes and caches once the change is visible to other connections"""
+    facility_id = instance.pk
+    transaction.on_commit(lambda: invalidate_facility(facility_id))
+
+
+def invalidate_facility(facility_id):
+    """
+    Mark data derived from facility rows as stale, remove tiles cached for
+    older data versions and drop one facility's isochrones
+    """
+    bump_data_version()
+    clear_tile_cache(keep_current=True)
+    discard_isochrones(facility_id)
+
+
+@contextmanager
+def invalidation_paused():
+    """
+    Disconnect ``facility_changed`` for bulk writes that invalidate once at
+    the end. Without a post_delete receiver, queryset deletes also run as a
+    single DELETE instead of loading every row first.
+    """
+    post_save.disconnect(facility_changed, sender=HealthFacility)
+    post_delete.disconnect(facility_changed, sender=HealthFacility)
+    try:
+        yield
+    finally:
+        post_save.connect(facility_changed, sender=HealthFacility)
+        post_delete.connect(facility_changed, sender=HealthFacility)
@@ -0,0 +1,176 @@
+"""
+Optional in-memory spatial index over HealthFacility locations.
+
+Enabled with the FACILITY_SPATIAL_INDEX setting, and always used for batch
+nearest queries (see ``get_index``). Candidates are pruned with a shapely
+STRtree and exact great-circle distances come from a vectorised haversine,
+so radius, k-nearest and bounding-box queries are answered without a
+database round trip. The index is rebuilt lazily whenever the facility data
+version changes (see ``facilities.cache``).
+"""
+import math
+import threading
+
+import numpy as np
+import shapely
+from django.conf import settings
+from django.contrib.gis.measure import D
+
+from .cache import data_version
+from .geodesy import EARTH_RADIUS_M, haversine, search_box, search_boxes
+from .models import HealthFacility
+
+
+class FacilityIndex:
+    """Immutable snapshot of facility ids, coordinates and amenity types"""
+
+    def __init__(self, ids, lngs, lats, amenities):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.amenities = np.asarray(amenities, dtype=object)
+        self.tree = shapely.STRtree(shapely.points(self.lngs, self.lats))
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """Build an index from the facilities in ``queryset``"""
+        ids, lngs, lats, amenities = [], [], [], []
+        for pk, location, amenity in queryset.values_list('id', 'location', 'amenity'):
+            ids.append(pk)
+            lngs.append(location.x)
+            lats.append(location.y)
+            amenities.append((amenity or '').lower())
+        return cls(ids, lngs, lats, amenities)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _filter_amenity(self, positions, amenity):
+        """Keep positions matching ``amenity``, a type or a list of types"""
+        if amenity:
+            positions = positions[self._amenity_mask(positions, amenity)]
+        return positions
+
+    def _amenity_mask(self, positions, amenity):
+        if isinstance(amenity, str):
+            return self.amenities[positions] == amenity.lower()
+        return np.isin(self.amenities[positions], [a.lower() for a in amenity])
+
+    def bbox(self, min_lng, min_lat, max_lng, max_lat, amenity=None):
+        """Return ids of facilities inside the bounding box"""
+        positions = self.tree.query(shapely.box(min_lng, min_lat, max_lng, max_lat))
+        positions = self._filter_amenity(positions, amenity)
+        return np.sort(self.ids[positions])
+
+    def within_polygon(self, polygon, amenity=None):
+        """
+        Return ids of facilities inside (or on the edge of) a shapely polygon.
+        The tree query prepares the polygon, so large ones stay cheap.
+        """
+        positions = self.tree.query(polygon, predicate='intersects')
+        positions = self._filter_amenity(positions, amenity)
+        return np.sort(self.ids[positions])
+
+    def within(self, lng, lat, radius_m, amenity=None):
+        """
+        Return (ids, distances_m) of facilities within ``radius_m`` of the
+        point, nearest first.
+        """
+        positions = self.tree.query(shapely.box(*search_box(lng, lat, radius_m)))
+        positions = self._filter_amenity(positions, amenity)
+        distances = haversine(lng, lat, self.lngs[positions], self.lats[positions])
+        keep = distances <= radius_m
+        positions, distances = positions[keep], distances[keep]
+        order = np.lexsort((self.ids[positions], distances))
+        return self.ids[positions][order], distances[order]
+
+    def nearest(self, lng, lat, k, radius_m=None, amenity=None):
+        """
+        Return (ids, distances_m) of the ``k`` nearest facilities, optionally
+        limited to ``radius_m``.
+        """
+        if radius_m is not None:
+            ids, distances = self.within(lng, lat, radius_m, amenity)
+            return ids[:k], distances[:k]
+
+        # Grow the search circle until it holds k facilities (or the globe)
+        radius_m = 1000.0
+        while True:
+            ids, distances = self.within(lng, lat, radius_m, amenity)
+            if len(ids) >= k or radius_m >= math.pi * EARTH_RADIUS_M:
+                return ids[:k], distances[:k]
+            radius_m *= 4
+
+    def nearest_many(self, lngs, lats, k, radius_m, amenity=None):
+        """
+        k-nearest facilities within ``radius_m`` for many origins at once.
+
+        Returns flat arrays (origins, ids, distances_m), sorted by origin
+        position and then nearest first, with up to ``k`` entries per origin.
+        """
+        lngs = np.asarray(lngs, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        boxes = shapely.box(*search_boxes(lngs, lats, radius_m))
+        origins, positions = self.tree.query(boxes)
+        if amenity:
+            keep = self._amenity_mask(positions, amenity)
+            origins, positions = origins[keep], positions[keep]
+
+        distances = haversine(lngs[origins], lats[origins], self.lngs[positions], self.lats[positions])
+        keep = distances <= radius_m
+        origins, ids, distances = origins[keep], self.ids[positions[keep]], distances[keep]
+
+        order = np.lexsort((ids, distances, origins))
+        origins, ids, distances = origins[order], ids[order], distances[order]
+        # Rank of each entry within its origin's run
+        starts = np.flatnonzero(np.r_[True, origins[1:] != origins[:-1]])
+        ranks = np.arange(len(origins)) - np.repeat(starts, np.diff(np.r_[starts, len(origins)]))
+        keep = ranks < k
+        return origins[keep], ids[keep], distances[keep]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_index(required=False):
+    """
+    Return the current FacilityIndex, or None when the index is disabled.
+    With ``required`` it is built whatever FACILITY_SPATIAL_INDEX says, for
+    queries that have no per-request SQL path (batch nearest); it is still
+    built once per data version and shared.
+    """
+    global _index, _index_version
+
+    if not required and not getattr(settings, 'FACILITY_SPATIAL_INDEX', False):
+        return None
+
+    version = data_version()
+    if _index is None or _index_version != version:
+        with _index_lock:
+            if _index is None or _index_version != version:
+                _index = FacilityIndex.from_queryset(HealthFacility.objects.all())
+                _index_version = version
+    return _index
+
+
+def facilities_by_id(ids, distances=None, queryset=None):
+    """
+    Load facilities for ``ids`` in the given order, setting ``distance`` on
+    each one when ``distances`` (in metres) are supplied.
+    """
+    if queryset is None:
+        queryset = HealthFacility.objects.all()
+    ids = [int(pk) for pk in ids]
+    by_id = queryset.in_bulk(ids)
+
+    facilities = []
+    for position, pk in enumerate(ids):
+        facility = by_id.get(pk)
+        if facility is None:
+            continue
+        if distances is not None:
+            facility.distance = D(m=float(distances[position]))
+        facilities.append(facility)
+    return facilities
@@ -0,0 +1,142 @@
+"""
+Spatial joins between health facilities and polygons.
+
+Facilities can be limited to a polygon passed inline (WKT or GeoJSON) or to
+the features of an uploaded ShapefileLayer. Administrative polygons often
+have thousands of vertices, and testing every facility against the whole
+boundary is slow. On PostGIS the polygon is cut with ``ST_Subdivide`` into
+small pieces first. The location index then finds candidates for each
+piece, and each point-in-polygon test only touches a few vertices. The
+in-memory index (FACILITY_SPATIAL_INDEX) uses shapely's STRtree instead,
+which prepares the polygon before testing points.
+"""
+import shapely
+from django.contrib.gis.gdal import GDALException
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+
+from admin.models import ShapefileFeature
+
+from .models import HealthFacility
+from .spatial_index import get_index
+
+
+# Most vertices in one ST_Subdivide piece
+SUBDIVIDE_MAX_VERTICES = 256
+
+POLYGON_TYPES = ('Polygon', 'MultiPolygon')
+
+FACILITY_TABLE = f'"{HealthFacility._meta.db_table}"'
+FEATURE_TABLE = f'"{ShapefileFeature._meta.db_table}"'
+
+
+def parse_polygon(text):
+    """
+    Parse a WKT, EWKT or GeoJSON polygon into a GEOSGeometry in EPSG:4326.
+    Coordinates without an SRID are taken to be WGS84.
+    """
+    try:
+        geometry = GEOSGeometry(text.strip())
+    except (ValueError, TypeError, GEOSException, GDALException):
+        raise ValueError('Geometry must be WKT or GeoJSON')
+    if geometry.geom_type not in POLYGON_TYPES:
+        raise ValueError(f'Geometry must be a Polygon or MultiPolygon, not {geometry.geom_type}')
+    if not geometry.srid:
+        geometry.srid = 4326
+    elif geometry.srid != 4326:
+        geometry.transform(4326)
+    return geometry
+
+
+def within_polygon(queryset, geometry):
+    """Keep facilities inside ``geometry`` (a polygon in EPSG:4326)"""
+    index = get_index()
+    if index is not None:
+        ids = index.within_polygon(shapely.from_wkb(bytes(geometry.wkb)))
+        return queryset.filter(pk__in=ids.tolist())
+    if connection.vendor != 'postgresql':
+        return queryset.filter(location__intersects=geometry)
+    return queryset.filter(RawSQL(
+        f'''{FACILITY_TABLE}."id" IN (
+            SELECT f."id" FROM {FACILITY_TABLE} f,
+                   ST_Subdivide(%s::geometry, %s) AS part(geom)
+            WHERE ST_Intersects(f."location", part.geom)
+        )''',
+        (geometry.hexewkb.decode(), SUBDIVIDE_MAX_VERTICES),
+        output_field=BooleanField(),
+    ))
+
+
+def within_layer(queryset, layer_id, fid=None):
+    """
+    Keep facilities inside feature ``fid`` of a shapefile layer, or inside
+    any of its features when ``fid`` is None.
+    """
+    if get_index() is not None or connection.vendor != 'postgresql':
+        features = ShapefileFeature.objects.filter(layer_id=layer_id)
+        if fid is not None:
+            features = features.filter(fid=fid)
+        geometries = list(features.values_list('geometry', flat=True))
+        if not geometries:
+            return queryset.none()
+        geometry = geometries[0]
+        for other in geometries[1:]:
+            geometry = geometry.union(other)
+        return within_polygon(queryset, geometry)
+
+    # Subdivide inside the database so large polygons never leave it
+    feature_filter, params = 's."layer_id" = %s', [layer_id]
+    if fid is not None:
+        feature_filter += ' AND s."fid" = %s'
+        params.append(fid)
+    return queryset.filter(RawSQL(
+        f'''{FACILITY_TABLE}."id" IN (
+            SELECT f."id" FROM {FACILITY_TABLE} f,
+                   (SELECT ST_Subdivide(s."geometry", %s) AS geom
+                    FROM {FEATURE_TABLE} s WHERE {feature_filter}) part
+            WHERE ST_Intersects(f."location", part.geom)
+        )''',
+        (SUBDIVIDE_MAX_VERTICES, *params),
+        output_field=BooleanField(),
+    ))
+
+
+def count_by_feature(queryset, layer_id):
+    """
+    Return ``{fid: number of facilities from queryset inside it}`` for every
+    feature of a shapefile layer; on PostGIS this is a single query.
+    """
+    if connection.vendor != 'postgresql':
+        counts = {}
+        for fid, geometry in ShapefileFeature.objects.filter(layer_id=layer_id).values_list('fid', 'geometry'):
+            counts[fid] = within_polygon(queryset, geometry).count()
+        return counts
+
+    try:
+        facility_sql, facility_params = queryset.order_by().values('id').query.sql_with_params()
+    except EmptyResultSet:
+        # e.g. pk__in=[] from the spatial index or .none() from within_layer
+        fids = ShapefileFeature.objects.filter(layer_id=layer_id).values_list('fid', flat=True)
+        return {fid: 0 for fid in fids}
+    sql = f'''
+        WITH parts AS (
+            SELECT s."fid", ST_Subdivide(s."geometry", %s) AS geom
+            FROM {FEATURE_TABLE} s
+            WHERE s."layer_id" = %s
+        ),
+        counts AS (
+            SELECT parts."fid", COUNT(DISTINCT f."id") AS n
+            FROM parts JOIN {FACILITY_TABLE} f ON ST_Intersects(f."location", parts.geom)
+            WHERE f."id" IN ({facility_sql})
+            GROUP BY parts."fid"
+        )
+        SELECT s."fid", COALESCE(counts.n, 0)
+        FROM {FEATURE_TABLE} s LEFT JOIN counts ON counts."fid" = s."fid"
+        WHERE s."layer_id" = %s
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [SUBDIVIDE_MAX_VERTICES, layer_id, *facility_params, layer_id])
+        return dict(cursor.fetchall())
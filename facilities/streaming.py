@@ -0,0 +1,51 @@
+"""
+Streaming GeoJSON FeatureCollections.
+
+Features are encoded one at a time and flushed in small batches, so neither
+the rows nor the serialized collection is ever held in memory as a whole and
+the first bytes go out as soon as the first rows arrive.
+"""
+import json
+
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+# Rows fetched per database round trip when iterating a queryset
+STREAM_CHUNK_SIZE = 2000
+
+
+def dumps(data):
+    """Encode like DRF's JSONRenderer (compact, UTF-8)"""
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'))
+
+
+def iter_json_collection(items, head, key, batch_size=100):
+    """
+    Yield ``{**head, key: [items...], "count": n}`` as JSON, piece by piece
+    """
+    yield dumps(head)[:-1] + (',' if head else '') + dumps(key) + ':['
+    count = 0
+    batch = []
+    for item in items:
+        batch.append(dumps(item) if count == 0 else ',' + dumps(item))
+        count += 1
+        if len(batch) >= batch_size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+    # The total is only known at the end, so it follows the items
+    yield '],"count":%d}' % count
+
+
+def iter_feature_collection(features, batch_size=100):
+    """Yield a FeatureCollection document piece by piece"""
+    return iter_json_collection(features, {'type': 'FeatureCollection'}, 'features', batch_size)
+
+
+def stream_feature_collection(features):
+    """Return a StreamingHttpResponse for an iterable of GeoJSON features"""
+    return StreamingHttpResponse(
+        iter_feature_collection(features), content_type='application/json'
+    )
@@ -1,6 +1,28 @@
-from django.test import TestCase
-from django.contrib.gis.geos import Point
+import base64
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.gis.geos import GEOSGeometry, Point, Polygon
+from rest_framework import status
+from rest_framework.test import APIClient
+from admin.models import ShapefileFeature, ShapefileLayer
+from .cache import bump_data_version
+from .importing import FeatureReader
 from .models import HealthFacility
+from .routing import get_graph
+from .spatial_index import FacilityIndex, get_index
+from .tiles import GEOM_POLYGON, encode_tile, lnglat_to_tile_pixel, tile_lnglat_bounds
+import json
 
 
 class HealthFacilityModelTest(TestCase):
@@ -58,3 +80,1089 @@ class HealthFacilityModelTest(TestCase):
         clinics = HealthFacility.objects.filter(amenity="clinic")
         self.assertEqual(hospitals.count(), 1)
         self.assertEqual(clinics.count(), 1)
+    
+    def test_distance_from_is_geodesic(self):
+        """Test distance_from measures on the ellipsoid, not in degrees"""
+        distance_m = self.facility1.distance_from((33.8000, -14.0000))
+        self.assertAlmostEqual(distance_m, 4995.27, delta=0.1)
+
+
+class NearbyFacilitiesAPITest(TestCase):
+    """Test cases for the nearby endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        HealthFacility.objects.create(
+            osm_id=1, name="Near Clinic", amenity="clinic",
+            location=Point(33.7741, -13.9626, srid=4326)
+        )
+        HealthFacility.objects.create(
+            osm_id=2, name="Mid Hospital", amenity="hospital",
+            location=Point(33.8000, -14.0000, srid=4326)
+        )
+        HealthFacility.objects.create(
+            osm_id=3, name="Far Hospital", amenity="hospital",
+            location=Point(35.0000, -15.8000, srid=4326)
+        )
+    
+    def test_nearby_orders_by_distance_within_radius(self):
+        """Test that only facilities inside the radius are returned, nearest first"""
+        response = self.client.get(
+            '/api/facilities/nearby/', {'lat': -13.9626, 'lng': 33.7741, 'radius': 10}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+        names = [f['name'] for f in response.data['facilities']]
+        self.assertEqual(names, ["Near Clinic", "Mid Hospital"])
+        self.assertEqual(response.data['facilities'][0]['distance_m'], 0)
+    
+    def test_nearby_distance_is_geodesic(self):
+        """Test that distances are measured in metres on the spheroid"""
+        response = self.client.get(
+            '/api/facilities/nearby/', {'lat': -13.9626, 'lng': 33.7741, 'radius': 10}
+        )
+        # ~5 km between the two Lilongwe points
+        distance_m = response.data['facilities'][1]['distance_m']
+        self.assertAlmostEqual(distance_m, 4995.27, delta=1)
+    
+    def test_nearby_amenity_and_limit(self):
+        """Test amenity filter and result limit"""
+        response = self.client.get('/api/facilities/nearby/', {
+            'lat': -13.9626, 'lng': 33.7741, 'radius': 500,
+            'amenity': 'HOSPITAL', 'limit': 1
+        })
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['facilities'][0]['name'], "Mid Hospital")
+    
+    def test_nearby_requires_coordinates(self):
+        """Test that lat and lng are required"""
+        response = self.client.get('/api/facilities/nearby/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_batch_nearest(self):
+        """Test k-nearest for several origins, in order, with an amenity list"""
+        response = self.client.post('/api/facilities/nearest/', {
+            'origins': [
+                {'id': 'lilongwe', 'lat': -13.9626, 'lng': 33.7741},
+                [35.0, -15.8],
+                [0, 0],
+            ],
+            'k': 1, 'radius': 500, 'amenity': ['Hospital'],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        results = response.data['results']
+        self.assertEqual(results[0]['origin']['id'], 'lilongwe')
+        self.assertEqual([f['name'] for f in results[0]['facilities']], ["Mid Hospital"])
+        self.assertAlmostEqual(results[0]['facilities'][0]['distance_m'], 4995, delta=25)
+        self.assertEqual(results[1]['origin']['id'], 1)
+        self.assertEqual([f['name'] for f in results[1]['facilities']], ["Far Hospital"])
+        self.assertEqual(results[2]['count'], 0)
+    
+    @override_settings(FACILITY_SPATIAL_INDEX=True)
+    def test_batch_nearest_streams_from_index(self):
+        """Test streamed batch results match the nearby endpoint"""
+        response = self.client.post(
+            '/api/facilities/nearest/?stream=1',
+            {'origins': [[33.7741, -13.9626]], 'k': 2, 'radius': 10},
+            format='json'
+        )
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['k'], 2)
+        names = [f['name'] for f in data['results'][0]['facilities']]
+        self.assertEqual(names, ["Near Clinic", "Mid Hospital"])
+    
+    @override_settings(FACILITY_SPATIAL_INDEX=False)
+    def test_batch_nearest_shares_index(self):
+        """Test batch queries build the index once per data version with the setting off"""
+        bump_data_version()
+        body = {'origins': [[33.7741, -13.9626]], 'k': 1}
+        with mock.patch.object(FacilityIndex, 'from_queryset', wraps=FacilityIndex.from_queryset) as build:
+            for _ in range(2):
+                response = self.client.post('/api/facilities/nearest/', body, format='json')
+                self.assertEqual(response.data['results'][0]['facilities'][0]['name'], "Near Clinic")
+        self.assertEqual(build.call_count, 1)
+        self.assertIsNone(get_index())
+    
+    def test_batch_nearest_rejects_bad_input(self):
+        """Test malformed origins and out of range k are rejected"""
+        for body in ({}, {'origins': [{'lat': 1}]}, {'origins': [[0, 0]], 'k': 0}):
+            response = self.client.post('/api/facilities/nearest/', body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DistanceMatrixTest(TestCase):
+    """Test cases for the distance matrix and directions endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.near = HealthFacility.objects.create(
+            osm_id=1, name="Near Clinic", amenity="clinic",
+            location=Point(33.7741, -13.9626, srid=4326)
+        )
+        self.mid = HealthFacility.objects.create(
+            osm_id=2, name="Mid Hospital", amenity="hospital",
+            location=Point(33.8000, -14.0000, srid=4326)
+        )
+        self.far = HealthFacility.objects.create(
+            osm_id=3, name="Far Hospital", amenity="hospital",
+            location=Point(35.0000, -15.8000, srid=4326)
+        )
+    
+    def test_matrix_for_facility_ids(self):
+        """Test one row per origin with a column per requested facility"""
+        response = self.client.post('/api/facilities/matrix/', {
+            'origins': [{'id': 'a', 'lat': -13.9626, 'lng': 33.7741}, [35.0, -15.8]],
+            'facilities': [self.mid.id, self.near.id],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([f['id'] for f in response.data['facilities']], [self.mid.id, self.near.id])
+        first = response.data['rows'][0]
+        self.assertEqual(first['origin']['id'], 'a')
+        self.assertAlmostEqual(first['distances_m'][0], 4995.27, delta=0.1)
+        self.assertEqual(first['distances_m'][1], 0)
+        # Mid Hospital lies south-east of Near Clinic
+        self.assertTrue(90 < first['bearings'][0] < 180)
+    
+    def test_matrix_uses_list_filters_and_streams(self):
+        """Test facilities can be chosen with list filters and streamed"""
+        response = self.client.post(
+            '/api/facilities/matrix/?amenity=hospital&stream=1',
+            {'origins': [[33.7741, -13.9626]]}, format='json'
+        )
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['facilities']), 2)
+        self.assertEqual(len(data['rows'][0]['distances_m']), 2)
+    
+    def test_matrix_rejects_unknown_facilities(self):
+        """Test unknown ids are reported"""
+        response = self.client.post('/api/facilities/matrix/', {
+            'origins': [[33.7741, -13.9626]], 'facilities': [self.near.id, 999999],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_directions_distance_matches_matrix(self):
+        """Test directions uses the same geodesic distance and bearing"""
+        response = self.client.get(
+            f'/api/facilities/{self.mid.id}/directions/', {'lat': -13.9626, 'lng': 33.7741}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertAlmostEqual(response.data['distance']['meters'], 4995.27, delta=0.1)
+        self.assertAlmostEqual(response.data['bearing'], 145.93, delta=0.01)
+
+
+class FacilitySpatialIndexTest(TestCase):
+    """Test cases for the in-memory spatial index"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.near = HealthFacility.objects.create(
+            osm_id=1, name="Near Clinic", amenity="clinic",
+            location=Point(33.7741, -13.9626, srid=4326)
+        )
+        self.mid = HealthFacility.objects.create(
+            osm_id=2, name="Mid Hospital", amenity="hospital",
+            location=Point(33.8000, -14.0000, srid=4326)
+        )
+        self.far = HealthFacility.objects.create(
+            osm_id=3, name="Far Hospital", amenity="hospital",
+            location=Point(35.0000, -15.8000, srid=4326)
+        )
+        self.index = FacilityIndex.from_queryset(HealthFacility.objects.all())
+    
+    def test_within_radius(self):
+        """Test radius queries return ids nearest first with distances"""
+        ids, distances = self.index.within(33.7741, -13.9626, 10000)
+        self.assertEqual(list(ids), [self.near.id, self.mid.id])
+        self.assertAlmostEqual(distances[1], 4995, delta=25)
+    
+    def test_k_nearest_with_amenity(self):
+        """Test k-nearest queries honour the amenity filter"""
+        ids, _ = self.index.nearest(33.7741, -13.9626, 2, amenity='HOSPITAL')
+        self.assertEqual(list(ids), [self.mid.id, self.far.id])
+    
+    def test_bbox(self):
+        """Test bounding box queries"""
+        ids = self.index.bbox(33.0, -14.5, 34.0, -13.5)
+        self.assertEqual(sorted(ids), sorted([self.near.id, self.mid.id]))
+    
+    @override_settings(FACILITY_SPATIAL_INDEX=True)
+    def test_nearby_uses_index(self):
+        """Test the nearby endpoint answers from the index when enabled"""
+        response = self.client.get(
+            '/api/facilities/nearby/', {'lat': -13.9626, 'lng': 33.7741, 'radius': 10}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [f['name'] for f in response.data['facilities']]
+        self.assertEqual(names, ["Near Clinic", "Mid Hospital"])
+    
+    @override_settings(FACILITY_SPATIAL_INDEX=True)
+    def test_index_rebuilds_after_save(self):
+        """Test saving a facility invalidates the index"""
+        first = get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            HealthFacility.objects.create(
+                osm_id=4, name="New Clinic", amenity="clinic",
+                location=Point(33.7750, -13.9630, srid=4326)
+            )
+            # Nothing changes until the save is committed
+            self.assertIs(get_index(), first)
+        second = get_index()
+        self.assertIsNot(first, second)
+        self.assertEqual(len(second), 4)
+
+
+class FacilityTileTest(TestCase):
+    """Test cases for the vector tile endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        HealthFacility.objects.create(
+            osm_id=1, name="Test Hospital", amenity="hospital",
+            location=Point(33.7741, -13.9626, srid=4326)
+        )
+    
+    def test_tile_math(self):
+        """Test tile bounds and pixel projection"""
+        min_lng, min_lat, max_lng, max_lat = tile_lnglat_bounds(0, 0, 0)
+        self.assertEqual((min_lng, max_lng), (-180, 180))
+        self.assertAlmostEqual(max_lat, 85.0511, places=4)
+        self.assertEqual(lnglat_to_tile_pixel(0, 0, 0, 0, 0), (2048, 2048))
+    
+    def test_encode_point_tile(self):
+        """Test the pure-Python encoder writes a single point feature"""
+        tile = encode_tile([('facilities', [
+            {'id': 1, 'geometry': (25, 17), 'properties': {'amenity': 'clinic'}}
+        ])])
+        self.assertTrue(tile.startswith(b'\x1a'))  # Tile.layers
+        self.assertIn(b'facilities', tile)
+        self.assertIn(b'amenity', tile)
+        self.assertIn(b'clinic', tile)
+    
+    def test_encode_polygon_tile(self):
+        """Test polygon rings are rewound and closed"""
+        square = [(0, 0), (0, 10), (10, 10), (10, 0), (0, 0)]  # counter-clockwise on screen
+        tile = encode_tile([('districts', [
+            {'id': 1, 'type': GEOM_POLYGON, 'geometry': [[square]], 'properties': {}}
+        ])])
+        # MoveTo(1) 10,0; LineTo(3) +0,+10 -10,+0 +0,-10; ClosePath
+        self.assertIn(bytes([9, 20, 0, 26, 0, 20, 19, 0, 0, 19, 15]), tile)
+    
+    def test_tile_endpoint(self):
+        """Test tiles are served as MVT and cached"""
+        response = self.client.get('/api/facilities/tiles/8/152/138.mvt')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn(b'facilities', response.content)
+        
+        cached = self.client.get('/api/facilities/tiles/8/152/138.mvt')
+        self.assertEqual(cached.content, response.content)
+    
+    def test_tile_includes_buffer(self):
+        """Test facilities just past the tile edge are drawn in the buffer"""
+        min_lng, min_lat, max_lng, max_lat = tile_lnglat_bounds(8, 152, 138)
+        HealthFacility.objects.create(
+            osm_id=2, name="Edge Clinic", amenity="clinic",
+            location=Point(min_lng - (max_lng - min_lng) * 16 / 4096, -13.9626, srid=4326)
+        )
+        response = self.client.get('/api/facilities/tiles/8/152/138.mvt')
+        self.assertIn(b'Edge Clinic', response.content)
+    
+    def test_stale_tiles_pruned_after_save(self):
+        """Test saving a facility removes tiles cached for older data versions"""
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(FACILITY_CACHE_DIR=cache_dir):
+            tiles_dir = os.path.join(cache_dir, 'tiles')
+            self.client.get('/api/facilities/tiles/8/152/138.mvt')
+            old_versions = os.listdir(tiles_dir)
+            with self.captureOnCommitCallbacks(execute=True):
+                HealthFacility.objects.create(
+                    osm_id=2, name="New Clinic", amenity="clinic",
+                    location=Point(33.7750, -13.9630, srid=4326)
+                )
+            self.client.get('/api/facilities/tiles/8/152/138.mvt')
+            versions = os.listdir(tiles_dir)
+            self.assertEqual(len(versions), 1)
+            self.assertNotIn(versions[0], old_versions)
+    
+    def test_invalid_tile(self):
+        """Test out-of-range tile coordinates are rejected"""
+        response = self.client.get('/api/facilities/tiles/2/9/0.mvt')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FacilityGeoJSONStreamTest(TestCase):
+    """Test cases for the streaming GeoJSON export"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(5):
+            HealthFacility.objects.create(
+                osm_id=100 + i, name=f"Clinic {i}", amenity="clinic", district="ZOMBA",
+                location=Point(35.3 + i / 100, -15.4, srid=4326)
+            )
+        HealthFacility.objects.create(
+            osm_id=200, name="Hospital", amenity="hospital", district="BLANTYRE",
+            location=Point(35.0, -15.8, srid=4326)
+        )
+    
+    def test_stream_matches_buffered_output(self):
+        """Test the streamed collection has the same features as the buffered one"""
+        buffered = self.client.get('/api/facilities/geojson/', {'district': 'zomba'})
+        streamed = self.client.get('/api/facilities/geojson/', {'district': 'zomba', 'stream': 1})
+        self.assertEqual(streamed.status_code, status.HTTP_200_OK)
+        self.assertTrue(streamed.streaming)
+        
+        data = json.loads(b''.join(streamed.streaming_content))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(data['features'], json.loads(json.dumps(buffered.data['features'])))
+    
+    def test_stream_honours_limit(self):
+        """Test an explicit limit still applies when streaming"""
+        response = self.client.get('/api/facilities/geojson/', {'stream': 1, 'limit': 2})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['count'], 2)
+
+
+class FacilityAggregateAPITest(TestCase):
+    """Test cases for the districts, amenities and stats endpoints"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        cache.clear()
+        rows = [
+            ("A", "LILONGWE", "hospital", "yes"),
+            ("B", "LILONGWE", "clinic", "no"),
+            ("C", "ZOMBA", "clinic", "YES"),
+            ("D", None, None, None),
+        ]
+        for i, (name, district, amenity, emergency) in enumerate(rows):
+            HealthFacility.objects.create(
+                osm_id=i + 1, name=name, district=district, amenity=amenity,
+                emergency=emergency, location=Point(33.7 + i / 10, -13.9, srid=4326)
+            )
+    
+    def test_districts_single_query_and_cached(self):
+        """Test districts are counted in one query and then served from cache"""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/facilities/districts/')
+        self.assertEqual(response.data['districts'], [
+            {'district': 'LILONGWE', 'facility_count': 2},
+            {'district': 'ZOMBA', 'facility_count': 1},
+        ])
+        with self.assertNumQueries(0):
+            self.client.get('/api/facilities/districts/')
+    
+    def test_amenities(self):
+        """Test amenity counts"""
+        response = self.client.get('/api/facilities/amenities/')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(response.data['amenities'][0], {'amenity': 'clinic', 'facility_count': 2})
+    
+    def test_stats(self):
+        """Test stats totals and amenity breakdown"""
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/facilities/stats/')
+        self.assertEqual(response.data['total_facilities'], 4)
+        self.assertEqual(response.data['total_districts'], 3)
+        self.assertEqual(response.data['total_amenity_types'], 3)
+        self.assertEqual(response.data['facilities_by_amenity'], {'clinic': 2, 'hospital': 1})
+        self.assertEqual(response.data['emergency_facilities'], 2)
+    
+    def test_cache_invalidated_on_change(self):
+        """Test saving a facility refreshes cached counts"""
+        self.client.get('/api/facilities/districts/')
+        HealthFacility.objects.create(
+            osm_id=99, name="E", district="ZOMBA", location=Point(35.3, -15.4, srid=4326)
+        )
+        response = self.client.get('/api/facilities/districts/')
+        self.assertEqual(response.data['districts'][1]['facility_count'], 2)
+
+
+class FacilityCursorPaginationTest(TestCase):
+    """Test cases for keyset pagination on the list endpoint"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(5):
+            HealthFacility.objects.create(
+                osm_id=i + 1, name="Same Name" if i < 3 else f"Clinic {i}",
+                location=Point(33.7 + i / 100, -13.9, srid=4326)
+            )
+    
+    def _walk(self, params):
+        ids = []
+        response = self.client.get('/api/facilities/', params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(f['id'] for f in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+    
+    def test_walks_by_name_and_id(self):
+        """Test cursor pages cover every facility once in (name, id) order"""
+        ids = self._walk({'pagination': 'cursor', 'page_size': 2})
+        expected = list(HealthFacility.objects.order_by('name', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+    
+    def test_walks_by_distance(self):
+        """Test cursor pages follow distance order when a location is given"""
+        with CaptureQueriesContext(connection) as ctx:
+            ids = self._walk({'pagination': 'cursor', 'page_size': 2, 'lat': -13.9, 'lng': 33.75})
+        # Pages are keyed on the KNN distance, so the geography index is used
+        self.assertTrue(all('<->' in q['sql'] for q in ctx.captured_queries if 'health_facilities' in q['sql']))
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertEqual(ids[0], HealthFacility.objects.get(osm_id=5).id)
+    
+    def test_page_number_is_default(self):
+        """Test existing clients still get page-number pagination"""
+        response = self.client.get('/api/facilities/')
+        self.assertEqual(response.data['count'], 5)
+    
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get('/api/facilities/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_cursor_value_must_match_key(self):
+        """Test hand-edited cursor values of the wrong type are rejected, not a 500"""
+        def cursor(value):
+            return base64.urlsafe_b64encode(json.dumps(value).encode('ascii')).decode('ascii')
+        
+        located = {'pagination': 'cursor', 'lat': -13.9, 'lng': 33.75}
+        for params, value in [
+            ({'pagination': 'cursor'}, [None, 1]),
+            ({'pagination': 'cursor'}, [{}, 1]),
+            ({'pagination': 'cursor'}, ['Clinic 3', 'x']),
+            (located, ['x', 1]),
+            (located, [True, 1]),
+        ]:
+            response = self.client.get('/api/facilities/', {**params, 'cursor': cursor(value)})
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, value)
+        
+        response = self.client.get('/api/facilities/', {**located, 'cursor': cursor([1000.5, 1])})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SparseFieldsetTest(TestCase):
+    """Test cases for ?fields= and ?omit="""
+    
+    def setUp(self):
+        self.client = APIClient()
+        self.facility = HealthFacility.objects.create(
+            osm_id=1, name="Test Hospital", amenity="hospital", district="LILONGWE",
+            addr_street="M1", location=Point(33.7741, -13.9626, srid=4326)
+        )
+    
+    def test_list_fields(self):
+        """Test list output is limited to the requested fields plus id"""
+        response = self.client.get('/api/facilities/', {'fields': 'name,latitude'})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name', 'latitude'})
+        self.assertEqual(response.data['results'][0]['latitude'], -13.9626)
+    
+    def test_omit(self):
+        """Test omitted fields are removed from detail output"""
+        response = self.client.get(f'/api/facilities/{self.facility.id}/', {'omit': 'addr_street,url'})
+        self.assertNotIn('addr_street', response.data)
+        self.assertNotIn('url', response.data)
+        self.assertIn('name', response.data)
+    
+    def test_geojson_keeps_geometry(self):
+        """Test GeoJSON features keep id and geometry"""
+        response = self.client.get('/api/facilities/geojson/', {'fields': 'name'})
+        feature = response.data['features'][0]
+        self.assertEqual(feature['id'], self.facility.id)
+        self.assertEqual(feature['geometry']['coordinates'], [33.7741, -13.9626])
+        self.assertEqual(set(feature['properties']), {'name'})
+    
+    def test_select_only_needed_columns(self):
+        """Test only the needed columns are fetched from the database"""
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/facilities/', {'fields': 'name,amenity'})
+        select = ctx.captured_queries[-1]['sql']
+        self.assertIn('"amenity"', select)
+        self.assertNotIn('"addr_stree"', select)
+        self.assertNotIn('"location"', select)
+
+
+class FastSerializationTest(TestCase):
+    """Test the values()-based fast path matches the DRF serializers"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        HealthFacility.objects.create(
+            osm_id=1, name="Central Hospital", amenity="hospital", district="LILONGWE",
+            beds=300, location=Point(33.7741, -13.9626, srid=4326)
+        )
+        HealthFacility.objects.create(
+            osm_id=2, name="Area 25 Clinic", amenity="clinic", district="LILONGWE",
+            location=Point(33.8, -13.95, srid=4326)
+        )
+    
+    def _compare(self, path, params=None):
+        with self.settings(FACILITY_FAST_SERIALIZATION=False):
+            expected = self.client.get(path, params)
+        with self.settings(FACILITY_FAST_SERIALIZATION=True):
+            actual = self.client.get(path, params)
+        self.assertEqual(actual.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(actual.content), json.loads(expected.content))
+    
+    def test_list_matches(self):
+        self._compare('/api/facilities/')
+        self._compare('/api/facilities/', {'fields': 'name,latitude'})
+    
+    def test_nearby_matches(self):
+        self._compare('/api/facilities/nearby/', {'lat': -13.96, 'lng': 33.78, 'radius': 10})
+    
+    def test_geojson_matches(self):
+        self._compare('/api/facilities/geojson/')
+        self._compare('/api/facilities/geojson/', {'stream': 1})
+
+
+class CaseInsensitiveFilterTest(TestCase):
+    """Test attribute filters use the UPPER() expression indexes"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        HealthFacility.objects.create(
+            osm_id=1, name="Zomba Clinic", amenity="clinic", district="ZOMBA",
+            region="Southern", emergency="yes", wheelchair="limited",
+            location=Point(35.3, -15.4, srid=4326)
+        )
+        HealthFacility.objects.create(
+            osm_id=2, name="Zomba Hospital", amenity="hospital", district="Zomba",
+            location=Point(35.31, -15.38, srid=4326)
+        )
+    
+    def test_filters_ignore_case(self):
+        response = self.client.get('/api/facilities/', {'district': 'zomba'})
+        self.assertEqual(response.data['count'], 2)
+        response = self.client.get('/api/facilities/', {
+            'region': 'SOUTHERN', 'amenity': 'Clinic', 'emergency': 'YES', 'wheelchair': 'Limited'
+        })
+        self.assertEqual(response.data['count'], 1)
+    
+    def test_filter_matches_index_expression(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get('/api/facilities/', {'district': 'zomba', 'amenity': 'clinic'})
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertIn('UPPER("health_facilities"."district") =', sql)
+        self.assertIn('UPPER("health_facilities"."amenity") =', sql)
+        self.assertNotIn('::text', sql)
+
+
+class SpatialJoinTest(TestCase):
+    """Test filtering and counting facilities by polygons"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        HealthFacility.objects.create(
+            osm_id=1, name="Lilongwe Clinic", amenity="clinic",
+            location=Point(33.77, -13.96, srid=4326)
+        )
+        HealthFacility.objects.create(
+            osm_id=2, name="Lilongwe Hospital", amenity="hospital",
+            location=Point(33.80, -14.00, srid=4326)
+        )
+        HealthFacility.objects.create(
+            osm_id=3, name="Blantyre Hospital", amenity="hospital",
+            location=Point(35.00, -15.80, srid=4326)
+        )
+        self.layer = ShapefileLayer.objects.create(name='Districts')
+        ShapefileFeature.objects.create(
+            layer=self.layer, fid=0, properties={'NAME': 'Lilongwe'},
+            geometry=Polygon.from_bbox((33.5, -14.5, 34.0, -13.5)),
+        )
+        ShapefileFeature.objects.create(
+            layer=self.layer, fid=1, properties={'NAME': 'Blantyre'},
+            geometry=Polygon.from_bbox((34.8, -16.0, 35.2, -15.5)),
+        )
+        ShapefileFeature.objects.create(
+            layer=self.layer, fid=2, properties={'NAME': 'Likoma'},
+            geometry=Polygon.from_bbox((34.7, -12.1, 34.8, -12.0)),
+        )
+    
+    def names(self, params):
+        response = self.client.get('/api/facilities/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(f['name'] for f in response.data['results'])
+    
+    def test_within_layer_feature(self):
+        """Test facilities are limited to one feature, or any feature of the layer"""
+        self.assertEqual(
+            self.names({'within_layer': self.layer.id, 'feature': 0}),
+            ["Lilongwe Clinic", "Lilongwe Hospital"]
+        )
+        self.assertEqual(len(self.names({'within_layer': self.layer.id})), 3)
+        self.assertEqual(
+            self.names({'within_layer': self.layer.id, 'feature': 0, 'amenity': 'hospital'}),
+            ["Lilongwe Hospital"]
+        )
+    
+    def test_within_inline_polygon(self):
+        """Test WKT and GeoJSON polygons filter facilities"""
+        wkt = 'POLYGON((34.8 -16, 35.2 -16, 35.2 -15.5, 34.8 -15.5, 34.8 -16))'
+        self.assertEqual(self.names({'within': wkt}), ["Blantyre Hospital"])
+        geojson = json.dumps({'type': 'Polygon', 'coordinates': [
+            [[33.7, -14.0], [33.9, -14.0], [33.9, -13.9], [33.7, -13.9], [33.7, -14.0]]
+        ]})
+        self.assertEqual(self.names({'within': geojson}), ["Lilongwe Clinic", "Lilongwe Hospital"])
+    
+    @override_settings(FACILITY_SPATIAL_INDEX=True)
+    def test_within_uses_index(self):
+        """Test polygon filters are answered by the in-memory index when enabled"""
+        self.assertEqual(
+            self.names({'within_layer': self.layer.id, 'feature': 1}), ["Blantyre Hospital"]
+        )
+    
+    def test_invalid_polygon(self):
+        """Test unparseable or non-polygon geometries are rejected"""
+        for value in ['POINT(33 -14)', 'not a polygon']:
+            response = self.client.get('/api/facilities/', {'within': value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('error', response.data)
+        response = self.client.get('/api/facilities/', {'within_layer': 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_feature_counts(self):
+        """Test every feature gets a count, including empty ones"""
+        response = self.client.get('/api/facilities/feature-counts/', {'layer': self.layer.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        counts = {r['properties']['NAME']: r['count'] for r in response.data['results']}
+        self.assertEqual(counts, {'Lilongwe': 2, 'Blantyre': 1, 'Likoma': 0})
+        self.assertEqual(response.data['total'], 3)
+        
+        response = self.client.get('/api/facilities/feature-counts/', {
+            'layer': self.layer.id, 'amenity': 'hospital'
+        })
+        counts = {r['fid']: r['count'] for r in response.data['results']}
+        self.assertEqual(counts, {0: 1, 1: 1, 2: 0})
+        
+        response = self.client.get('/api/facilities/feature-counts/', {'layer': 999})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    
+    def test_feature_counts_total_distinct(self):
+        """Test facilities in overlapping features count once in the total"""
+        ShapefileFeature.objects.create(
+            layer=self.layer, fid=3, properties={'NAME': 'Central'},
+            geometry=Polygon.from_bbox((33.0, -15.0, 34.5, -13.0)),
+        )
+        response = self.client.get('/api/facilities/feature-counts/', {'layer': self.layer.id})
+        self.assertEqual(response.data['results'][3]['count'], 2)
+        self.assertEqual(response.data['total'], 3)
+    
+    def test_inactive_layer_hidden(self):
+        """Test inactive layers are only usable by staff"""
+        self.layer.is_active = False
+        self.layer.save()
+        response = self.client.get('/api/facilities/feature-counts/', {'layer': self.layer.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/api/facilities/', {'within_layer': self.layer.id})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        
+        staff = User.objects.create_user(username='staff', password='staffpass123', is_staff=True)
+        self.client.force_authenticate(user=staff)
+        response = self.client.get('/api/facilities/feature-counts/', {'layer': self.layer.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    @override_settings(FACILITY_SPATIAL_INDEX=True)
+    def test_feature_counts_with_no_facilities(self):
+        """Test filters that match nothing give zero counts, not an error"""
+        response = self.client.get('/api/facilities/feature-counts/', {
+            'layer': self.layer.id, 'bbox': '0,0,1,1'
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({r['fid']: r['count'] for r in response.data['results']}, {0: 0, 1: 0, 2: 0})
+        self.assertEqual(response.data['total'], 0)
+
+
+class BoundaryLookupTest(TestCase):
+    """Test point-in-polygon lookups against boundary layers"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(FACILITY_CACHE_DIR=cache_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        self.clinic = HealthFacility.objects.create(
+            osm_id=1, name="Lilongwe Clinic", district="Unknown",
+            location=Point(33.77, -13.96, srid=4326)
+        )
+        self.hospital = HealthFacility.objects.create(
+            osm_id=2, name="Blantyre Hospital", district="BLANTYRE", region="SOUTHERN",
+            location=Point(35.00, -15.80, srid=4326)
+        )
+        # Layer changes invalidate the in-memory indexes once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.districts = ShapefileLayer.objects.create(
+                name='Districts', boundary_role='district', boundary_name_field='DIST_NAME'
+            )
+            regions = ShapefileLayer.objects.create(
+                name='Regions', boundary_role='region', boundary_name_field='REGION'
+            )
+        ShapefileFeature.objects.create(
+            layer=self.districts, fid=0, properties={'DIST_NAME': 'Lilongwe'},
+            geometry=Polygon.from_bbox((33.5, -14.5, 34.0, -13.5)),
+        )
+        ShapefileFeature.objects.create(
+            layer=self.districts, fid=1, properties={'DIST_NAME': 'Dedza'},
+            geometry=Polygon.from_bbox((34.0, -14.5, 34.5, -13.5)),
+        )
+        ShapefileFeature.objects.create(
+            layer=regions, fid=0, properties={'REGION': 'Central'},
+            geometry=Polygon.from_bbox((32.5, -15.0, 35.0, -12.5)),
+        )
+    
+    def test_locate(self):
+        """Test the containing district and region are returned"""
+        response = self.client.get('/api/facilities/locate/', {'lat': -14.0, 'lng': 33.8})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['district'], {'name': 'Lilongwe', 'layer': self.districts.id, 'fid': 0})
+        self.assertEqual(response.data['region']['name'], 'Central')
+        
+        # Points on a shared border resolve to the lowest fid
+        response = self.client.get('/api/facilities/locate/', {'lat': -14.0, 'lng': 34.0})
+        self.assertEqual(response.data['district']['name'], 'Lilongwe')
+        
+        response = self.client.get('/api/facilities/locate/', {'lat': -15.8, 'lng': 35.5})
+        self.assertIsNone(response.data['district'])
+        self.assertIsNone(response.data['region'])
+        
+        response = self.client.get('/api/facilities/locate/', {'lat': 'x', 'lng': 33.8})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_assign_boundaries_command(self):
+        """Test districts and regions are derived in bulk, keeping unmatched values"""
+        out = StringIO()
+        call_command('assign_boundaries', '--uppercase', '--dry-run', stdout=out)
+        self.assertIn('Would update 1 facilities', out.getvalue())
+        self.clinic.refresh_from_db()
+        self.assertEqual(self.clinic.district, 'Unknown')
+        
+        call_command('assign_boundaries', '--uppercase', stdout=StringIO())
+        self.clinic.refresh_from_db()
+        self.hospital.refresh_from_db()
+        self.assertEqual((self.clinic.district, self.clinic.region), ('LILONGWE', 'CENTRAL'))
+        self.assertEqual((self.hospital.district, self.hospital.region), ('BLANTYRE', 'SOUTHERN'))
+        
+        call_command('assign_boundaries', '--role', 'region', '--clear-unmatched', stdout=StringIO())
+        self.hospital.refresh_from_db()
+        self.assertEqual((self.hospital.district, self.hospital.region), ('BLANTYRE', None))
+
+
+class RoadRoutingTest(TestCase):
+    """Test cases for the road graph and travel time routing"""
+    
+    def setUp(self):
+        self.client = APIClient()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.graph_file = os.path.join(cache_dir.name, 'road_graph.npz')
+        settings_override = override_settings(
+            FACILITY_CACHE_DIR=cache_dir.name, ROAD_GRAPH_FILE=self.graph_file
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        
+        # A fast road east of the origin and a slow track north of it
+        roads = [
+            {'type': 'Feature', 'properties': {'highway': 'primary'},
+             'geometry': {'type': 'LineString', 'coordinates': [[33.0, -14.0], [33.1, -14.0], [33.2, -14.0]]}},
+            {'type': 'Feature', 'properties': {'highway': 'track'},
+             'geometry': {'type': 'LineString', 'coordinates': [[33.0, -14.0], [33.0, -13.95]]}},
+            {'type': 'Feature', 'properties': {'highway': 'footway'},
+             'geometry': {'type': 'LineString', 'coordinates': [[33.0, -14.0], [33.0, -14.1]]}},
+            # One way out and no way back
+            {'type': 'Feature', 'properties': {'highway': 'primary', 'oneway': 'yes'},
+             'geometry': {'type': 'LineString', 'coordinates': [[33.2, -14.0], [33.3, -14.0]]}},
+        ]
+        handle, path = tempfile.mkstemp(suffix='.geojson')
+        with os.fdopen(handle, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': roads}, f)
+        self.addCleanup(os.remove, path)
+        out = StringIO()
+        call_command('build_road_graph', '--file', path, stdout=out)
+        self.output = out.getvalue()
+        
+        self.track_clinic = HealthFacility.objects.create(
+            osm_id=1, name="Track Clinic", amenity="clinic",
+            location=Point(33.0, -13.95, srid=4326)
+        )
+        self.road_hospital = HealthFacility.objects.create(
+            osm_id=2, name="Road Hospital", amenity="hospital",
+            location=Point(33.1, -14.0, srid=4326)
+        )
+    
+    def test_build_road_graph(self):
+        """Test the command keeps roads only and merges vertices between junctions"""
+        self.assertIn('3 roads read, 1 other features skipped', self.output)
+        graph = get_graph()
+        # The one-way spur is dropped, which leaves one line with two ends
+        self.assertEqual(len(graph), 2)
+        self.assertEqual(graph.edge_count, 2)
+        self.assertEqual(graph.shape_lngs.tolist(), [33.0, 33.0, 33.1, 33.2])
+    
+    def test_route_follows_roads(self):
+        """Test routes run along the graph with distance and travel time"""
+        route = get_graph().route(33.0, -13.95, 33.1, -14.0)
+        self.assertEqual(
+            route['geometry']['coordinates'],
+            [[33.0, -13.95], [33.0, -14.0], [33.1, -14.0]]
+        )
+        self.assertAlmostEqual(route['distance_m'], 5559 + 10798, delta=20)
+        # 5.6 km at 15 km/h plus 10.8 km at 70 km/h
+        self.assertAlmostEqual(route['duration_s'], 1334 + 555, delta=10)
+    
+    def test_route_joins_road_between_vertices(self):
+        """Test points beside a long segment join it there instead of at a vertex"""
+        route = get_graph().route(33.05, -14.0001, 33.1, -14.0)
+        self.assertAlmostEqual(route['distance_m'], 11 + 5399, delta=20)
+        # 11 m on foot, then 5.4 km at 70 km/h
+        self.assertAlmostEqual(route['duration_s'], 8 + 278, delta=5)
+        self.assertAlmostEqual(route['geometry']['coordinates'][1][0], 33.05, places=6)
+    
+    def test_nearby_rank_by_travel_time(self):
+        """Test the farther facility on the fast road ranks first by travel time"""
+        params = {'lat': -14.0, 'lng': 33.0, 'radius': 50}
+        response = self.client.get('/api/facilities/nearby/', params)
+        self.assertEqual(response.data['facilities'][0]['name'], "Track Clinic")
+        
+        response = self.client.get('/api/facilities/nearby/', {**params, 'rank_by': 'travel_time'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [f['name'] for f in response.data['facilities']]
+        self.assertEqual(names, ["Road Hospital", "Track Clinic"])
+        self.assertAlmostEqual(response.data['facilities'][0]['travel_time_s'], 555, delta=5)
+    
+    def test_directions_include_route(self):
+        """Test directions report the road route next to the straight line"""
+        response = self.client.get(
+            f'/api/facilities/{self.road_hospital.id}/directions/', {'lat': -13.95, 'lng': 33.0}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['route']['geometry']['type'], 'LineString')
+        self.assertGreater(response.data['route']['distance_m'], response.data['distance']['meters'])
+    
+    def test_travel_time_needs_graph(self):
+        """Test travel time ranking is refused without a road graph"""
+        with override_settings(ROAD_GRAPH_FILE=self.graph_file + '.missing'):
+            response = self.client.get(
+                '/api/facilities/nearby/', {'lat': -14.0, 'lng': 33.0, 'rank_by': 'travel_time'}
+            )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+    
+    def _isochrones(self, facility, **params):
+        response = self.client.get(f'/api/facilities/{facility.id}/isochrone/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {
+            f['properties']['cutoff']: GEOSGeometry(json.dumps(f['geometry']))
+            for f in response.data['features']
+        }
+    
+    def test_isochrone_follows_roads(self):
+        """Test travel time areas stretch along the fast road"""
+        areas = self._isochrones(self.track_clinic, cutoffs='10,30')
+        on_primary = Point(33.05, -14.0, srid=4326)
+        self.assertFalse(areas[10].contains(on_primary))
+        self.assertTrue(areas[30].contains(on_primary))
+        # Far from any road, so out of reach on foot within 30 minutes
+        self.assertFalse(areas[30].contains(Point(33.05, -13.9, srid=4326)))
+    
+    def test_isochrone_cache_dropped_when_facility_moves(self):
+        """Test a moved facility gets areas around its new position"""
+        self._isochrones(self.track_clinic, cutoffs='10')
+        cache_dir = os.path.join(settings.FACILITY_CACHE_DIR, 'isochrones', str(self.track_clinic.id))
+        self.assertTrue(os.path.isdir(cache_dir))
+        
+        self.track_clinic.location = Point(33.2, -14.0, srid=4326)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.track_clinic.save()
+        self.assertFalse(os.path.isdir(cache_dir))
+        area = self._isochrones(self.track_clinic, cutoffs='10')[10]
+        self.assertTrue(area.contains(Point(33.15, -14.0, srid=4326)))
+    
+    def test_isochrone_cutoffs_rounded(self):
+        """Test nearby cutoffs share one rounded cutoff and cache file"""
+        areas = self._isochrones(self.track_clinic, cutoffs='14,15.01')
+        self.assertEqual(list(areas), [15.0])
+        cache_dir = os.path.join(settings.FACILITY_CACHE_DIR, 'isochrones', str(self.track_clinic.id))
+        files = [name for _, _, names in os.walk(cache_dir) for name in names]
+        self.assertEqual(len(files), 1)
+    
+    def test_isochrones_union(self):
+        """Test several facilities merge into one area per cutoff"""
+        ids = f'{self.track_clinic.id},{self.road_hospital.id}'
+        response = self.client.get('/api/facilities/isochrones/', {'cutoffs': '15', 'union': 1, 'ids': ids})
+        self.assertEqual(len(response.data['features']), 1)
+        properties = response.data['features'][0]['properties']
+        self.assertEqual(sorted(properties['facilities']), sorted([self.track_clinic.id, self.road_hospital.id]))
+    
+    def test_isochrones_compute_few_per_request(self):
+        """Test uncached facilities beyond the per-request cap are left pending"""
+        params = {'cutoffs': '15', 'ids': f'{self.track_clinic.id},{self.road_hospital.id}'}
+        with mock.patch('facilities.views.MAX_UNCACHED_ISOCHRONES', 1):
+            response = self.client.get('/api/facilities/isochrones/', params)
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(len(response.data['pending']), 1)
+            
+            response = self.client.get('/api/facilities/isochrones/', params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['features']), 2)
+    
+    def test_isochrone_search_budget(self):
+        """Test cutoffs beyond the defaults reaching too much of the road graph are refused"""
+        url = f'/api/facilities/{self.track_clinic.id}/isochrone/'
+        with mock.patch('facilities.isochrones.MAX_NODES', 1):
+            response = self.client.get(url, {'cutoffs': '90'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+    
+    def test_precompute_skips_large_isochrones(self):
+        """Test precompute_isochrones skips facilities over its budget and continues"""
+        out = StringIO()
+        call_command('precompute_isochrones', cutoffs='90', max_nodes=1, stdout=out)
+        self.assertIn(f'Skipping facility {self.track_clinic.id}', out.getvalue())
+        self.assertIn('Skipped: 2 facilities', out.getvalue())
+        
+        out = StringIO()
+        call_command('precompute_isochrones', cutoffs='90', stdout=out)
+        self.assertIn('Cached isochrones for 2 facilities', out.getvalue())
+    
+    def test_isochrone_without_graph(self):
+        """Test distance areas fall back to geodesic circles without a graph"""
+        with override_settings(ROAD_GRAPH_FILE=self.graph_file + '.missing'):
+            response = self.client.get(
+                f'/api/facilities/{self.road_hospital.id}/isochrone/', {'metric': 'distance', 'cutoffs': '5'}
+            )
+            properties = response.data['features'][0]['properties']
+            self.assertEqual(properties['method'], 'straight_line')
+            self.assertAlmostEqual(properties['area_km2'], 78.5, delta=0.5)
+            
+            response = self.client.get(f'/api/facilities/{self.road_hospital.id}/isochrone/')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class LoadFacilitiesCommandTest(TestCase):
+    """Test cases for the load_facilities management command"""
+    
+    def setUp(self):
+        HealthFacility.objects.create(
+            osm_id=1, name="Old Name", location=Point(33.0, -13.0, srid=4326)
+        )
+        features = [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [33.1, -13.1]},
+             'properties': {'osm_id': 1, 'name': 'New Name', 'district': '  Lilongwe ', 'beds': '12'}},
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [33.2, -13.2]},
+             'properties': {'osm_id': 2, 'amenity': 'clinic'}},
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [33.3, -13.3]},
+             'properties': {'osm_id': 2, 'amenity': 'hospital'}},
+            {'type': 'Feature', 'geometry': None, 'properties': {'osm_id': 3}},
+        ]
+        handle, self.path = tempfile.mkstemp(suffix='.geojson')
+        with os.fdopen(handle, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+        self.addCleanup(os.remove, self.path)
+    
+    def _load(self, *args):
+        out = StringIO()
+        call_command('load_facilities', '--file', self.path, *args, stdout=out)
+        return out.getvalue()
+    
+    def _check_result(self, output):
+        self.assertIn('Created: 1 facilities', output)
+        self.assertIn('Updated: 2 facilities', output)
+        self.assertIn('Skipped: 1 features', output)
+        facility = HealthFacility.objects.get(osm_id=1)
+        self.assertEqual(facility.name, 'New Name')
+        self.assertEqual(facility.district, 'Lilongwe')
+        self.assertEqual(facility.beds, 12)
+        self.assertEqual(HealthFacility.objects.get(osm_id=2).amenity, 'hospital')
+    
+    def test_row_import(self):
+        self._check_result(self._load())
+    
+    def test_bulk_import(self):
+        with CaptureQueriesContext(connection) as ctx:
+            output = self._load('--bulk', '--batch-size', '10')
+        self._check_result(output)
+        # One lookup, one INSERT and one UPDATE for the whole batch
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries]
+        self.assertEqual(statements.count('INSERT'), 1)
+        self.assertEqual(statements.count('UPDATE'), 1)
+    
+    def test_parallel_import(self):
+        self._check_result(self._load('--workers', '2', '--batch-size', '2'))
+    
+    def test_parallel_import_skips_out_of_range_values(self):
+        """Test values COPY would reject skip their feature instead of the import"""
+        features = [
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [33.4, -13.4]},
+             'properties': {'osm_id': 4, 'name': 'x' * 300}},
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [33.5, -13.5]},
+             'properties': {'osm_id': 5, 'beds': str(2 ** 31)}},
+            {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [33.6, -13.6]},
+             'properties': {'osm_id': 6, 'name': 'Valid Clinic'}},
+        ]
+        with open(self.path, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+        output = self._load('--workers', '2', '--batch-size', '2')
+        self.assertIn('Error processing feature 1: name is longer than 255 characters', output)
+        self.assertIn('Skipped: 2 features', output)
+        self.assertEqual(list(HealthFacility.objects.values_list('osm_id', flat=True).order_by('osm_id')), [1, 6])
+    
+    def test_clear_skips_row_signals(self):
+        """Test --clear deletes in one statement and reconnects the cache receivers"""
+        with CaptureQueriesContext(connection) as ctx:
+            self._load('--clear')
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries]
+        self.assertEqual(statements.count('DELETE'), 1)
+        self.assertEqual(HealthFacility.objects.count(), 2)
+        self.assertTrue(post_delete.has_listeners(HealthFacility))
+    
+    def test_delta_prune_report(self):
+        """Test a delta import leaves unchanged rows alone and prunes missing ones"""
+        for mode in ([], ['--bulk'], ['--workers', '2']):
+            self._load(*mode)
+            unchanged = HealthFacility.objects.get(osm_id=1)
+            extra = HealthFacility.objects.create(
+                osm_id=99, name="Closed Clinic", location=Point(33.5, -13.5, srid=4326)
+            )
+            report_path = self.path + '.report.json'
+            self.addCleanup(lambda: os.path.exists(report_path) and os.remove(report_path))
+            
+            output = self._load('--delta', '--prune', '--report', report_path, *mode)
+            self.assertIn('Deleted: 1 facilities', output)
+            self.assertEqual(HealthFacility.objects.get(osm_id=1).updated_at, unchanged.updated_at)
+            self.assertFalse(HealthFacility.objects.filter(osm_id=99).exists())
+            with open(report_path) as f:
+                report = json.load(f)
+            self.assertEqual(report['created'], [])
+            self.assertNotIn(unchanged.pk, report['updated'])
+            self.assertEqual(report['deleted'], [extra.pk])
+    
+    def test_delta_row_import_reads_hashes_per_batch(self):
+        """Test a delta row import looks up stored hashes for its features only"""
+        self._load()
+        with CaptureQueriesContext(connection) as ctx:
+            self._load('--delta')
+        selects = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+        self.assertTrue(any('"osm_id" IN (' in sql for sql in selects))
+        self.assertEqual([sql for sql in selects if 'WHERE' not in sql], [])
+    
+    def test_feature_reader_streams(self):
+        """Test features are read incrementally, whatever the chunk size"""
+        with open(self.path) as f:
+            expected = json.load(f)['features']
+        for chunk_size in (1, 7, 1 << 16):
+            reader = FeatureReader(self.path, chunk_size=chunk_size)
+            self.assertEqual(list(reader), expected)
+            self.assertEqual(reader.bytes_read, reader.total_bytes)
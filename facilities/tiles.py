@@ -0,0 +1,363 @@
+"""
+Mapbox Vector Tiles for health facilities.
+
+Tiles are rendered with ``ST_AsMVT`` on PostGIS and with a small pure-Python
+encoder on other backends. Only a handful of properties are written per zoom
+level so tile size stays roughly constant. Rendered tiles are cached on disk
+under FACILITY_CACHE_DIR/tiles/<data version>/, so any change to facility
+data starts a fresh cache; ``clear_tile_cache`` removes the stale ones.
+"""
+import math
+import os
+import shutil
+import struct
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.gis.geos import Polygon
+from django.db import connection
+
+from .cache import data_version
+from .models import HealthFacility
+
+
+LAYER_NAME = 'facilities'
+EXTENT = 4096
+MAX_ZOOM = 22
+# Pixels drawn beyond each tile edge so symbols and strokes are not cut off
+TILE_BUFFER = 64
+
+# (minimum zoom, properties written to each feature)
+TILE_PROPERTIES = [
+    (0, ['amenity']),
+    (8, ['name', 'amenity']),
+    (12, ['name', 'amenity', 'district', 'healthcare', 'emergency']),
+]
+
+
+def properties_for_zoom(z):
+    """Return the facility properties written to tiles at zoom ``z``"""
+    fields = TILE_PROPERTIES[0][1]
+    for min_zoom, zoom_fields in TILE_PROPERTIES:
+        if z >= min_zoom:
+            fields = zoom_fields
+    return fields
+
+
+def is_valid_tile(z, x, y):
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def tile_lnglat_bounds(z, x, y):
+    """Return (min_lng, min_lat, max_lng, max_lat) of an XYZ tile"""
+    n = 2 ** z
+
+    def lat(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def buffered_lnglat_bounds(z, x, y, buffer=TILE_BUFFER):
+    """Return the bounds of an XYZ tile widened by ``buffer`` pixels on each side"""
+    min_lng, min_lat, max_lng, max_lat = tile_lnglat_bounds(z, x, y)
+    margin_x = (max_lng - min_lng) * buffer / EXTENT
+    margin_y = (max_lat - min_lat) * buffer / EXTENT
+    return (
+        min_lng - margin_x, max(min_lat - margin_y, -90),
+        max_lng + margin_x, min(max_lat + margin_y, 90),
+    )
+
+
+def lnglat_to_tile_pixel(lng, lat, z, x, y, extent=EXTENT):
+    """Project a WGS84 coordinate to integer pixel coordinates inside a tile"""
+    n = 2 ** z
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    world_x = (lng + 180) / 360 * n
+    sin_lat = math.sin(math.radians(lat))
+    world_y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * n
+    return round((world_x - x) * extent), round((world_y - y) * extent)
+
+
+# --- Tile rendering -------------------------------------------------------
+
+def render_tile_postgis(z, x, y):
+    """Render a facility tile with ST_AsMVT"""
+    fields = properties_for_zoom(z)
+    columns = ', '.join(
+        'f.%s AS %s' % (
+            connection.ops.quote_name(HealthFacility._meta.get_field(name).column),
+            connection.ops.quote_name(name),
+        )
+        for name in fields
+    )
+    sql = f'''
+        WITH bounds AS (
+            SELECT ST_TileEnvelope(%s, %s, %s) AS geom,
+                   ST_TileEnvelope(%s, %s, %s, margin => %s) AS area
+        )
+        SELECT ST_AsMVT(tile, %s, %s, 'geom', 'id')
+        FROM (
+            SELECT f.id, {columns},
+                   ST_AsMVTGeom(ST_Transform(f.location, 3857), bounds.geom, %s, %s, true) AS geom
+            FROM {connection.ops.quote_name(HealthFacility._meta.db_table)} f, bounds
+            WHERE f.location && ST_Transform(bounds.area, 4326)
+        ) AS tile
+    '''
+    margin = TILE_BUFFER / EXTENT
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [z, x, y, z, x, y, margin, LAYER_NAME, EXTENT, EXTENT, TILE_BUFFER])
+        row = cursor.fetchone()
+    return bytes(row[0]) if row and row[0] else b''
+
+
+def render_tile_python(z, x, y):
+    """Render a facility tile without database vector tile support"""
+    fields = properties_for_zoom(z)
+    bounds = Polygon.from_bbox(buffered_lnglat_bounds(z, x, y))
+    rows = HealthFacility.objects.filter(location__intersects=bounds).values(
+        'id', 'location', *fields
+    )
+
+    features = []
+    for row in rows.iterator(chunk_size=2000):
+        location = row.pop('location')
+        features.append({
+            'id': row.pop('id'),
+            'geometry': lnglat_to_tile_pixel(location.x, location.y, z, x, y),
+            'properties': row,
+        })
+    if not features:
+        return b''
+    return encode_tile([(LAYER_NAME, features)])
+
+
+def render_tile(z, x, y):
+    if connection.vendor == 'postgresql':
+        return render_tile_postgis(z, x, y)
+    return render_tile_python(z, x, y)
+
+
+# --- Disk cache -----------------------------------------------------------
+
+def _cache_root():
+    return Path(settings.FACILITY_CACHE_DIR) / 'tiles'
+
+
+def get_tile(z, x, y):
+    """Return the MVT bytes for a tile, rendering and caching on a miss"""
+    version = data_version() or 'initial'
+    path = _cache_root() / version / str(z) / str(x) / f'{y}.mvt'
+    return cached_tile(path, lambda: render_tile(z, x, y))
+
+
+def cached_tile(path, render):
+    """Return the tile stored at ``path``, writing ``render()`` there on a miss"""
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        pass
+
+    tile = render()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    tmp_path.write_bytes(tile)
+    os.replace(tmp_path, path)
+    return tile
+
+
+def clear_tile_cache(keep_current=False):
+    """Delete cached tiles, optionally keeping the current data version"""
+    root = _cache_root()
+    if not root.exists():
+        return
+    current = data_version() or 'initial'
+    for entry in root.iterdir():
+        if keep_current and entry.name == current:
+            continue
+        shutil.rmtree(entry, ignore_errors=True)
+
+
+# --- Minimal MVT (protobuf) encoder ----------------------------------------
+# See https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+
+GEOM_POINT = 1
+GEOM_LINESTRING = 2
+GEOM_POLYGON = 3
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+
+
+def _varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field_number, wire_type):
+    return _varint((field_number << 3) | wire_type)
+
+
+def _length_delimited(field_number, payload):
+    return _key(field_number, 2) + _varint(len(payload)) + payload
+
+
+def _packed(field_number, values):
+    return _length_delimited(field_number, b''.join(_varint(v) for v in values))
+
+
+def _encode_value(value):
+    if isinstance(value, bool):
+        return _key(7, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(6, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _key(3, 1) + struct.pack('<d', value)
+    return _length_delimited(1, str(value).encode('utf-8'))
+
+
+def _command(command_id, count):
+    return command_id | (count << 3)
+
+
+class _Cursor:
+    """Pen position shared by every part of one feature's geometry"""
+    
+    def __init__(self):
+        self.x = self.y = 0
+    
+    def moves(self, points):
+        params = []
+        for px, py in points:
+            params.append(_zigzag(px - self.x))
+            params.append(_zigzag(py - self.y))
+            self.x, self.y = px, py
+        return params
+
+
+def _dedupe(points):
+    """Drop consecutive repeated pixels, which quantisation produces a lot of"""
+    out = []
+    for point in points:
+        point = tuple(point)
+        if not out or point != out[-1]:
+            out.append(point)
+    return out
+
+
+def _ring_area(ring):
+    """Twice the signed area of a ring in tile pixels (positive = exterior)"""
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]))
+
+
+def _point_geometry(points):
+    return [_command(CMD_MOVE_TO, len(points))] + _Cursor().moves(points)
+
+
+def _line_geometry(lines):
+    cursor = _Cursor()
+    commands = []
+    for line in lines:
+        line = _dedupe(line)
+        if len(line) < 2:
+            continue
+        commands.append(_command(CMD_MOVE_TO, 1))
+        commands += cursor.moves(line[:1])
+        commands.append(_command(CMD_LINE_TO, len(line) - 1))
+        commands += cursor.moves(line[1:])
+    return commands
+
+
+def _polygon_geometry(polygons):
+    """
+    Encode polygons given as lists of rings (exterior first). Rings are
+    rewound as the spec requires: exteriors clockwise on screen (positive
+    area in tile coordinates), holes the other way.
+    """
+    cursor = _Cursor()
+    commands = []
+    for rings in polygons:
+        for index, ring in enumerate(rings):
+            ring = _dedupe(ring)
+            if len(ring) > 1 and ring[0] == ring[-1]:
+                ring = ring[:-1]
+            area = _ring_area(ring) if len(ring) >= 3 else 0
+            if area == 0:
+                if index == 0:
+                    # Exterior collapsed to nothing at this zoom; skip its holes too
+                    break
+                continue
+            if (area > 0) != (index == 0):
+                ring = ring[::-1]
+            commands.append(_command(CMD_MOVE_TO, 1))
+            commands += cursor.moves(ring[:1])
+            commands.append(_command(CMD_LINE_TO, len(ring) - 1))
+            commands += cursor.moves(ring[1:])
+            commands.append(_command(CMD_CLOSE_PATH, 1))
+    return commands
+
+
+_GEOMETRY_ENCODERS = {
+    GEOM_POINT: _point_geometry,
+    GEOM_LINESTRING: _line_geometry,
+    GEOM_POLYGON: _polygon_geometry,
+}
+
+
+def encode_layer(name, features, extent=EXTENT):
+    """
+    Encode one layer. Each feature is a dict with ``id``, ``geometry`` and
+    ``properties``; null properties are omitted. ``type`` defaults to
+    GEOM_POINT, where the geometry is one pixel (x, y) or a list of them; for
+    GEOM_LINESTRING it is a list of lines and for GEOM_POLYGON a list of
+    polygons, each a list of rings of pixels. Features whose geometry
+    collapses to nothing are dropped.
+    """
+    keys, values = {}, {}
+    encoded_features = []
+    for feature in features:
+        geom_type = feature.get('type', GEOM_POINT)
+        geometry = feature['geometry']
+        if geom_type == GEOM_POINT and isinstance(geometry[0], int):
+            geometry = [geometry]
+        commands = _GEOMETRY_ENCODERS[geom_type](geometry)
+        if not commands:
+            continue
+        
+        tags = []
+        for key, value in feature['properties'].items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        body = _key(1, 0) + _varint(feature['id'])
+        if tags:
+            body += _packed(2, tags)
+        body += _key(3, 0) + _varint(geom_type)
+        body += _packed(4, commands)
+        encoded_features.append(_length_delimited(2, body))
+
+    layer = _key(15, 0) + _varint(2) + _length_delimited(1, name.encode('utf-8'))
+    layer += b''.join(encoded_features)
+    layer += b''.join(_length_delimited(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(_length_delimited(4, _encode_value(value)) for _, value in values)
+    layer += _key(5, 0) + _varint(extent)
+    return layer
+
+
+def encode_tile(layers):
+    """Encode ``[(layer_name, features), ...]`` as MVT bytes"""
+    return b''.join(
+        _length_delimited(3, encode_layer(name, features)) for name, features in layers
+    )
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import HealthFacilityViewSet
+from .views import HealthFacilityViewSet, facility_tile
 
 router = DefaultRouter()
 router.register(r'facilities', HealthFacilityViewSet, basename='facility')
 
 urlpatterns = [
+    path('facilities/tiles/<int:z>/<int:x>/<int:y>.mvt', facility_tile, name='facility-tile'),
     path('', include(router.urls)),
 ]
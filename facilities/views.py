@@ -1,18 +1,49 @@
+import base64
+import json
+import math
+
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
-from django.contrib.gis.geos import Point
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from django.conf import settings
+from django.contrib.gis.geos import Point, Polygon
 from django.contrib.gis.measure import D
-from django.contrib.gis.db.models.functions import Distance
-from django.db.models import Q
+from django.db.models import Count, Q
+from django.http import HttpResponse, StreamingHttpResponse
+from admin.models import ShapefileLayer
+from . import batch_nearest, matrix
+from .boundaries import locate as locate_boundaries
+from .cache import cached_result
+from .fast_serializers import FastFacilitySerializer, rows_in_order
+from .filters import iexact
+from .geodesy import inverse
+from .isochrones import (
+    MAX_FACILITIES as MAX_ISOCHRONE_FACILITIES,
+    MAX_UNCACHED as MAX_UNCACHED_ISOCHRONES,
+    IsochroneTooLarge,
+    NoRoadGraph,
+    facility_isochrones,
+    node_budget,
+    parse_cutoffs,
+    union_features,
+)
 from .models import HealthFacility
+from .nearby import annotate_distance, nearest, order_by_proximity, proximity, within_radius
+from .routing import TRAVEL_TIME_CANDIDATES, get_graph
+from .spatial_index import facilities_by_id, get_index
+from .spatial_join import count_by_feature, parse_polygon, within_layer, within_polygon
+from .streaming import STREAM_CHUNK_SIZE, iter_json_collection, stream_feature_collection
+from .tiles import get_tile, is_valid_tile
 from .serializers import (
     HealthFacilityListSerializer,
     HealthFacilityDetailSerializer,
     HealthFacilityGeoJSONSerializer,
     NearbyFacilitySerializer,
-    DirectionsSerializer
+    DirectionsSerializer,
+    requested_fields
 )
 
 
@@ -23,6 +54,104 @@ class HealthFacilityPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class HealthFacilityCursorPagination(BasePagination):
+    """
+    Keyset pagination for health facilities.
+    
+    Pages are ordered by (name, id), and each page starts after the key of
+    the previous one. There is no COUNT(*) and no OFFSET, so deep pages cost
+    the same as the first. When the view orders by distance from a point
+    (``view.proximity_origin``), the key is the KNN ``<->`` distance instead,
+    so every page is still read nearest-first from the geography GiST index.
+    A KNN scan cannot start partway, though: ``proximity > value`` filters
+    the scan, so a page by distance re-reads every nearer row and costs
+    grow with depth as they would with OFFSET.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        
+        origin = getattr(view, 'proximity_origin', None)
+        if origin is not None and 'distance' in queryset.query.annotations:
+            key = 'proximity'
+            queryset = queryset.annotate(proximity=proximity(origin))
+        else:
+            key = 'name'
+        queryset = queryset.order_by(key, 'id')
+        
+        cursor = self.decode_cursor(request, key)
+        if cursor is not None:
+            value, pk = cursor
+            queryset = queryset.filter(
+                Q(**{f'{key}__gt': value}) | Q(**{key: value, 'id__gt': pk})
+            )
+        
+        results = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            last = results[-1]
+            if isinstance(last, dict):
+                value, pk = last[key], last['id']
+            else:
+                value, pk = getattr(last, key), last.pk
+            self.next_cursor = (value, pk)
+        return results
+    
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+    
+    def decode_cursor(self, request, key):
+        """
+        Return the (value, pk) cursor of the request, checked against ``key``
+        so a hand-edited cursor fails here rather than in the query
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if key == 'proximity':
+            valid = (
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                and math.isfinite(value)
+            )
+        else:
+            valid = isinstance(value, str) and '\x00' not in value
+        if not valid or not isinstance(pk, int) or isinstance(pk, bool) or not 0 < pk < 2 ** 63:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+    
+    def encode_cursor(self, cursor):
+        return base64.urlsafe_b64encode(json.dumps(cursor).encode('ascii')).decode('ascii')
+    
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), 'page')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_cursor))
+    
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data
+        })
+
+
 class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for health facilities with comprehensive filtering options.
@@ -31,10 +160,17 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
     - GET /api/facilities/ - List all facilities
     - GET /api/facilities/{id}/ - Get facility details
     - GET /api/facilities/nearby/ - Find nearby facilities
+    - POST /api/facilities/nearest/ - k nearest facilities for many origins
+    - POST /api/facilities/matrix/ - Distances and bearings from many origins
     - GET /api/facilities/geojson/ - Get facilities in GeoJSON format
     - GET /api/facilities/districts/ - Get list of districts
     - GET /api/facilities/amenities/ - Get list of amenity types
     - GET /api/facilities/directions/ - Get directions to a facility
+    - GET /api/facilities/{id}/isochrone/ - Areas within travel times of a facility
+    - GET /api/facilities/isochrones/ - Isochrones for several facilities
+    - GET /api/facilities/feature-counts/ - Count facilities per layer feature
+    - GET /api/facilities/locate/ - Find the district and region containing a point
+    - GET /api/facilities/tiles/{z}/{x}/{y}.mvt - Get a Mapbox Vector Tile
     
     Query Parameters:
     - name: Filter by facility name (case-insensitive partial match)
@@ -44,12 +180,31 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
     - lat & lng: User's current location for distance calculations
     - radius: Search radius in kilometers (default: 50km)
     - max_distance: Maximum distance in kilometers
+    - bbox: Bounding box as min_lng,min_lat,max_lng,max_lat
+    - within: Polygon (WKT or GeoJSON) the facilities must lie in
+    - within_layer & feature: Shapefile layer id and feature fid to lie in
+      (any feature of the layer when feature is omitted)
     - emergency: Filter facilities with emergency services (yes/no)
     - wheelchair: Filter wheelchair accessible facilities (yes/no)
+    - pagination: 'cursor' for keyset pagination (follow the 'next' link)
+    - fields / omit: Comma-separated fields to include or leave out
     """
     
     queryset = HealthFacility.objects.all()
     pagination_class = HealthFacilityPagination
+    # Set by get_queryset when results are ordered by distance from lat/lng
+    proximity_origin = None
+    
+    @property
+    def paginator(self):
+        """Use keyset pagination when the client asks for it"""
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if params.get('pagination') == 'cursor' or 'cursor' in params:
+                self._paginator = HealthFacilityCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
     
     def get_serializer_class(self):
         """Return appropriate serializer based on action"""
@@ -57,10 +212,17 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
             return HealthFacilityDetailSerializer
         elif self.action == 'geojson':
             return HealthFacilityGeoJSONSerializer
-        elif self.action == 'nearby':
+        elif self.action in ('nearby', 'batch_nearest'):
             return NearbyFacilitySerializer
         return HealthFacilityListSerializer
     
+    def visible_layers(self):
+        """Shapefile layers this request may read; inactive ones are admin-only"""
+        layers = ShapefileLayer.objects.all()
+        if not self.request.user.is_staff:
+            layers = layers.filter(is_active=True)
+        return layers
+    
     def get_queryset(self):
         """Apply filters to the queryset"""
         queryset = HealthFacility.objects.all()
@@ -73,27 +235,64 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
         # Filter by district (case-insensitive)
         district = self.request.query_params.get('district', None)
         if district:
-            queryset = queryset.filter(district__iexact=district)
+            queryset = queryset.filter(iexact('district', district))
         
         # Filter by region
         region = self.request.query_params.get('region', None)
         if region:
-            queryset = queryset.filter(region__iexact=region)
+            queryset = queryset.filter(iexact('region', region))
         
         # Filter by amenity type
         amenity = self.request.query_params.get('amenity', None)
         if amenity:
-            queryset = queryset.filter(amenity__iexact=amenity)
+            queryset = queryset.filter(iexact('amenity', amenity))
         
         # Filter by emergency services
         emergency = self.request.query_params.get('emergency', None)
         if emergency:
-            queryset = queryset.filter(emergency__iexact=emergency)
+            queryset = queryset.filter(iexact('emergency', emergency))
         
         # Filter by wheelchair accessibility
         wheelchair = self.request.query_params.get('wheelchair', None)
         if wheelchair:
-            queryset = queryset.filter(wheelchair__iexact=wheelchair)
+            queryset = queryset.filter(iexact('wheelchair', wheelchair))
+        
+        # Filter by bounding box
+        bbox = self.request.query_params.get('bbox', None)
+        if bbox:
+            try:
+                min_lng, min_lat, max_lng, max_lat = [float(v) for v in bbox.split(',')]
+                index = get_index()
+                if index is not None:
+                    queryset = queryset.filter(
+                        pk__in=index.bbox(min_lng, min_lat, max_lng, max_lat).tolist()
+                    )
+                else:
+                    queryset = queryset.filter(
+                        location__within=Polygon.from_bbox((min_lng, min_lat, max_lng, max_lat))
+                    )
+            except (ValueError, TypeError):
+                pass
+        
+        # Filter by polygon
+        within = self.request.query_params.get('within', None)
+        if within:
+            try:
+                queryset = within_polygon(queryset, parse_polygon(within))
+            except ValueError as e:
+                raise ParseError({'error': str(e)})
+        
+        # Filter by a feature of an uploaded shapefile layer
+        layer_id = self.request.query_params.get('within_layer', None)
+        if layer_id:
+            feature = self.request.query_params.get('feature', None)
+            try:
+                layer_id, feature = int(layer_id), int(feature) if feature else None
+            except ValueError:
+                raise ParseError({'error': 'within_layer and feature must be integers'})
+            if not self.visible_layers().filter(pk=layer_id).exists():
+                raise NotFound('Shapefile layer not found')
+            queryset = within_layer(queryset, layer_id, feature)
         
         # Calculate distance from user's location
         lat = self.request.query_params.get('lat', None)
@@ -102,20 +301,58 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
         if lat and lng:
             try:
                 user_location = Point(float(lng), float(lat), srid=4326)
-                queryset = queryset.annotate(
-                    distance=Distance('location', user_location)
-                ).order_by('distance')
                 
                 # Filter by maximum distance
                 max_distance = self.request.query_params.get('max_distance', None)
                 if max_distance:
-                    queryset = queryset.filter(
-                        distance__lte=D(km=float(max_distance))
-                    )
+                    index = get_index()
+                    if index is not None:
+                        ids, _ = index.within(
+                            user_location.x, user_location.y, float(max_distance) * 1000
+                        )
+                        queryset = queryset.filter(pk__in=ids.tolist())
+                    else:
+                        queryset = within_radius(
+                            queryset, user_location, float(max_distance) * 1000
+                        )
+                
+                queryset = order_by_proximity(
+                    annotate_distance(queryset, user_location), user_location
+                )
+                self.proximity_origin = user_location
             except (ValueError, TypeError):
                 pass
         
-        return queryset
+        return self.select_requested_fields(queryset)
+    
+    def get_fast_serializer(self):
+        """
+        Return a FastFacilitySerializer mirroring this action's serializer,
+        or None when FACILITY_FAST_SERIALIZATION is off.
+        """
+        if not getattr(settings, 'FACILITY_FAST_SERIALIZATION', False):
+            return None
+        return FastFacilitySerializer(self.get_serializer_class(), self.get_serializer_context())
+    
+    def list(self, request, *args, **kwargs):
+        """List facilities, serializing values() rows when the fast path is on"""
+        fast = self.get_fast_serializer()
+        if not fast:
+            return super().list(request, *args, **kwargs)
+        
+        rows = fast.rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(fast.serialize(page))
+        return Response(fast.serialize(rows))
+    
+    def select_requested_fields(self, queryset):
+        """Fetch only the columns needed for ?fields= / ?omit= output"""
+        fields, omit = requested_fields(self.request)
+        if not fields and not omit:
+            return queryset
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        return queryset.only(*serializer.model_fields())
     
     @action(detail=False, methods=['get'])
     def nearby(self, request):
@@ -130,6 +367,8 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
         - radius: Search radius in kilometers (default: 50km)
         - amenity: Filter by amenity type
         - limit: Maximum number of results (default: 20)
+        - rank_by: 'distance' (default) or 'travel_time' to order by the
+          fastest route over the road graph
         """
         lat = request.query_params.get('lat')
         lng = request.query_params.get('lng')
@@ -144,31 +383,69 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
             user_location = Point(float(lng), float(lat), srid=4326)
             radius = float(request.query_params.get('radius', 50))  # Default 50km
             limit = int(request.query_params.get('limit', 20))
+            rank_by = request.query_params.get('rank_by', 'distance')
+            if rank_by not in ('distance', 'travel_time'):
+                raise ValueError("rank_by must be 'distance' or 'travel_time'")
+            
+            graph = None
+            fetch = limit
+            if rank_by == 'travel_time':
+                graph = get_graph()
+                if graph is None:
+                    return Response(
+                        {'error': 'Travel time ranking needs a road graph (see build_road_graph)'},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE
+                    )
+                # Rank the straight-line nearest candidates by travel time
+                fetch = max(limit, TRAVEL_TIME_CANDIDATES)
             
-            # Get facilities within radius
-            queryset = HealthFacility.objects.annotate(
-                distance=Distance('location', user_location)
-            ).filter(
-                distance__lte=D(km=radius)
-            ).order_by('distance')
+            queryset = self.select_requested_fields(HealthFacility.objects.all())
             
             # Apply amenity filter if provided
             amenity = request.query_params.get('amenity')
             if amenity:
-                queryset = queryset.filter(amenity__iexact=amenity)
+                queryset = queryset.filter(iexact('amenity', amenity))
             
-            # Limit results
-            queryset = queryset[:limit]
+            fast = self.get_fast_serializer()
+            index = get_index()
+            if index is not None:
+                # Answer from the in-memory index, then load just those rows
+                ids, distances = index.nearest(
+                    user_location.x, user_location.y, fetch,
+                    radius_m=radius * 1000, amenity=amenity
+                )
+                if fast:
+                    rows = fast.rows(queryset.filter(pk__in=ids.tolist()))
+                    facilities = rows_in_order(rows, ids, distances)
+                else:
+                    facilities = facilities_by_id(ids, distances, queryset)
+            else:
+                # Narrow by radius with ST_DWithin, then take the nearest with KNN
+                queryset = nearest(queryset, user_location, radius, fetch)
+                facilities = list(fast.rows(queryset) if fast else queryset)
             
-            serializer = self.get_serializer(queryset, many=True)
+            if graph is not None:
+                facilities, routes = _rank_by_travel_time(
+                    graph, user_location.x, user_location.y, facilities, limit
+                )
+            
+            if fast:
+                data = fast.serialize(facilities)
+            else:
+                data = self.get_serializer(facilities, many=True).data
+            if graph is not None:
+                for item, (duration, distance) in zip(data, routes):
+                    item['travel_time_s'] = round(duration, 1)
+                    item['travel_distance_m'] = round(distance, 2)
             return Response({
-                'count': len(queryset),
+                'count': len(facilities),
                 'radius_km': radius,
+                'rank_by': rank_by,
                 'user_location': {
                     'latitude': float(lat),
                     'longitude': float(lng)
                 },
-                'facilities': serializer.data
+                'facilities': data
             })
         
         except (ValueError, TypeError) as e:
@@ -177,43 +454,198 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    @action(detail=False, methods=['post'], url_path='nearest')
+    def batch_nearest(self, request):
+        """
+        Find the k nearest facilities for many origins in one request.
+        
+        Body (JSON):
+        - origins: List of {"lat", "lng", "id"} objects or [lng, lat] pairs
+        
+        Optional Body Fields:
+        - k: Facilities per origin (default: 5, at most 100)
+        - radius: Search radius in kilometers (default: 50km)
+        - amenity: Amenity type, or a list of types
+        
+        Results come back in the order of the origins. Requests with more
+        origins than one chunk (or ?stream=1) are streamed.
+        """
+        data = request.data
+        try:
+            lngs, lats, labels = batch_nearest.parse_origins(data.get('origins'))
+            k = int(data.get('k', 5))
+            radius = float(data.get('radius', 50))
+            amenity = data.get('amenity') or None
+            if not 1 <= k <= batch_nearest.MAX_K:
+                raise ValueError(f'k must be between 1 and {batch_nearest.MAX_K}')
+            if radius <= 0:
+                raise ValueError('radius must be positive')
+            if amenity is not None and not (
+                isinstance(amenity, str)
+                or (isinstance(amenity, list) and all(isinstance(a, str) for a in amenity))
+            ):
+                raise ValueError('amenity must be a string or a list of strings')
+        except (AttributeError, ValueError, TypeError) as e:
+            return Response(
+                {'error': f'Invalid parameters: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Built once per data version, even with FACILITY_SPATIAL_INDEX off
+        index = get_index(required=True)
+        
+        queryset = self.select_requested_fields(HealthFacility.objects.all())
+        fast = self.get_fast_serializer()
+        if fast:
+            def load(ids):
+                return {row['id']: row for row in fast.rows(queryset.filter(pk__in=ids))}
+            
+            def represent(row, distance):
+                return fast.to_representation({**row, 'distance': D(m=distance)})
+        else:
+            serializer = self.get_serializer()
+            
+            def load(ids):
+                return queryset.in_bulk(ids)
+            
+            def represent(facility, distance):
+                facility.distance = D(m=distance)
+                return serializer.to_representation(facility)
+        
+        results = batch_nearest.iter_nearest(
+            index, lngs, lats, labels, k, radius * 1000, amenity, load, represent
+        )
+        head = {'k': k, 'radius_km': radius}
+        if len(labels) > batch_nearest.CHUNK_SIZE or request.query_params.get('stream'):
+            return StreamingHttpResponse(
+                iter_json_collection(results, head, 'results'), content_type='application/json'
+            )
+        results = list(results)
+        return Response({**head, 'results': results, 'count': len(results)})
+    
+    @action(detail=False, methods=['post'])
+    def matrix(self, request):
+        """
+        Geodesic distances and initial bearings from many origins to many
+        facilities.
+        
+        Body (JSON):
+        - origins: List of {"lat", "lng", "id"} objects or [lng, lat] pairs
+        
+        Optional Body Fields:
+        - facilities: Facility ids (default: every facility matching the
+          list filters in the query string, e.g. ?amenity=hospital)
+        
+        Each row holds one origin's distances (m) and bearings (degrees
+        clockwise from north), in the order of the returned facilities.
+        At most 1,000,000 cells; large matrices (or ?stream=1) are streamed.
+        """
+        data = request.data
+        try:
+            lngs, lats, labels = batch_nearest.parse_origins(data.get('origins'))
+            ids = data.get('facilities')
+            if ids is not None:
+                if not isinstance(ids, list) or not ids:
+                    raise ValueError('facilities must be a non-empty list of ids')
+                ids = [int(pk) for pk in ids]
+        except (AttributeError, ValueError, TypeError) as e:
+            return Response(
+                {'error': f'Invalid parameters: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_facilities = matrix.MAX_CELLS // len(labels)
+        if ids is not None:
+            if len(ids) > max_facilities:
+                facilities = None
+            else:
+                by_id = {
+                    row[0]: row
+                    for row in HealthFacility.objects.filter(pk__in=ids).values_list('id', 'name', 'location')
+                }
+                missing = [pk for pk in ids if pk not in by_id]
+                if missing:
+                    raise NotFound(f'Facilities not found: {", ".join(map(str, missing[:20]))}')
+                facilities = [by_id[pk] for pk in ids]
+        else:
+            queryset = self.get_queryset().values_list('id', 'name', 'location')
+            facilities = list(queryset[:max_facilities + 1])
+            if len(facilities) > max_facilities:
+                facilities = None
+        if facilities is None:
+            return Response(
+                {'error': f'At most {matrix.MAX_CELLS} origin x facility cells are allowed per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        rows = matrix.iter_rows(
+            lngs, lats, labels,
+            [location.x for _, _, location in facilities],
+            [location.y for _, _, location in facilities],
+        )
+        head = {
+            'facilities': [
+                {'id': pk, 'name': name, 'latitude': location.y, 'longitude': location.x}
+                for pk, name, location in facilities
+            ],
+        }
+        if len(labels) * len(facilities) > matrix.STREAM_CELLS or request.query_params.get('stream'):
+            return StreamingHttpResponse(
+                iter_json_collection(rows, head, 'rows'), content_type='application/json'
+            )
+        rows = list(rows)
+        return Response({**head, 'rows': rows, 'count': len(rows)})
+    
     @action(detail=False, methods=['get'])
     def geojson(self, request):
         """
         Return facilities in GeoJSON format for mapping applications.
         Supports same filters as list endpoint.
+        
+        Pass stream=1 to stream every matching facility (no default limit)
+        without building the collection in memory.
         """
         queryset = self.get_queryset()
         
+        if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+            limit = request.query_params.get('limit')
+            if limit:
+                queryset = queryset[:int(limit)]
+            serializer = self.get_fast_serializer()
+            if serializer:
+                queryset = serializer.rows(queryset)
+            else:
+                serializer = HealthFacilityGeoJSONSerializer(context=self.get_serializer_context())
+            return stream_feature_collection(
+                serializer.to_representation(facility)
+                for facility in queryset.iterator(chunk_size=STREAM_CHUNK_SIZE)
+            )
+        
         # Limit results for performance
         limit = int(request.query_params.get('limit', 1000))
-        queryset = queryset[:limit]
         
-        serializer = HealthFacilityGeoJSONSerializer(
-            queryset, 
-            many=True,
-            context={'request': request}
-        )
+        fast = self.get_fast_serializer()
+        if fast:
+            facilities = list(fast.rows(queryset)[:limit])
+            features = fast.serialize(facilities)
+        else:
+            facilities = queryset[:limit]
+            features = HealthFacilityGeoJSONSerializer(
+                facilities, 
+                many=True,
+                context={'request': request}
+            ).data
         
         return Response({
             'type': 'FeatureCollection',
-            'count': len(queryset),
-            'features': serializer.data
+            'count': len(facilities),
+            'features': features
         })
     
     @action(detail=False, methods=['get'])
     def districts(self, request):
         """Get list of all districts with facility counts"""
-        districts = HealthFacility.objects.values('district').distinct().order_by('district')
-        
-        district_data = []
-        for d in districts:
-            if d['district']:
-                count = HealthFacility.objects.filter(district=d['district']).count()
-                district_data.append({
-                    'district': d['district'],
-                    'facility_count': count
-                })
+        district_data = cached_result('districts', lambda: _count_by('district'))
         
         return Response({
             'count': len(district_data),
@@ -223,16 +655,7 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'])
     def amenities(self, request):
         """Get list of all amenity types with counts"""
-        amenities = HealthFacility.objects.values('amenity').distinct().order_by('amenity')
-        
-        amenity_data = []
-        for a in amenities:
-            if a['amenity']:
-                count = HealthFacility.objects.filter(amenity=a['amenity']).count()
-                amenity_data.append({
-                    'amenity': a['amenity'],
-                    'facility_count': count
-                })
+        amenity_data = cached_result('amenities', lambda: _count_by('amenity'))
         
         return Response({
             'count': len(amenity_data),
@@ -250,6 +673,8 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
         
         Returns:
         - Straight-line distance and bearing
+        - Road route (distance, travel time and geometry) when a road graph
+          is available, else null
         - Facility coordinates
         - Google Maps and OpenStreetMap URLs
         """
@@ -264,25 +689,26 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
             )
         
         try:
-            user_location = Point(float(lng), float(lat), srid=4326)
+            if not (-90 <= float(lat) <= 90 and -180 <= float(lng) <= 180):
+                raise ValueError('coordinates out of range')
             
-            # Calculate distance
-            from django.contrib.gis.geos import Point as GEOSPoint
-            distance_m = user_location.distance(facility.location) * 111319.9  # Approximate conversion to meters
+            # Geodesic distance and initial bearing on the WGS84 ellipsoid
+            distance_m, bearing = inverse(
+                float(lng), float(lat), facility.longitude, facility.latitude
+            )
             distance_km = distance_m / 1000
             
-            # Calculate bearing (approximate)
-            import math
-            lat1 = math.radians(float(lat))
-            lat2 = math.radians(facility.latitude)
-            lng1 = math.radians(float(lng))
-            lng2 = math.radians(facility.longitude)
-            
-            dLon = lng2 - lng1
-            y = math.sin(dLon) * math.cos(lat2)
-            x = math.cos(lat1) * math.sin(lat2) - math.sin(lat1) * math.cos(lat2) * math.cos(dLon)
-            bearing = math.degrees(math.atan2(y, x))
-            bearing = (bearing + 360) % 360
+            # Shortest travel time over the local road graph
+            route = None
+            graph = get_graph()
+            if graph is not None:
+                route = graph.route(float(lng), float(lat), facility.longitude, facility.latitude)
+            if route is not None:
+                route = {
+                    'distance_m': round(route['distance_m'], 2),
+                    'duration_s': round(route['duration_s'], 1),
+                    'geometry': route['geometry'],
+                }
             
             # Generate navigation URLs
             google_maps_url = f"https://www.google.com/maps/dir/?api=1&origin={lat},{lng}&destination={facility.latitude},{facility.longitude}"
@@ -306,6 +732,7 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
                     'kilometers': round(distance_km, 2)
                 },
                 'bearing': round(bearing, 2),
+                'route': route,
                 'navigation_urls': {
                     'google_maps': google_maps_url,
                     'openstreetmap': osm_url
@@ -318,29 +745,243 @@ class HealthFacilityViewSet(viewsets.ReadOnlyModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
     
+    @action(detail=True, methods=['get'])
+    def isochrone(self, request, pk=None):
+        """
+        Areas within travel times (or distances) of a facility.
+        
+        Optional Parameters:
+        - metric: 'time' (default, minutes over the road graph) or
+          'distance' (km; road distance, or straight line without a graph)
+        - cutoffs: Comma-separated cutoffs (default: 15,30,60 minutes or
+          5,10,25 km)
+        
+        Returns a FeatureCollection with one polygon per cutoff.
+        """
+        facility = self.get_object()
+        return self._isochrone_response(request, [facility], union=False)
+    
     @action(detail=False, methods=['get'])
-    def stats(self, request):
-        """Get statistics about health facilities"""
-        total_facilities = HealthFacility.objects.count()
-        districts_count = HealthFacility.objects.values('district').distinct().count()
-        amenities_count = HealthFacility.objects.values('amenity').distinct().count()
-        
-        # Facilities by amenity type
-        amenity_breakdown = {}
-        for amenity in HealthFacility.objects.values('amenity').distinct():
-            if amenity['amenity']:
-                count = HealthFacility.objects.filter(amenity=amenity['amenity']).count()
-                amenity_breakdown[amenity['amenity']] = count
-        
-        # Facilities with emergency services
-        emergency_facilities = HealthFacility.objects.filter(
-            emergency__iexact='yes'
-        ).count()
+    def isochrones(self, request):
+        """
+        Isochrones for several facilities.
+        
+        Facilities are chosen with ids=1,2,3 or the list filters (e.g.
+        ?amenity=hospital&district=ZOMBA), up to 20 at a time. Only 3
+        facilities without cached isochrones are computed per request; if
+        more are missing the response is a 503 listing them as "pending",
+        and repeating the request computes the next ones.
         
+        Optional Parameters:
+        - metric, cutoffs: As for a single facility's isochrone
+        - union: 1 to merge all facilities into one area per cutoff
+        """
+        queryset = self.get_queryset()
+        ids = request.query_params.get('ids')
+        if ids:
+            try:
+                queryset = queryset.filter(pk__in=[int(pk) for pk in ids.split(',')])
+            except ValueError:
+                return Response(
+                    {'error': 'ids must be a comma-separated list of facility ids'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        facilities = list(queryset.only('id', 'location')[:MAX_ISOCHRONE_FACILITIES + 1])
+        if len(facilities) > MAX_ISOCHRONE_FACILITIES:
+            return Response(
+                {'error': f'At most {MAX_ISOCHRONE_FACILITIES} facilities are allowed per request; '
+                          'narrow the filters or pass ids'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        union = request.query_params.get('union', '').lower() in ('1', 'true', 'yes')
+        return self._isochrone_response(request, facilities, union)
+    
+    def _isochrone_response(self, request, facilities, union):
+        metric = request.query_params.get('metric', 'time')
+        try:
+            cutoffs = parse_cutoffs(request.query_params.get('cutoffs'), metric)
+        except ValueError as e:
+            return Response(
+                {'error': f'Invalid parameters: {str(e)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        features = []
+        pending = []
+        uncached = 0
+        try:
+            for facility in facilities:
+                args = (facility.pk, facility.longitude, facility.latitude, cutoffs, metric)
+                found = facility_isochrones(*args, compute=False)
+                if found is None and uncached < MAX_UNCACHED_ISOCHRONES:
+                    uncached += 1
+                    found = facility_isochrones(*args, max_nodes=node_budget(cutoffs, metric))
+                if found is None:
+                    pending.append(facility.pk)
+                else:
+                    features.extend(found)
+        except NoRoadGraph as e:
+            return Response(
+                {'error': f'{e}; use metric=distance for straight-line areas'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        except IsochroneTooLarge as e:
+            return Response(
+                {'error': f'Invalid parameters: {e}; use smaller cutoffs or cache them '
+                          'with precompute_isochrones'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if pending:
+            return Response(
+                {'error': f'Isochrones for {len(pending)} facilities are not cached yet; repeat the '
+                          f'request to compute the next {MAX_UNCACHED_ISOCHRONES}, or cache them '
+                          'with precompute_isochrones',
+                 'pending': pending},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        if union and features:
+            features = union_features(features, cutoffs, metric)
+        return Response({'type': 'FeatureCollection', 'features': features})
+    
+    @action(detail=False, methods=['get'], url_path='feature-counts')
+    def feature_counts(self, request):
+        """
+        Count facilities inside every feature of a shapefile layer. ``total``
+        counts each facility once, even where features overlap.
+        
+        Required Parameters:
+        - layer: Shapefile layer id (inactive layers are admin-only)
+        
+        Supports the same filters as the list endpoint (e.g. amenity).
+        """
+        try:
+            layer = self.visible_layers().only('id', 'name').get(pk=int(request.query_params.get('layer', '')))
+        except ValueError:
+            return Response(
+                {'error': 'layer must be a shapefile layer id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except ShapefileLayer.DoesNotExist:
+            raise NotFound('Shapefile layer not found')
+        
+        queryset = self.get_queryset()
+        counts = count_by_feature(queryset, layer.pk)
+        features = layer.features.values_list('fid', 'properties').order_by('fid')
         return Response({
-            'total_facilities': total_facilities,
-            'total_districts': districts_count,
-            'total_amenity_types': amenities_count,
-            'facilities_by_amenity': amenity_breakdown,
-            'emergency_facilities': emergency_facilities
+            'layer': layer.pk,
+            'name': layer.name,
+            'total': within_layer(queryset, layer.pk).count(),
+            'results': [
+                {'fid': fid, 'properties': properties, 'count': counts.get(fid, 0)}
+                for fid, properties in features
+            ],
         })
+    
+    @action(detail=False, methods=['get'])
+    def locate(self, request):
+        """
+        Find the district and region containing a point, from the shapefile
+        layers designated as boundary layers.
+        
+        Required Parameters:
+        - lat: Latitude
+        - lng: Longitude
+        """
+        try:
+            lat = float(request.query_params['lat'])
+            lng = float(request.query_params['lng'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'Latitude (lat) and longitude (lng) are required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({
+            'latitude': lat,
+            'longitude': lng,
+            **locate_boundaries(lng, lat),
+        })
+    
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Get statistics about health facilities"""
+        return Response(cached_result('stats', _facility_stats))
+
+
+def _rank_by_travel_time(graph, lng, lat, facilities, limit):
+    """
+    Order facilities (rows or instances) by travel time from a point and keep
+    the ``limit`` fastest reachable ones. Returns (facilities, routes) with
+    one (duration_s, distance_m) pair per facility kept.
+    """
+    coordinates = [
+        (f['longitude'], f['latitude']) if isinstance(f, dict) else (f.longitude, f.latitude)
+        for f in facilities
+    ]
+    positions, durations, distances = graph.fastest(
+        lng, lat, [c[0] for c in coordinates], [c[1] for c in coordinates], limit
+    )
+    return (
+        [facilities[position] for position in positions],
+        list(zip(durations, distances)),
+    )
+
+
+def _count_by(field):
+    """Facility counts per non-empty value of ``field``, in a single GROUP BY"""
+    rows = (
+        HealthFacility.objects
+        .exclude(**{f'{field}__isnull': True})
+        .exclude(**{field: ''})
+        .values(field)
+        .annotate(facility_count=Count('id'))
+        .order_by(field)
+    )
+    return [
+        {field: row[field], 'facility_count': row['facility_count']}
+        for row in rows
+    ]
+
+
+def _facility_stats():
+    """Totals for the stats endpoint from one conditional-aggregate pass"""
+    totals = HealthFacility.objects.aggregate(
+        total_facilities=Count('id'),
+        districts=Count('district', distinct=True),
+        null_districts=Count('id', filter=Q(district__isnull=True)),
+        amenities=Count('amenity', distinct=True),
+        null_amenities=Count('id', filter=Q(amenity__isnull=True)),
+        emergency_facilities=Count('id', filter=iexact('emergency', 'yes')),
+    )
+    
+    # Facilities by amenity type (shares the amenities endpoint's cache)
+    amenity_breakdown = {
+        row['amenity']: row['facility_count']
+        for row in cached_result('amenities', lambda: _count_by('amenity'))
+    }
+    
+    # A missing value counts as one more distinct value, as with .distinct()
+    return {
+        'total_facilities': totals['total_facilities'],
+        'total_districts': totals['districts'] + (1 if totals['null_districts'] else 0),
+        'total_amenity_types': totals['amenities'] + (1 if totals['null_amenities'] else 0),
+        'facilities_by_amenity': amenity_breakdown,
+        'emergency_facilities': totals['emergency_facilities']
+    }
+
+
+@api_view(['GET'])
+def facility_tile(request, z, x, y):
+    """
+    Return facilities in tile z/x/y as a Mapbox Vector Tile.
+    
+    Each tile holds a single 'facilities' layer; the properties written to
+    each feature grow with the zoom level (amenity, then name, then district,
+    healthcare and emergency).
+    """
+    if not is_valid_tile(z, x, y):
+        return Response(
+            {'error': f'Invalid tile coordinates: {z}/{x}/{y}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return HttpResponse(get_tile(z, x, y), content_type='application/vnd.mapbox-vector-tile')
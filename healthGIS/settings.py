@@ -161,6 +161,29 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Facility data caches (spatial index, tiles, aggregates) are invalidated
+# through version files kept in this directory
+FACILITY_CACHE_DIR = Path(os.getenv('FACILITY_CACHE_DIR', BASE_DIR / 'cache'))
+
+# Serve nearby/bbox queries from an in-process spatial index instead of PostGIS
+FACILITY_SPATIAL_INDEX = os.getenv('FACILITY_SPATIAL_INDEX', 'False').lower() in ('true', '1', 'yes')
+
+# Road graph written by the build_road_graph command; directions, travel time
+# ranking and isochrones use it when the file exists
+ROAD_GRAPH_FILE = Path(os.getenv('ROAD_GRAPH_FILE', BASE_DIR / 'cache' / 'road_graph.npz'))
+
+# Serialize list, nearby and geojson responses from values() rows instead of
+# model instances (same output, much less per-row overhead)
+FACILITY_FAST_SERIALIZATION = os.getenv('FACILITY_FAST_SERIALIZATION', 'True').lower() in ('true', '1', 'yes')
+
+# Threads that ingest uploaded shapefiles in the background; 0 runs each
+# ingest job in the request thread once its transaction commits
+SHAPEFILE_INGEST_WORKERS = int(os.getenv('SHAPEFILE_INGEST_WORKERS', '2'))
+
+# Chunked shapefile uploads are assembled here until they are finalized
+SHAPEFILE_UPLOAD_DIR = Path(os.getenv('SHAPEFILE_UPLOAD_DIR', BASE_DIR / 'media' / 'chunked_uploads'))
+SHAPEFILE_UPLOAD_MAX_SIZE = int(os.getenv('SHAPEFILE_UPLOAD_MAX_SIZE', str(2 * 1024 ** 3)))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -22,6 +22,7 @@ from django.conf.urls.static import static
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('facilities.urls')),
+    path('api/', include('admin.urls')),
 ]
 
 # Serve media files in development